@@ -0,0 +1,315 @@
+# Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as n
+import numpy.random as nr
+import ConfigParser as cfg
+import os
+from ordereddict import OrderedDict
+
+AUGMENT_SECTION = 'augment'
+# Output cases are transformed in chunks of this many, so that every chunk
+# is still in cache when the pointwise stages run over it
+CHUNK_SIZE = 256
+# Number of cases used to estimate channel statistics when the dataset meta file has none
+STATS_SAMPLE_SIZE = 2000
+
+class AugmentationError(Exception):
+    pass
+
+# An augmentation stage. Stages are configured by a single value each,
+# e.g. 'crop = 4' or 'brightness = 20'.
+#
+# Geometric stages (crop, flip) choose, for every output case, which part of
+# which input image it shows. Pointwise stages return an affine map
+# x -> x * scale + shift, where scale and shift broadcast against a
+# (channels, 1, 1, cases) array, plus an optional per-pixel shift that
+# broadcasts against (channels, height, width, 1). Any of the three may be None.
+#
+# Random stages are skipped when testing.
+class Stage:
+    geometric = False
+    random = True
+    def __init__(self, name, value):
+        self.name = name
+        try:
+            self.parse(value)
+        except ValueError:
+            raise AugmentationError("Augmentation stage '%s': invalid value '%s'" % (name, value))
+        
+    def parse(self, value):
+        self.value = float(value)
+        
+    def init(self, pipeline):
+        pass
+    
+    def get_affine(self, pipeline, num_cases):
+        return None, None, None
+    
+    @staticmethod
+    def uniform(amount, shape):
+        return n.single(nr.uniform(-amount, amount, size=shape))
+    
+# Random crops of (size - 2 * border) pixels; the center crop when testing
+class CropStage(Stage):
+    geometric = True
+    random = False
+    def parse(self, value):
+        self.value = int(value)
+        if self.value < 0:
+            raise ValueError()
+    
+# Horizontal flips with the given probability
+class FlipStage(Stage):
+    geometric = True
+    
+# Adds a random value in [-value, value] to all pixels of an image
+class BrightnessStage(Stage):
+    def get_affine(self, pipeline, num_cases):
+        return None, self.uniform(self.value, (1, 1, 1, num_cases)), None
+    
+# Scales the difference from the mean pixel value by a random factor in
+# [1 - value, 1 + value]. The mean is that of the data as transformed by the
+# stages before this one, so that e.g. mean-subtracted images are scaled
+# around zero.
+class ContrastStage(Stage):
+    def get_affine(self, pipeline, num_cases):
+        factor = 1 + self.uniform(self.value, (1, 1, 1, num_cases))
+        return factor, pipeline.curr_mean * (1 - factor), None
+    
+# Scales every channel of an image by its own random factor in [1 - value, 1 + value]
+class JitterStage(Stage):
+    def get_affine(self, pipeline, num_cases):
+        return 1 + self.uniform(self.value, (pipeline.num_colors, 1, 1, num_cases)), None, None
+    
+# PCA lighting noise: shifts the color of an image along each principal component
+# of the pixel colors by a normal random amount with standard deviation value
+# (in units of the standard deviation along that component)
+class LightingStage(Stage):
+    def init(self, pipeline):
+        evals, self.evecs = n.linalg.eigh(pipeline.color_cov)
+        self.stdevs = n.sqrt(n.maximum(evals, 0))
+        
+    def get_affine(self, pipeline, num_cases):
+        alpha = nr.normal(0, self.value, size=(pipeline.num_colors, num_cases))
+        shift = n.dot(self.evecs, alpha * self.stdevs[:, n.newaxis])
+        return None, n.single(shift.reshape(pipeline.num_colors, 1, 1, num_cases)), None
+    
+# Subtracts the mean image ('pixel', cropped at the center like the images)
+# or the mean of every channel ('channel')
+class MeanStage(Stage):
+    random = False
+    def parse(self, value):
+        if value not in ('pixel', 'channel'):
+            raise ValueError()
+        self.value = value
+        
+    def get_affine(self, pipeline, num_cases):
+        if self.value == 'pixel':
+            return None, None, -pipeline.get_cropped_mean()
+        return None, -pipeline.color_mean.reshape(pipeline.num_colors, 1, 1, 1), None
+    
+# Divides every channel by its standard deviation (if value is true)
+class StdStage(Stage):
+    random = False
+    def parse(self, value):
+        self.value = value.lower() in ('true', '1')
+        
+    def get_affine(self, pipeline, num_cases):
+        if not self.value:
+            return None, None, None
+        return 1 / pipeline.color_std.reshape(pipeline.num_colors, 1, 1, 1), None, None
+
+stage_types = OrderedDict([('crop', CropStage), ('flip', FlipStage), ('brightness', BrightnessStage),
+                           ('contrast', ContrastStage), ('jitter', JitterStage), ('lighting', LightingStage),
+                           ('mean', MeanStage), ('std', StdStage)])
+
+# Batched augmentation of images stored as (channels * size * size, cases) matrices.
+#
+# The stages are declared in the [augment] section of a config file, one line
+# per stage:
+#
+# [augment]
+# crop=4
+# flip=0.5
+# brightness=20
+# lighting=0.1
+# mean=pixel
+#
+# Geometric stages always run first. They are fused into a single gather from
+# the input batch. The pointwise stages run in the given order but are composed
+# into as few affine maps as possible, so every chunk of output cases is
+# written once by the gather and then updated while it's still in cache.
+#
+# With multiview=True (for testing), every image yields num_views outputs:
+# five crops (the corners and the center), each also flipped. Output case
+# v * numCases + i is view v of input case i.
+class AugmentationPipeline:
+    def __init__(self, stages, num_colors, img_size, data_mean=None, sample=None, test=False, multiview=False):
+        self.stages = [stage_types[t](t, v) for t, v in stages]
+        self.num_colors, self.img_size = num_colors, img_size
+        self.test, self.multiview = test, multiview
+        self.border = sum(s.value for s in self.stages if isinstance(s, CropStage))
+        self.inner_size = img_size - 2 * self.border
+        if self.inner_size <= 0:
+            raise AugmentationError("Crop border %d leaves nothing of %dx%d images" % (self.border, img_size, img_size))
+        self.flip = 0 if test else sum(s.value for s in self.stages if isinstance(s, FlipStage))
+        self.num_views = 10 if multiview else 1
+        self.pointwise = [s for s in self.stages if not s.geometric and not (test and s.random)]
+        self.__init_stats(data_mean, sample)
+        for s in self.stages:
+            s.init(self)
+    
+    @classmethod
+    def from_config(cls, path, *args, **kwargs):
+        if not os.path.exists(path):
+            raise AugmentationError("Augmentation config file '%s' does not exist" % path)
+        mcp = cfg.SafeConfigParser(dict_type=OrderedDict)
+        mcp.read([path])
+        if not mcp.has_section(AUGMENT_SECTION):
+            raise AugmentationError("Augmentation config file '%s' has no [%s] section" % (path, AUGMENT_SECTION))
+        stages = mcp.items(AUGMENT_SECTION)
+        for t, v in stages:
+            if t not in stage_types:
+                raise AugmentationError("Unknown augmentation stage '%s'; known stages: %s" % (t, ", ".join(stage_types.keys())))
+        return cls(stages, *args, **kwargs)
+    
+    # Channel statistics for the stages that need them. data_mean is the
+    # (channels * size * size, 1) mean image; sample is a batch of input images.
+    def __init_stats(self, data_mean, sample):
+        if data_mean is None and sample is not None:
+            data_mean = sample.mean(axis=1)
+        self.data_mean = None if data_mean is None else n.single(data_mean).reshape(self.num_colors, self.img_size, self.img_size, 1)
+        need_mean = any(isinstance(s, (ContrastStage, MeanStage)) for s in self.stages)
+        need_sample = any(isinstance(s, (LightingStage, StdStage)) for s in self.stages)
+        if need_mean and self.data_mean is None:
+            raise AugmentationError("Augmentation stages %s need the data mean" % ", ".join(s.name for s in self.stages))
+        if need_sample and sample is None:
+            raise AugmentationError("Augmentation stages %s need sample data" % ", ".join(s.name for s in self.stages))
+        if self.data_mean is not None:
+            self.color_mean = self.data_mean.reshape(self.num_colors, -1).mean(axis=1)
+        if need_sample:
+            pixels = n.single(sample[:, :STATS_SAMPLE_SIZE]).reshape(self.num_colors, -1)
+            self.color_cov = n.cov(pixels)
+            self.color_std = n.single(n.sqrt(n.diag(self.color_cov)))
+    
+    def get_cropped_mean(self):
+        b = self.border
+        return self.data_mean[:, b:b + self.inner_size, b:b + self.inner_size, :]
+    
+    def get_output_dims(self):
+        return self.inner_size**2 * self.num_colors
+    
+    # Whether the same image comes out differently every time
+    def is_random(self):
+        return not self.test and (self.border > 0 or self.flip > 0 or any(s.random for s in self.pointwise))
+    
+    # For each output case: the input case, the top-left corner of its crop, and whether it's flipped
+    def __get_geometry(self, num_cases):
+        cases = n.arange(num_cases)
+        border2 = 2 * self.border
+        if self.multiview:
+            corners = [(0, 0), (0, border2), (self.border, self.border), (border2, 0), (border2, border2)]
+            corners = corners * 2
+            src = n.tile(cases, 10)
+            ys = n.repeat([c[0] for c in corners], num_cases)
+            xs = n.repeat([c[1] for c in corners], num_cases)
+            flips = n.repeat([False] * 5 + [True] * 5, num_cases)
+        elif self.test:
+            src, ys, xs, flips = cases, n.zeros(num_cases, dtype=n.int) + self.border, n.zeros(num_cases, dtype=n.int) + self.border, n.zeros(num_cases, dtype=n.bool)
+        else:
+            src = cases
+            ys, xs = nr.randint(0, border2 + 1, size=num_cases), nr.randint(0, border2 + 1, size=num_cases)
+            flips = nr.rand(num_cases) < self.flip
+        return src, ys, xs, flips
+    
+    # Composes the pointwise stages into affine maps (scale, shift, pixel_shift).
+    # A per-pixel shift can't be followed by a per-case scale without becoming
+    # as big as the batch, so such a scale starts a new map.
+    #
+    # While a stage's map is made, self.curr_mean holds the mean pixel value
+    # of the data mean image under the maps of the stages before it, per case
+    # where those are random. Averaging over pixels commutes with the maps, so
+    # it follows the channel means through them.
+    def __get_affine_maps(self, num_cases):
+        maps = []
+        scale, shift, pixel_shift = None, None, None
+        channel_means = None
+        if self.data_mean is not None:
+            channel_means = self.get_cropped_mean().mean(axis=2).mean(axis=1).reshape(self.num_colors, 1, 1, 1)
+        for s in self.pointwise:
+            self.curr_mean = None if channel_means is None else channel_means.mean(axis=0)[n.newaxis]
+            a, b, p = s.get_affine(self, num_cases)
+            if channel_means is not None:
+                channel_means = channel_means * (1 if a is None else a) + (0 if b is None else b)
+                if p is not None:
+                    channel_means = channel_means + p.mean(axis=2).mean(axis=1).reshape(self.num_colors, 1, 1, 1)
+            if a is not None and pixel_shift is not None and a.shape[-1] > 1:
+                maps += [(scale, shift, pixel_shift)]
+                scale, shift, pixel_shift = None, None, None
+            if a is not None:
+                scale = a if scale is None else scale * a
+                shift = None if shift is None else shift * a
+                pixel_shift = None if pixel_shift is None else pixel_shift * a
+            if b is not None:
+                shift = b if shift is None else shift + b
+            if p is not None:
+                pixel_shift = p if pixel_shift is None else pixel_shift + p
+        maps += [(scale, shift, pixel_shift)]
+        return [m for m in maps if any(a is not None for a in m)]
+    
+    # Augments data, a (channels * size * size, cases) matrix of any type.
+    # Writes the result to target, a single-precision (get_output_dims(), cases * num_views)
+    # matrix, which is allocated if not given. Returns target.
+    def apply(self, data, target=None):
+        num_cases = data.shape[1]
+        num_out = num_cases * self.num_views
+        if target is None:
+            target = n.empty((self.get_output_dims(), num_out), dtype=n.single)
+        assert target.shape == (self.get_output_dims(), num_out) and target.dtype == n.single and target.flags.c_contiguous
+        x = data.reshape(self.num_colors, self.img_size, self.img_size, num_cases)
+        y = target.reshape(self.num_colors, self.inner_size, self.inner_size, num_out)
+        src, ys, xs, flips = self.__get_geometry(num_cases)
+        maps = self.__get_affine_maps(num_out)
+        inner = n.arange(self.inner_size)
+        for start in xrange(0, num_out, CHUNK_SIZE):
+            c = slice(start, min(num_out, start + CHUNK_SIZE))
+            csrc, cys, cxs, cflips = src[c], ys[c], xs[c], flips[c]
+            if (csrc == csrc[0] + n.arange(len(csrc))).all() and (cys == cys[0]).all() and (cxs == cxs[0]).all() and (cflips == cflips[0]).all():
+                # The whole chunk is one crop of consecutive cases, so plain slicing does it
+                pic = x[:, cys[0]:cys[0] + self.inner_size, cxs[0]:cxs[0] + self.inner_size, csrc[0]:csrc[-1] + 1]
+                y[..., c] = pic[:, :, ::-1, :] if cflips[0] else pic
+            else:
+                rows = cys[n.newaxis, :] + inner[:, n.newaxis]
+                cols = cxs[n.newaxis, :] + n.where(cflips[n.newaxis, :], self.inner_size - 1 - inner[:, n.newaxis], inner[:, n.newaxis])
+                y[..., c] = x[:, rows[:, n.newaxis, :], cols[n.newaxis, :, :], csrc[n.newaxis, n.newaxis, :]]
+            yc = y[..., c]
+            for scale, shift, pixel_shift in maps:
+                if scale is not None:
+                    yc *= scale[..., c] if scale.shape[-1] > 1 else scale
+                if shift is not None:
+                    yc += shift[..., c] if shift.shape[-1] > 1 else shift
+                if pixel_shift is not None:
+                    yc += pixel_shift
+        return target
@@ -0,0 +1,117 @@
+# Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as n
+import numpy.random as nr
+import multiprocessing as mp
+import ctypes
+import traceback as tb
+from collections import deque
+
+class AugmentationPoolError(Exception):
+    pass
+
+# A ring of batch buffers in shared memory, filled by worker processes.
+#
+# Every buffer holds a (data_dims, cases) data matrix and a (1, cases) label
+# matrix of up to max_cases cases. The workers are forked when the pool is
+# created, so they share the buffers and see the state of the process at
+# that point (in particular the dataset). Only buffer indices go over the
+# queues; the batches themselves are written in place.
+#
+# fill(epoch, batch_idx, data, labels) is called in a worker to produce a
+# batch into the given buffer views.
+#
+# The consumer requests batches in the order it wants them and gets them back
+# in that order. A buffer that has been handed out stays in use until it is
+# released with release().
+class AugmentationWorkerPool:
+    def __init__(self, fill, num_workers, num_buffers, data_dims, max_cases):
+        if num_buffers < 3:
+            raise AugmentationPoolError("The pool needs at least 3 buffers, got %d" % num_buffers)
+        self.fill = fill
+        self.data_dims, self.max_cases = data_dims, max_cases
+        self.buffers = [(mp.RawArray(ctypes.c_float, data_dims * max_cases), mp.RawArray(ctypes.c_float, max_cases)) for i in xrange(num_buffers)]
+        self.free = deque(xrange(num_buffers))
+        self.pending = deque() # (buffer, number of cases) in request order
+        self.ready = set()
+        self.task_queue, self.done_queue = mp.Queue(), mp.Queue()
+        self.workers = [mp.Process(target=self.__work) for i in xrange(num_workers)]
+        for w in self.workers:
+            w.daemon = True
+            w.start()
+            
+    def __get_views(self, buf, num_cases):
+        data, labels = self.buffers[buf]
+        return (n.frombuffer(data, dtype=n.single, count=self.data_dims * num_cases).reshape(self.data_dims, num_cases),
+                n.frombuffer(labels, dtype=n.single, count=num_cases).reshape(1, num_cases))
+    
+    # Runs in the worker processes
+    def __work(self):
+        nr.seed() # otherwise every worker makes the same random choices
+        while True:
+            task = self.task_queue.get()
+            if task is None:
+                break
+            buf, num_cases, epoch, batch_idx = task
+            try:
+                self.fill(epoch, batch_idx, *self.__get_views(buf, num_cases))
+                self.done_queue.put((buf, None))
+            except Exception:
+                self.done_queue.put((buf, tb.format_exc()))
+                
+    def has_free_buffer(self):
+        return len(self.free) > 0
+    
+    # Queues the production of a batch of num_cases cases into a free buffer
+    def request(self, epoch, batch_idx, num_cases):
+        if num_cases > self.max_cases:
+            raise AugmentationPoolError("Batch of %d cases does not fit in buffers of %d cases" % (num_cases, self.max_cases))
+        buf = self.free.popleft()
+        self.pending.append((buf, num_cases))
+        self.task_queue.put((buf, num_cases, epoch, batch_idx))
+        
+    # Waits for the oldest requested batch and returns (buffer, data, labels)
+    def get(self):
+        if not self.pending:
+            raise AugmentationPoolError("No batch has been requested")
+        buf, num_cases = self.pending.popleft()
+        while buf not in self.ready:
+            done, error = self.done_queue.get()
+            if error is not None:
+                raise AugmentationPoolError("Augmentation worker failed:\n%s" % error)
+            self.ready.add(done)
+        self.ready.remove(buf)
+        return (buf,) + self.__get_views(buf, num_cases)
+    
+    # Returns a buffer handed out by get() to the ring
+    def release(self, buf):
+        self.free.append(buf)
+        
+    def stop(self):
+        for w in self.workers:
+            self.task_queue.put(None)
+        for w in self.workers:
+            w.join()
+        self.workers = []
@@ -0,0 +1,229 @@
+# Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import zlib
+import struct
+from collections import deque
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+# A compressed container in which the data is split into fixed-size blocks that
+# are compressed independently. This lets blocks be compressed and decompressed
+# in parallel (zlib releases the GIL), and lets any byte range be read without
+# decompressing the whole file.
+#
+# Layout:
+#     header: magic, format version, block size
+#     compressed blocks, back to back
+#     index: (file offset, compressed size, uncompressed size) of every block
+#     footer: index offset, number of blocks, magic
+
+CHUNK_MAGIC = 'CCNB'
+CHUNK_VERSION = 1
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+HEADER = struct.Struct('<4sBI')
+INDEX_ENTRY = struct.Struct('<QII')
+FOOTER = struct.Struct('<QQ4s')
+
+class ChunkFileError(Exception):
+    pass
+
+def default_num_threads():
+    try:
+        return cpu_count()
+    except NotImplementedError:
+        return 1
+
+class ChunkFileWriter:
+    """
+    A write-only file object. Data written to it is cut into blocks of block_size bytes
+    which are compressed by a pool of num_threads threads. At most 2 * num_threads
+    blocks are held in memory at any time.
+    """
+    def __init__(self, filename, block_size=DEFAULT_BLOCK_SIZE, num_threads=None, level=6):
+        self.fo = open(filename, 'wb')
+        self.block_size = block_size
+        self.level = level
+        self.num_threads = num_threads or default_num_threads()
+        self.pool = ThreadPool(self.num_threads)
+        self.buf, self.buf_size = [], 0
+        self.pending = deque()
+        self.index = []
+        self.fo.write(HEADER.pack(CHUNK_MAGIC, CHUNK_VERSION, block_size))
+        
+    def write(self, s):
+        self.buf += [s]
+        self.buf_size += len(s)
+        if self.buf_size >= self.block_size:
+            data = ''.join(self.buf)
+            # Everything past the last full block stays in the buffer
+            end = len(data) - len(data) % self.block_size
+            for start in xrange(0, end, self.block_size):
+                self._submit(data[start:start + self.block_size])
+            self.buf = [data[end:]]
+            self.buf_size = len(data) - end
+            
+    def _submit(self, block):
+        self.pending.append((len(block), self.pool.apply_async(zlib.compress, (block, self.level))))
+        while len(self.pending) > 2 * self.num_threads:
+            self._write_next()
+        
+    def _write_next(self):
+        size, result = self.pending.popleft()
+        cblock = result.get()
+        self.index += [(self.fo.tell(), len(cblock), size)]
+        self.fo.write(cblock)
+        
+    def close(self):
+        if self.fo is None:
+            return
+        if self.buf_size > 0:
+            self._submit(''.join(self.buf))
+        self.buf, self.buf_size = [], 0
+        while len(self.pending) > 0:
+            self._write_next()
+        self.pool.close()
+        self.pool.join()
+        index_offset = self.fo.tell()
+        self.fo.write(''.join(INDEX_ENTRY.pack(*entry) for entry in self.index))
+        self.fo.write(FOOTER.pack(index_offset, len(self.index), CHUNK_MAGIC))
+        self.fo.close()
+        self.fo = None
+        
+class ChunkFileReader:
+    """
+    A read-only, seekable file object over a file written by ChunkFileWriter.
+    While reading sequentially, the next num_threads blocks are decompressed
+    in parallel ahead of the read position.
+    """
+    def __init__(self, filename, num_threads=None):
+        self.fo = open(filename, 'rb')
+        try:
+            magic, version, self.block_size = HEADER.unpack(self.fo.read(HEADER.size))
+            if magic != CHUNK_MAGIC or version != CHUNK_VERSION:
+                raise ChunkFileError("'%s' is not a version %d chunk file" % (filename, CHUNK_VERSION))
+            self.fo.seek(-FOOTER.size, 2)
+            index_offset, num_blocks, magic = FOOTER.unpack(self.fo.read(FOOTER.size))
+            if magic != CHUNK_MAGIC:
+                raise ChunkFileError("Chunk file '%s' is truncated" % filename)
+            self.fo.seek(index_offset)
+            index = self.fo.read(num_blocks * INDEX_ENTRY.size)
+            if len(index) != num_blocks * INDEX_ENTRY.size:
+                raise ChunkFileError("Chunk file '%s' is truncated" % filename)
+        except struct.error:
+            raise ChunkFileError("Chunk file '%s' is truncated" % filename)
+        self.index = [INDEX_ENTRY.unpack_from(index, i * INDEX_ENTRY.size) for i in xrange(num_blocks)]
+        # Uncompressed offset of every block, plus the total size at the end
+        self.starts = [0]
+        for offset, csize, size in self.index:
+            self.starts += [self.starts[-1] + size]
+        self.size = self.starts[-1]
+        self.num_threads = num_threads or default_num_threads()
+        self.pool = ThreadPool(self.num_threads) if self.num_threads > 1 else None
+        self.pending = {}
+        self.pos = 0
+        self.block_idx, self.block = -1, ''
+        
+    def _read_compressed(self, idx):
+        offset, csize, size = self.index[idx]
+        self.fo.seek(offset)
+        return self.fo.read(csize)
+    
+    def _get_block(self, idx):
+        if idx == self.block_idx:
+            return self.block
+        if self.pool is None:
+            block = zlib.decompress(self._read_compressed(idx))
+        else:
+            # Schedule this block and the ones after it, then drop any that the
+            # read position has skipped past
+            for i in xrange(idx, min(idx + self.num_threads, len(self.index))):
+                if i not in self.pending:
+                    self.pending[i] = self.pool.apply_async(zlib.decompress, (self._read_compressed(i),))
+            block = self.pending.pop(idx).get()
+            for i in [i for i in self.pending if i < idx]:
+                del self.pending[i]
+        self.block_idx, self.block = idx, block
+        return block
+    
+    def _find_block(self, pos):
+        lo, hi = 0, len(self.index) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) / 2
+            if self.starts[mid] <= pos:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+    
+    def read(self, size=-1):
+        end = self.size if size < 0 else min(self.size, self.pos + size)
+        parts = []
+        while self.pos < end:
+            idx = self._find_block(self.pos)
+            block = self._get_block(idx)
+            start = self.pos - self.starts[idx]
+            part = block[start:start + end - self.pos]
+            parts += [part]
+            self.pos += len(part)
+        return parts[0] if len(parts) == 1 else ''.join(parts)
+    
+    def readline(self, size=-1):
+        parts = []
+        while self.pos < self.size and size != 0:
+            idx = self._find_block(self.pos)
+            block = self._get_block(idx)
+            start = self.pos - self.starts[idx]
+            stop = block.find('\n', start)
+            stop = len(block) if stop < 0 else stop + 1
+            if size > 0:
+                stop = min(stop, start + size)
+                size -= stop - start
+            parts += [block[start:stop]]
+            self.pos += stop - start
+            if parts[-1].endswith('\n'):
+                break
+        return ''.join(parts)
+    
+    def read_range(self, start, end):
+        self.seek(start)
+        return self.read(end - start)
+    
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += self.size
+        self.pos = max(0, min(pos, self.size))
+        
+    def tell(self):
+        return self.pos
+    
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.pending = {}
+        self.fo.close()
@@ -26,6 +26,12 @@ from data import *
 import numpy.random as nr
 import numpy as n
 import random as r
+import math as m
+from augment import AugmentationPipeline
+from augpool import AugmentationWorkerPool
+from collections import deque
+import atexit
+from whiten import load_whitening, apply_whitening
 
 class CIFARDataProvider(LabeledMemoryDataProvider):
     def __init__(self, data_dir, batch_range, init_epoch=1, init_batchnum=None, dp_params={}, test=False):
@@ -63,26 +69,32 @@ class CroppedCIFARDataProvider(LabeledMemoryDataProvider):
         self.border_size = dp_params['crop_border']
         self.inner_size = 32 - self.border_size*2
         self.multiview = dp_params['multiview_test'] and test
+        self.lazy_views = self.multiview and dp_params.get('lazy_views', False)
         self.num_views = 5*2
-        self.data_mult = self.num_views if self.multiview else 1
+        self.data_mult = self.num_views if self.multiview and not self.lazy_views else 1
         self.num_colors = 3
         
         for d in self.data_dic:
-            d['data'] = n.require(d['data'], requirements='C')
+            d['data'] = n.require(d['data'], dtype=n.single if self.lazy_views else None, requirements='C')
             d['labels'] = n.require(n.tile(d['labels'].reshape((1, d['data'].shape[1])), (1, self.data_mult)), requirements='C')
         
-        self.cropped_data = [n.zeros((self.get_data_dims(), self.data_dic[0]['data'].shape[1]*self.data_mult), dtype=n.single) for x in xrange(2)]
+        stages = [('crop', self.border_size), ('flip', 0.5), ('mean', 'pixel')]
+        self.pipeline = AugmentationPipeline(stages, self.num_colors, 32, data_mean=self.batch_meta['data_mean'], test=test, multiview=self.multiview)
+        if not self.lazy_views:
+            self.cropped_data = [n.zeros((self.get_data_dims(), self.data_dic[0]['data'].shape[1]*self.data_mult), dtype=n.single) for x in xrange(2)]
 
         self.batches_generated = 0
-        self.data_mean = self.batch_meta['data_mean'].reshape((3,32,32))[:,self.border_size:self.border_size+self.inner_size,self.border_size:self.border_size+self.inner_size].reshape((self.get_data_dims(), 1))
+        self.data_mean = self.pipeline.get_cropped_mean().reshape((self.get_data_dims(), 1))
 
     def get_next_batch(self):
         epoch, batchnum, datadic = LabeledMemoryDataProvider.get_next_batch(self)
+        # The CPU backend makes the views itself with self.pipeline
+        if self.lazy_views:
+            return epoch, batchnum, [datadic['data'], datadic['labels']]
 
         cropped = self.cropped_data[self.batches_generated % 2]
 
-        self.__trim_borders(datadic['data'], cropped)
-        cropped -= self.data_mean
+        self.pipeline.apply(datadic['data'], target=cropped)
         self.batches_generated += 1
         return epoch, batchnum, [cropped, datadic['labels']]
         
@@ -96,30 +108,150 @@ class CroppedCIFARDataProvider(LabeledMemoryDataProvider):
     def get_plottable_data(self, data):
         return n.require((data + self.data_mean).T.reshape(data.shape[1], 3, self.inner_size, self.inner_size).swapaxes(1,3).swapaxes(1,2) / 255.0, dtype=n.single)
     
-    def __trim_borders(self, x, target):
-        y = x.reshape(3, 32, 32, x.shape[1])
+# Square images of any size and number of colors, augmented by the pipeline
+# in the file given by --aug-config (see augment.py). The image geometry comes
+# from the 'img_size' and 'num_colors' keys of the batches.meta file; without
+# them, the images are assumed to have 3 colors.
+#
+# With --aug-workers, the augmentation runs in that many worker processes
+# which write batches ahead into shared buffers (see augpool.py). A buffer is
+# recycled after finish_batch, or at the latest when get_next_batch is called
+# for the second time after it was returned.
+#
+# For multiview testing on the CPU backend (lazy_views), the batches hold the
+# uncropped images once and the backend makes the views with the pipeline.
+class AugmentedDataProvider(LabeledMemoryDataProvider):
+    def __init__(self, data_dir, batch_range=None, init_epoch=1, init_batchnum=None, dp_params=None, test=False):
+        LabeledMemoryDataProvider.__init__(self, data_dir, batch_range, init_epoch, init_batchnum, dp_params, test)
+        if not dp_params.get('aug_config'):
+            raise DataProviderException("The augmented data provider needs an augmentation config file (--aug-config)")
+        data_dims = self.data_dic[0]['data'].shape[0]
+        self.num_colors = self.batch_meta.get('num_colors', 3)
+        self.img_size = self.batch_meta.get('img_size', int(round(m.sqrt(data_dims / self.num_colors))))
+        if self.img_size**2 * self.num_colors != data_dims:
+            raise DataProviderException("Data dimensionality %d is not that of %dx%d images with %d colors" % (data_dims, self.img_size, self.img_size, self.num_colors))
+        self.multiview = dp_params.get('multiview_test', False) and test
+        sample = self.data_dic[0]['data']
+        self.pipeline = AugmentationPipeline.from_config(dp_params['aug_config'], self.num_colors, self.img_size,
+                                                         data_mean=self.batch_meta.get('data_mean'), sample=sample,
+                                                         test=test, multiview=self.multiview)
+        self.inner_size = self.pipeline.inner_size
+        self.num_views = self.pipeline.num_views
+        self.lazy_views = self.multiview and dp_params.get('lazy_views', False)
+        self.data_mult = self.num_views if self.multiview and not self.lazy_views else 1
 
-        if self.test: # don't need to loop over cases
-            if self.multiview:
-                start_positions = [(0,0),  (0, self.border_size*2),
-                                   (self.border_size, self.border_size),
-                                  (self.border_size*2, 0), (self.border_size*2, self.border_size*2)]
-                end_positions = [(sy+self.inner_size, sx+self.inner_size) for (sy,sx) in start_positions]
-                for i in xrange(self.num_views/2):
-                    pic = y[:,start_positions[i][0]:end_positions[i][0],start_positions[i][1]:end_positions[i][1],:]
-                    target[:,i * x.shape[1]:(i+1)* x.shape[1]] = pic.reshape((self.get_data_dims(),x.shape[1]))
-                    target[:,(self.num_views/2 + i) * x.shape[1]:(self.num_views/2 +i+1)* x.shape[1]] = pic[:,:,::-1,:].reshape((self.get_data_dims(),x.shape[1]))
-            else:
-                pic = y[:,self.border_size:self.border_size+self.inner_size,self.border_size:self.border_size+self.inner_size, :] # just take the center for now
-                target[:,:] = pic.reshape((self.get_data_dims(), x.shape[1]))
-        else:
-            for c in xrange(x.shape[1]): # loop over cases
-                startY, startX = nr.randint(0,self.border_size*2 + 1), nr.randint(0,self.border_size*2 + 1)
-                endY, endX = startY + self.inner_size, startX + self.inner_size
-                pic = y[:,startY:endY,startX:endX, c]
-                if nr.randint(2) == 0: # also flip the image with 50% probability
-                    pic = pic[:,:,::-1]
-                target[:,c] = pic.reshape((self.get_data_dims(),))
+        for d in self.data_dic:
+            d['data'] = n.require(d['data'], dtype=n.single if self.lazy_views else None, requirements='C')
+            d['labels'] = n.require(n.tile(d['labels'].reshape((1, d['data'].shape[1])), (1, self.data_mult)), dtype=n.single, requirements='C')
+        self.augmented_data = [None, None]
+        self.batches_generated = 0
+        
+        self.pool = None
+        num_workers = dp_params.get('aug_workers', 0)
+        if num_workers > 0 and not self.lazy_views:
+            num_buffers = dp_params.get('aug_buffers', 0) or num_workers + 2
+            max_cases = max(d['data'].shape[1] for d in self.data_dic) * self.data_mult
+            self.pool = AugmentationWorkerPool(self.fill_batch, num_workers, num_buffers, self.get_data_dims(), max_cases)
+            atexit.register(self.pool.stop)
+            self.pool_cursor = None # (epoch, batch_idx) of the next batch to request from the pool
+            self.held_buffers = deque() # buffers returned by get_next_batch but not yet finished
+        
+    # Augments the batch at batch_idx of the given epoch into data and labels.
+    # Runs in the pool's worker processes.
+    def fill_batch(self, epoch, batch_idx, data, labels):
+        dic = self.get_batch_dic(batch_idx, epoch)
+        self.pipeline.apply(dic['data'], target=data)
+        labels[:] = dic['labels']
+    
+    # The number of cases of the batch at batch_idx of the given epoch, which
+    # the sampler deals from a window of source batches when shuffling
+    def __get_num_cases(self, epoch, batch_idx):
+        if self.sampler is not None:
+            batch_idx = self.sampler.get_source_idx(epoch, batch_idx)
+        return self.data_dic[batch_idx]['data'].shape[1]
+    
+    def __request_batches(self):
+        if self.pool_cursor is None:
+            self.pool_cursor = (self.curr_epoch, self.batch_idx)
+        while self.pool.has_free_buffer():
+            epoch, batch_idx = self.pool_cursor
+            self.pool.request(epoch, batch_idx, self.__get_num_cases(epoch, batch_idx) * self.data_mult)
+            batch_idx = (batch_idx + 1) % len(self.batch_range)
+            self.pool_cursor = (epoch + (batch_idx == 0), batch_idx)
+            
+    def __get_pooled_batch(self):
+        while len(self.held_buffers) >= 2:
+            self.pool.release(self.held_buffers.popleft())
+        self.__request_batches()
+        buf, data, labels = self.pool.get()
+        self.held_buffers.append(buf)
+        epoch, batchnum = self.curr_epoch, self.curr_batchnum
+        self.advance_batch()
+        return epoch, batchnum, [data, labels]
+    
+    def get_next_batch(self):
+        if self.pool is not None:
+            return self.__get_pooled_batch()
+        epoch, batchnum, datadic = LabeledMemoryDataProvider.get_next_batch(self)
+        if self.lazy_views:
+            return epoch, batchnum, [datadic['data'], datadic['labels']]
+        
+        # Alternate between two output buffers, since the previous batch may still be in use
+        i = self.batches_generated % 2
+        num_out = datadic['data'].shape[1] * self.data_mult
+        if self.augmented_data[i] is None or self.augmented_data[i].shape[1] != num_out:
+            self.augmented_data[i] = n.empty((self.get_data_dims(), num_out), dtype=n.single)
+        self.pipeline.apply(datadic['data'], target=self.augmented_data[i])
+        self.batches_generated += 1
+        return epoch, batchnum, [self.augmented_data[i], datadic['labels']]
+    
+    def finish_batch(self):
+        if self.pool is not None and self.held_buffers:
+            self.pool.release(self.held_buffers.popleft())
+    
+    def get_data_dims(self, idx=0):
+        return self.pipeline.get_output_dims() if idx == 0 else 1
+    
+    # Approximately undoes the deterministic stages, for plotting
+    def get_plottable_data(self, data):
+        data = data.T.reshape(data.shape[1], self.num_colors, self.inner_size, self.inner_size)
+        data = data - data.min(axis=3).min(axis=2).min(axis=1)[:, n.newaxis, n.newaxis, n.newaxis]
+        data /= max(data.max(), 1e-6)
+        return n.require(data.swapaxes(1,3).swapaxes(1,2), dtype=n.single)
+    
+# Whitened data. Either the batches were written pre-whitened (by whiten.py
+# --output-path), or the data directory holds a whitening transform (fit by
+# whiten.py), which is applied to every batch once, when it's loaded.
+class WhitenedDataProvider(LabeledMemoryDataProvider):
+    def __init__(self, data_dir, batch_range=None, init_epoch=1, init_batchnum=None, dp_params=None, test=False):
+        LabeledMemoryDataProvider.__init__(self, data_dir, batch_range, init_epoch, init_batchnum, dp_params, test)
+        self.transform = None
+        if not self.batch_meta.get('whitened'):
+            self.transform = load_whitening(data_dir)
+            if self.transform is None:
+                raise DataProviderException("%s has neither whitened batches nor a whitening transform (see whiten.py)" % data_dir)
+        for d in self.data_dic:
+            if self.transform is not None:
+                d['data'] = apply_whitening(self.transform, d['data'])
+            d['data'] = n.require(d['data'], dtype=n.single, requirements='C')
+            d['labels'] = n.require(d['labels'].reshape((1, d['data'].shape[1])), dtype=n.single, requirements='C')
+        self.num_vis = self.data_dic[0]['data'].shape[0]
+            
+    def get_next_batch(self):
+        epoch, batchnum, datadic = LabeledMemoryDataProvider.get_next_batch(self)
+        return epoch, batchnum, [datadic['data'], datadic['labels']]
+    
+    def get_data_dims(self, idx=0):
+        return self.num_vis if idx == 0 else 1
+    
+    # Whitened images aren't in [0, 255], so every image is stretched to [0, 1]
+    def get_plottable_data(self, data):
+        num_colors = self.batch_meta.get('num_colors', 3)
+        img_size = self.batch_meta.get('img_size', int(round(m.sqrt(self.num_vis / num_colors))))
+        data = data.T.reshape(data.shape[1], num_colors, img_size, img_size)
+        data = data - data.min(axis=3).min(axis=2).min(axis=1)[:, n.newaxis, n.newaxis, n.newaxis]
+        data /= n.maximum(data.max(axis=3).max(axis=2).max(axis=1), 1e-6)[:, n.newaxis, n.newaxis, n.newaxis]
+        return n.require(data.swapaxes(1,3).swapaxes(1,2), dtype=n.single)
     
 class DummyConvNetDataProvider(LabeledDummyDataProvider):
     def __init__(self, data_dim):
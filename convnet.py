@@ -32,27 +32,151 @@ import sys
 import math as m
 import layer as lay
 from convdata import *
+from metrics import MetricsLog, MetricsLogError
+from multiprocessing import Process
+import featcache as fc
+import schedule
+import cpunet
+from sampler import get_stratified_sample, get_confidence_halfwidth
 from os import linesep as NL
 #import pylab as pl
 
+# Sampled tests (--test-sample-width) take at least this many rounds, since
+# the spread of a few rounds says little about the variance
+MIN_SAMPLE_ROUNDS = 5
+
 class ConvNet(IGPUModel):
     def __init__(self, op, load_dic, dp_params={}):
         filename_options = []
         dp_params['multiview_test'] = op.get_value('multiview_test')
         dp_params['crop_border'] = op.get_value('crop_border')
+        # The CPU backend makes the test views from the uncropped images
+        dp_params['lazy_views'] = 'cpu' in op.options and op.get_value('cpu') and dp_params['multiview_test']
+        for name in ('shuffle', 'shuffle_window', 'shuffle_seed', 'aug_config', 'aug_workers', 'aug_buffers', 'shared_data'):
+            if name in op.options: # not in checkpoints made before these options existed
+                dp_params[name] = op.get_value(name)
         IGPUModel.__init__(self, "ConvNet", op, load_dic, filename_options, dp_params=dp_params)
         
+    def use_cpu(self):
+        return 'cpu' in self.op.options and self.op.get_value('cpu')
+    
+    def get_gpus(self):
+        if self.use_cpu():
+            self.device_ids = [-1]
+        else:
+            IGPUModel.get_gpus(self)
+        
     def import_model(self):
+        if self.use_cpu():
+            print "========================="
+            print "Using the NumPy CPU backend"
+            self.libmodel = cpunet.CPUModel()
+            return
         lib_name = "pyconvnet" if is_windows_machine() else "_ConvNet"
         print "========================="
         print "Importing %s C++ module" % lib_name
         self.libmodel = __import__(lib_name) 
         
     def init_model_lib(self):
+        layers = self.layers
+        if 'frozen_cache' in self.op.options and self.op.get_value('frozen_cache') and not self.check_grads:
+            try:
+                layers = self.init_frozen_prefix()
+            except (ModelStateException, fc.FeatureCacheError), e:
+                print e
+                sys.exit(1)
+        try:
+            self.libmodel.initModel(layers, self.minibatch_size, self.device_ids[0])
+        except cpunet.CPUModelError, e:
+            print e
+            sys.exit(1)
+        self.libmodel.setStrictArrays(self.strict_arrays)
+        self.num_array_copies = self.libmodel.getArrayCopyStats()[0]
+        if self.use_cpu():
+            self.num_arena_allocs = self.libmodel.getArenaStats()[0]
+        
+    def print_model_state(self):
+        schedule.print_backward_report(self.layers)
+        
+    # Computes the outputs of the frozen prefix of the net (see featcache.py)
+    # once per batch, and sets the model up to train only the layers above it
+    # on those. Returns the layers of that suffix.
+    def init_frozen_prefix(self):
+        frozen = fc.get_frozen_layers(self.layers)
+        frontier = fc.get_frontier(self.layers, frozen)
+        if not frontier:
+            print "No frozen layers below the trainable ones; not caching."
+            return self.layers
+        if getattr(self.train_data_provider, 'sampler', None) is not None:
+            raise ModelStateException("The outputs of frozen layers can't be cached when shuffling cases across batches (--shuffle)")
+        pipeline = getattr(self.train_data_provider, 'pipeline', None)
+        if pipeline is not None and pipeline.is_random():
+            print "Warning: the training batches are augmented randomly, but the frozen layers' outputs are cached for one augmentation of every batch, which every epoch will train on"
+        dp_key = sorted((k, v) for k, v in self.dp_params.iteritems() if k not in ('convnet', 'lazy_views'))
+        cache = fc.FeatureCache(self.op.get_value('frozen_cache'), self.layers, frozen, (self.data_path, self.dp_type, dp_key))
+        print "Frozen layers: %s" % ", ".join(self.layers[i]['name'] for i in sorted(frozen))
+        print "Caching outputs of layer(s) %s in %s" % (", ".join(self.layers[i]['name'] for i in frontier), cache.path)
+        suffix, sources, index_map = fc.make_suffix_layers(self.layers, frozen, frontier)
+        
+        # The C++ module can hold only one model per process, so the full net runs in a child process
+        child = Process(target=self.fill_frozen_cache, args=(cache, sources))
+        child.start()
+        child.join()
+        if child.exitcode != 0:
+            raise ModelStateException("Unable to compute the outputs of the frozen layers")
+        
+        self.train_data_provider = fc.FrozenPrefixDataProvider(self.train_data_provider, cache, 'train', self.layers, sources)
+        self.test_data_provider = fc.FrozenPrefixDataProvider(self.test_data_provider, cache, 'test', self.layers, sources)
+        if self.op.get_value('logreg_name'):
+            self.logreg_idx = index_map[self.logreg_idx]
+        return suffix
+    
+    # Runs in a child process. Writes the data sources of the suffix of the net
+    # (the outputs of the frontier layers, and the labels) for all train and
+    # test batches that aren't in the cache yet.
+    def fill_frozen_cache(self, cache, sources):
         self.libmodel.initModel(self.layers, self.minibatch_size, self.device_ids[0])
+        # The suffix of the net takes the frontier outputs of all views, not images to make them from
+        dp_params = dict(self.dp_params, aug_workers=0, lazy_views=False)
+        names = [fc.get_source_name(self.layers, src) for src in sources]
+        for kind, batch_range in (('train', self.train_batch_range), ('test', self.test_batch_range)):
+            missing = [b for b in batch_range if not all(cache.has(kind, b, name) for name in names)]
+            if not missing:
+                continue
+            dp = DataProvider.get_instance(self.data_path, missing, type=self.dp_type, dp_params=dp_params, test=(kind == 'test'))
+            for b in missing:
+                epoch, batchnum, data = self.parse_batch_data(dp.get_next_batch(), train=(kind == 'train'))
+                for (s, i), name in zip(sources, names):
+                    if s == 'data':
+                        cache.write(kind, batchnum, name, data[i].T)
+                        continue
+                    ftrs = n.zeros((data[0].shape[1], self.layers[i]['outputs']), dtype=n.single)
+                    self.libmodel.startFeatureWriter(data + [ftrs], i)
+                    self.finish_batch()
+                    cache.write(kind, batchnum, name, ftrs)
+                dp.finish_batch()
+                print "Cached %s batch %d" % (kind, batchnum)
+                sys.stdout.flush()
+        
+    # Keeps the per-batch training costs in a MetricsLog, converting the
+    # plain list used by new models and older checkpoints.
+    def init_train_outputs(self):
+        ms = self.model_state
+        if type(ms['train_outputs']) == list:
+            ms['train_outputs'] = MetricsLog.from_list(ms['train_outputs'])
+        else:
+            log_dir = self.load_file if os.path.isdir(self.load_file) else os.path.dirname(self.load_file)
+            try:
+                missing = ms['train_outputs'].attach(log_dir)
+            except MetricsLogError, e:
+                raise ModelStateException(e)
+            if missing > 0:
+                num_rows = len(ms['train_outputs'])
+                print "Warning: %s has the training costs of only %d of %d batches; continuing without the rest" % (os.path.join(log_dir, MetricsLog.FILE_NAME), num_rows, num_rows + missing)
         
     def init_model_state(self):
         ms = self.model_state
+        self.init_train_outputs()
         if self.load_file:
             ms['layers'] = lay.LayerParser.parse_layers(self.layer_def, self.layer_params, self, ms['layers'])
         else:
@@ -112,8 +236,13 @@ class ConvNet(IGPUModel):
         data = batch_data[2]
         if self.check_grads:
             self.libmodel.checkGradients(data)
+        elif self.use_cpu() and self.op.get_value('cpu_bench') > 0:
+            self.libmodel.benchmark(data, self.op.get_value('cpu_bench'))
         elif not train and self.multiview_test:
-            self.libmodel.startMultiviewTest(data, self.train_data_provider.num_views, self.logreg_idx)
+            if getattr(self.test_data_provider, 'lazy_views', False):
+                self.libmodel.startMultiviewTest(data, self.test_data_provider.num_views, self.logreg_idx, self.test_data_provider.pipeline)
+            else:
+                self.libmodel.startMultiviewTest(data, self.train_data_provider.num_views, self.logreg_idx)
         else:
             self.libmodel.startBatch(data, not train)
         
@@ -122,6 +251,24 @@ class ConvNet(IGPUModel):
         
     def print_train_time(self, compute_time_py):
         print "(%.3f sec)" % (compute_time_py)
+        self.print_array_copies()
+        if self.use_cpu():
+            self.print_arena_allocs()
+        
+    # Arrays given to the C++ module are copied if they're not contiguous
+    def print_array_copies(self):
+        num_copies, num_bytes = self.libmodel.getArrayCopyStats()
+        if num_copies > self.num_array_copies:
+            print "Warning: %d non-contiguous data arrays copied (%.2f MB copied in total). Use --strict-arrays to find them." % (num_copies - self.num_array_copies, num_bytes / 1024.0**2)
+        self.num_array_copies = num_copies
+        
+    # The CPU backend reuses its arrays from minibatch to minibatch, so it
+    # should allocate only on the first batches
+    def print_arena_allocs(self):
+        num_allocs, num_bytes = self.libmodel.getArenaStats()
+        if num_allocs > self.num_arena_allocs:
+            print "CPU backend allocated %d arrays (%.2f MB allocated in total)" % (num_allocs - self.num_arena_allocs, num_bytes / 1024.0**2)
+        self.num_arena_allocs = num_allocs
         
     def print_costs(self, cost_outputs):
         costs, num_cases = cost_outputs[0], cost_outputs[1]
@@ -144,6 +291,9 @@ class ConvNet(IGPUModel):
         print "======================Test output======================"
         self.print_costs(self.test_outputs[-1])
         print ""
+        if getattr(self, 'test_ci', None) is not None:
+            print "Sampled %d test cases; 95%% confidence intervals: %s" % (self.test_outputs[-1][1],
+                  ", ".join("%s: %s" % (name, ", ".join("+-%6f" % h for h in self.test_ci[name])) for name in sorted(self.test_ci)))
         print "-------------------------------------------------------", 
         for i,l in enumerate(self.layers): # This is kind of hacky but will do for now.
             if 'weights' in l:
@@ -155,7 +305,95 @@ class ConvNet(IGPUModel):
                 print "%sLayer '%s' biases: %e [%e]" % (NL, l['name'], n.mean(n.abs(l['biases'])), n.mean(n.abs(l['biasesInc']))),
         print ""
         
+    def save_state(self):
+        checkpoint_dir = self.get_checkpoint_dir()
+        if not os.path.exists(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+        # The checkpoint only refers to the training costs written here
+        self.train_outputs.flush(os.path.join(checkpoint_dir, MetricsLog.FILE_NAME))
+        IGPUModel.save_state(self)
+        
+    # With --test-sample-width, the net is tested --test-full-freq times per
+    # --test-freq batches. Those tests estimate the test costs from a sample
+    # of the test cases (see get_sampled_test_error), except every --test-freq
+    # batches and after the last batch, when a checkpoint is due: then the
+    # whole test range is tested and the checkpoint saved.
+    def sampling_tests(self):
+        return getattr(self, 'test_sample_width', 0) > 0 and not self.test_only and self.test_full_freq > 1
+    
+    # The number of batches between tests
+    def get_test_interval(self):
+        return max(1, self.testing_freq / self.test_full_freq) if self.sampling_tests() else self.testing_freq
+    
+    # IGPUModel.train stops after the first batch of epoch num_epochs + 1
+    def is_save_due(self):
+        return self.get_num_batches_done() % self.testing_freq == 0 or self.epoch > self.num_epochs
+    
+    def is_test_due(self):
+        if not self.sampling_tests():
+            return IGPUModel.is_test_due(self)
+        return self.get_num_batches_done() % self.get_test_interval() == 0 or self.is_save_due()
+    
+    def get_test_error(self):
+        self.test_ci = None
+        if not self.sampling_tests() or self.is_save_due():
+            return IGPUModel.get_test_error(self)
+        return self.get_sampled_test_error(self.test_sample_width)
+    
+    # A second provider of the test batches for get_sampled_test_error, so
+    # that sampling doesn't move the test provider, whose full tests must
+    # start at the first test batch
+    def get_sample_data_provider(self):
+        if getattr(self, 'sample_data_provider', None) is None:
+            dp = DataProvider.get_instance(self.data_path, self.test_batch_range, type=self.dp_type,
+                                           dp_params=dict(self.dp_params, aug_workers=0), test=True)
+            if isinstance(self.test_data_provider, fc.FrozenPrefixDataProvider):
+                dp = self.test_data_provider.wrap(dp)
+            self.sample_data_provider = dp
+        return self.sample_data_provider
+    
+    # Estimates the test costs from rounds of --test-sample-size cases. Every
+    # round takes the next batch of the sample provider and samples its cases
+    # stratified by label, so its average costs are an unbiased estimate of
+    # the batch's. Rounds are added until there are at least
+    # MIN_SAMPLE_ROUNDS and the 95% confidence interval of the mean over
+    # rounds is at most width wide for the values of --test-sample-cost (all
+    # costs if not given), or until as many cases were tested as the test
+    # range holds. Returns the summed costs and number of the tested cases, as
+    # IGPUModel.get_test_error; self.test_ci gets the half-widths of the
+    # intervals of all costs.
+    def get_sampled_test_error(self, width):
+        rng = nr.RandomState([self.epoch, self.batchnum])
+        dp = self.get_sample_data_provider()
+        logregs = [l for l in self.layers if l['type'] == 'cost.logreg']
+        labels_idx = self.layers[logregs[0]['inputs'][0]]['dataIdx'] if logregs else None
+        num_views = dp.num_views if self.multiview_test and not getattr(dp, 'lazy_views', False) else 1
+        rounds, total, max_cases = [], None, None
+        while True:
+            epoch, batchnum, data = self.parse_batch_data(dp.get_next_batch(), train=False)
+            num_cases = data[0].shape[1] / num_views
+            if max_cases is None:
+                max_cases = num_cases * len(self.test_batch_range)
+            labels = data[labels_idx][0, :num_cases] if labels_idx is not None and labels_idx < len(data) else n.zeros(num_cases)
+            cases = get_stratified_sample(labels, self.test_sample_size, rng)
+            cols = (cases[n.newaxis, :] + num_cases * n.arange(num_views)[:, n.newaxis]).ravel()
+            self.start_batch((epoch, batchnum, [n.require(d[:, cols], requirements='C') for d in data]), train=False)
+            costs, num_tested = self.finish_batch()
+            dp.finish_batch()
+            
+            rounds += [dict((name, [v / num_tested for v in c]) for name, c in costs.iteritems())]
+            total = self.aggregate_test_outputs([total, (costs, num_tested)] if total else [(costs, num_tested)])
+            self.test_ci = dict((name, [get_confidence_halfwidth([r[name][i] for r in rounds]) for i in xrange(len(c))]) for name, c in costs.iteritems())
+            controlled = [self.test_sample_cost] if self.test_sample_cost else self.test_ci.keys()
+            if total[1] >= max_cases:
+                return total
+            if len(rounds) >= MIN_SAMPLE_ROUNDS and all(2 * h <= width for name in controlled for h in self.test_ci.get(name, [])):
+                return total
+    
     def conditional_save(self):
+        if self.test_ci is not None:
+            print "(sampled test; not saving)",
+            return
         self.save_state()
         print "-------------------------------------------------------"
         print "Saved checkpoint to %s" % os.path.join(self.save_path, self.save_file)
@@ -182,6 +420,21 @@ class ConvNet(IGPUModel):
         op.add_option("conv-to-local", "conv_to_local", ListOptionParser(StringOptionParser), "Convert given conv layers to unshared local", default=[])
         op.add_option("unshare-weights", "unshare_weights", ListOptionParser(StringOptionParser), "Unshare weight matrices in given layers", default=[])
         op.add_option("conserve-mem", "conserve_mem", BooleanOptionParser, "Conserve GPU memory (slower)?", default=0)
+        op.add_option("shuffle", "shuffle", BooleanOptionParser, "Shuffle the training cases across batches every epoch?", default=0)
+        op.add_option("shuffle-window", "shuffle_window", IntegerOptionParser, "Number of batches whose cases are mixed together (for --shuffle)", default=2)
+        op.add_option("shuffle-seed", "shuffle_seed", IntegerOptionParser, "Random seed of the shuffling (for --shuffle)", default=0)
+        op.add_option("aug-config", "aug_config", StringOptionParser, "Augmented DP: augmentation pipeline config file", default="")
+        op.add_option("aug-workers", "aug_workers", IntegerOptionParser, "Augmented DP: number of augmentation processes (0 to augment in the training process)", default=0)
+        op.add_option("aug-buffers", "aug_buffers", IntegerOptionParser, "Augmented DP: number of shared batch buffers (for --aug-workers; 0 for workers + 2)", default=0)
+        op.add_option("shared-data", "shared_data", BooleanOptionParser, "Memory DPs: share the loaded batches with other jobs on this host using the same data?", default=0)
+        op.add_option("frozen-cache", "frozen_cache", StringOptionParser, "Cache the outputs of the frozen layers (those with no trainable layers below) in this directory and train only the layers above", default="")
+        op.add_option("cpu", "cpu", BooleanOptionParser, "Run the net with the NumPy CPU backend (cpunet.py) instead of on a GPU?", default=0)
+        op.add_option("cpu-bench", "cpu_bench", IntegerOptionParser, "CPU backend: time every layer on the first training minibatch, averaging over this many passes, and quit (0 to train normally)", default=0, requires=['cpu'])
+        op.add_option("test-sample-width", "test_sample_width", FloatOptionParser, "Estimate the test costs from stratified samples of test cases until their 95% confidence intervals are at most this wide (0 to always test on the whole test range)", default=0)
+        op.add_option("test-sample-size", "test_sample_size", IntegerOptionParser, "Number of test cases sampled at a time (for --test-sample-width)", default=256)
+        op.add_option("test-sample-cost", "test_sample_cost", StringOptionParser, "Cost whose confidence intervals --test-sample-width bounds (default: all costs)", default="")
+        op.add_option("test-full-freq", "test_full_freq", IntegerOptionParser, "Number of tests per --test-freq batches with --test-sample-width: all but the one that saves the checkpoint are sampled", default=10)
+        op.add_option("strict-arrays", "strict_arrays", BooleanOptionParser, "Raise an error instead of copying non-contiguous data arrays?", default=0)
                 
         op.delete_option('max_test_err')
         op.options["max_filesize_mb"].default = 0
@@ -192,6 +445,8 @@ class ConvNet(IGPUModel):
         DataProvider.register_data_provider('cifar', 'CIFAR', CIFARDataProvider)
         DataProvider.register_data_provider('dummy-cn-n', 'Dummy ConvNet', DummyConvNetDataProvider)
         DataProvider.register_data_provider('cifar-cropped', 'Cropped CIFAR', CroppedCIFARDataProvider)
+        DataProvider.register_data_provider('augmented', 'Augmented images (see --aug-config)', AugmentedDataProvider)
+        DataProvider.register_data_provider('whitened', 'Whitened data (see whiten.py)', WhitenedDataProvider)
         
         return op
     
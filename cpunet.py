@@ -0,0 +1,1264 @@
+# Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as n
+from numpy.lib.stride_tricks import as_strided
+import sys
+from time import time
+import schedule
+from layer import LogregCostParser
+
+# Classes (rows of logits) read at a time by the fused softmax and
+# logistic regression cost
+LOGREG_CHUNK = 1024
+
+# Relative error above which a gradient check fails (as in util.cuh)
+GC_REL_ERR_THRESH = 0.02
+
+class CPUModelError(Exception):
+    pass
+
+# Neuron functions and their gradients, as in neuron.cuh. A function
+# computes f(x) with params p into out; its gradient function computes the
+# gradient from the gradient v, the input x and the output a into out.
+# out may be x (or v), so they read it before writing out. get_array(name,
+# shape, dtype) returns work arrays.
+def neuron_ident(x, p, out, get_array):
+    n.copyto(out, x)
+    
+def neuron_ident_grad(v, x, a, p, out, get_array):
+    n.copyto(out, v)
+    
+def neuron_logistic(x, p, out, get_array):
+    n.negative(x, out)
+    n.exp(out, out)
+    out += 1
+    n.reciprocal(out, out)
+    
+def neuron_logistic_grad(v, x, a, p, out, get_array):
+    s = get_array('s', a.shape, a.dtype)
+    n.subtract(1, a, s)
+    s *= a
+    n.multiply(v, s, out)
+    
+def neuron_abs(x, p, out, get_array):
+    n.absolute(x, out)
+    
+def neuron_abs_grad(v, x, a, p, out, get_array):
+    positive = get_array('mask', x.shape, n.bool_)
+    n.greater(x, 0, positive)
+    n.negative(v, out)
+    n.negative(out, out, where=positive)
+    
+def neuron_relu(x, p, out, get_array):
+    n.maximum(x, 0, out)
+    
+def neuron_relu_grad(v, x, a, p, out, get_array):
+    positive = get_array('mask', a.shape, n.bool_)
+    n.greater(a, 0, positive)
+    n.multiply(v, positive, out)
+    
+def neuron_softrelu(x, p, out, get_array):
+    large = get_array('mask', x.shape, n.bool_)
+    n.greater(x, 4, large)
+    s = get_array('s', x.shape, x.dtype)
+    n.minimum(x, 4, s)
+    n.exp(s, s)
+    n.log1p(s, s)
+    n.copyto(s, x, where=large)
+    n.copyto(out, s)
+    
+def neuron_softrelu_grad(v, x, a, p, out, get_array):
+    s = get_array('s', a.shape, a.dtype)
+    n.negative(a, s)
+    n.expm1(s, s)
+    n.negative(s, s)
+    large = get_array('mask', a.shape, n.bool_)
+    n.greater(a, 4, large)
+    n.copyto(s, 1, where=large)
+    n.multiply(v, s, out)
+    
+def neuron_square(x, p, out, get_array):
+    n.multiply(x, x, out)
+    
+def neuron_square_grad(v, x, a, p, out, get_array):
+    n.multiply(v, x, out)
+    out *= 2
+    
+def neuron_sqrt(x, p, out, get_array):
+    n.sqrt(x, out)
+    
+def neuron_sqrt_grad(v, x, a, p, out, get_array):
+    s = get_array('s', a.shape, a.dtype)
+    n.multiply(a, 2, s)
+    n.divide(v, s, out)
+    
+def neuron_tanh(x, p, out, get_array):
+    n.multiply(x, p['b'], out)
+    n.tanh(out, out)
+    out *= p['a']
+    
+def neuron_tanh_grad(v, x, a, p, out, get_array):
+    s = get_array('s', a.shape, a.dtype)
+    n.multiply(a, a, s)
+    s /= -p['a']
+    s += p['a']
+    s *= p['b']
+    n.multiply(v, s, out)
+    
+def neuron_brelu(x, p, out, get_array):
+    n.clip(x, 0, p['a'], out)
+    
+def neuron_brelu_grad(v, x, a, p, out, get_array):
+    inside, below = get_array('mask', a.shape, n.bool_), get_array('mask2', a.shape, n.bool_)
+    n.greater(a, 0, inside)
+    n.less(a, p['a'], below)
+    inside &= below
+    n.multiply(v, inside, out)
+    
+def neuron_linear(x, p, out, get_array):
+    n.multiply(x, p['a'], out)
+    out += p['b']
+    
+def neuron_linear_grad(v, x, a, p, out, get_array):
+    n.multiply(v, p['a'], out)
+
+neurons = {'ident': (neuron_ident, neuron_ident_grad),
+           'logistic': (neuron_logistic, neuron_logistic_grad),
+           'abs': (neuron_abs, neuron_abs_grad),
+           'relu': (neuron_relu, neuron_relu_grad),
+           'softrelu': (neuron_softrelu, neuron_softrelu_grad),
+           'square': (neuron_square, neuron_square_grad),
+           'sqrt': (neuron_sqrt, neuron_sqrt_grad),
+           'tanh': (neuron_tanh, neuron_tanh_grad),
+           'brelu': (neuron_brelu, neuron_brelu_grad),
+           'linear': (neuron_linear, neuron_linear_grad)}
+
+# The default get_array of the functions that take one: a new array
+def new_array(name, shape, dtype):
+    return n.empty(shape, dtype=dtype)
+
+# Returns the (num_cases,) integer labels in a (1, num_cases) label matrix
+def get_labels(labels):
+    return labels.ravel().astype(n.int32)
+
+# The windows [i + lo, i + hi] of the indices i of an axis of length num,
+# clipped to the axis, as arrays of (start, end) indices
+def get_windows(num, lo, hi):
+    i = n.arange(num)
+    return n.clip(i + lo, 0, num), n.clip(i + hi + 1, 0, num)
+
+# The windows of cross-map normalization with blocked=True: the maps are
+# split into consecutive blocks of size maps, each normalized on its own
+def get_blocked_windows(num, size):
+    starts = n.arange(num) / size * size
+    return starts, n.minimum(starts + size, num)
+
+# Sums of a over the given windows of axis into out, using prefix sums
+# along it so that each sum costs the same regardless of window size. The
+# prefix sums are accumulated in double precision to keep the differences
+# accurate.
+def window_sums(a, axis, windows, out, get_array=new_array):
+    starts, ends = windows
+    shape = list(a.shape)
+    shape[axis] += 1
+    prefix = get_array('prefix', shape, n.float64)
+    index = [slice(None)] * a.ndim
+    index[axis] = 0
+    prefix[tuple(index)] = 0
+    index[axis] = slice(1, None)
+    n.cumsum(a, axis=axis, dtype=n.float64, out=prefix[tuple(index)])
+    sums, lower = get_array('prefix_ends', a.shape, n.float64), get_array('prefix_starts', a.shape, n.float64)
+    n.take(prefix, ends, axis=axis, out=sums, mode='clip')
+    n.take(prefix, starts, axis=axis, out=lower, mode='clip')
+    n.subtract(sums, lower, out, casting='same_kind')
+    return out
+
+# Log-sum-exp of every column of logits, reading them once, LOGREG_CHUNK
+# rows at a time, with a running maximum and a rescaled running sum.
+# Returns (log-sum-exp, maximum, number of rows equal to the maximum),
+# each of shape (num_cases,).
+def logsumexp(logits, get_array=new_array):
+    num_cases = logits.shape[1]
+    maxes = n.empty(num_cases, dtype=logits.dtype)
+    maxes.fill(-n.inf)
+    sums = n.zeros(num_cases, dtype=logits.dtype)
+    num_max = n.zeros(num_cases, dtype=logits.dtype)
+    work_shape = (min(LOGREG_CHUNK, logits.shape[0]), num_cases)
+    exps, is_max = get_array('exps', work_shape, logits.dtype), get_array('is_max', work_shape, n.bool_)
+    for start in xrange(0, logits.shape[0], LOGREG_CHUNK):
+        chunk = logits[start:start + LOGREG_CHUNK]
+        rows = chunk.shape[0]
+        chunk_max = chunk.max(axis=0)
+        chunk_num_max = n.equal(chunk, chunk_max, is_max[:rows]).sum(axis=0)
+        new_maxes = n.maximum(maxes, chunk_max)
+        sums *= n.exp(maxes - new_maxes)
+        n.subtract(chunk, new_maxes, exps[:rows])
+        sums += n.exp(exps[:rows], exps[:rows]).sum(axis=0)
+        num_max = n.where(chunk_max > maxes, chunk_num_max, num_max + (chunk_max == maxes) * chunk_num_max)
+        maxes = new_maxes
+    return maxes + n.log(sums), maxes, num_max
+
+# Preallocated arrays of the CPU backend, so that running the net
+# minibatch after minibatch allocates no arrays of the size of its
+# activities. Every array is a view of a flat buffer kept under a key,
+# which is reallocated only if it is too small or of another type;
+# num_allocs counts the allocations.
+class Arena:
+    def __init__(self):
+        self.buffers = {}
+        self.fills = {}
+        self.num_allocs, self.num_alloc_bytes = 0, 0
+        
+    # Returns a C-contiguous array of the given shape and type under key.
+    # If fill is given, the array is set to it whenever its buffer or shape
+    # changes, so that elements the caller never writes keep that value.
+    def get(self, key, shape, dtype, fill=None):
+        size, dtype = int(n.prod(shape)), n.dtype(dtype)
+        buf = self.buffers.get(key)
+        if buf is None or buf.size < size or buf.dtype != dtype:
+            buf = self.buffers[key] = n.empty(size, dtype=dtype)
+            self.num_allocs += 1
+            self.num_alloc_bytes += buf.nbytes
+            self.fills.pop(key, None)
+        a = buf[:size].reshape(shape)
+        if fill is not None and self.fills.get(key) != (tuple(shape), fill):
+            a.fill(fill)
+            self.fills[key] = (tuple(shape), fill)
+        return a
+    
+    def get_num_bytes(self):
+        return sum(b.nbytes for b in self.buffers.itervalues())
+
+class Layer:
+    def __init__(self, model, dic, idx):
+        self.model, self.dic, self.idx = model, dic, idx
+        self.name = dic['name']
+        self.num_outputs = dic.get('outputs', 0)
+        
+    # Computes the layer's output from the outputs of its input layers into
+    # acts, an (outputs, cases) array. train says whether bprop will follow.
+    # If the layer shares its activity matrix with input actsTarget (see
+    # LayerWithInputParser.optimize), acts is that input.
+    def fprop(self, inputs, acts, train):
+        raise NotImplementedError()
+    
+    # Computes the gradient with respect to input inp given the gradient v
+    # with respect to the output acts into grad, or adds it to grad if add.
+    # If the layer shares its activity gradient matrix with input
+    # actsGradTarget, grad is v when inp is that input.
+    def bprop_acts(self, v, inp, inputs, acts, grad, add):
+        raise NotImplementedError()
+    
+    # A short description of the layer's configuration, for benchmark
+    def describe(self):
+        return ""
+    
+    # A work array of this layer, kept in the model's arena
+    def get_scratch(self, name, shape, dtype, fill=None):
+        return self.model.arena.get((self.idx, name), shape, dtype, fill)
+    
+    # The array to compute a gradient in that is to be written to grad, or
+    # added to it if add
+    def get_grad_target(self, grad, add):
+        return self.get_scratch('grad', grad.shape, grad.dtype) if add else grad
+    
+    # n.dot(a, b) into out, through a work array if out isn't C-contiguous
+    def dot(self, a, b, out):
+        if out.flags.c_contiguous:
+            n.dot(a, b, out=out)
+        else:
+            s = self.get_scratch('dot', out.shape, out.dtype)
+            n.dot(a, b, out=s)
+            out[...] = s
+            
+# Data layers have no activity matrix of their own; their output is the data.
+class DataLayer(Layer):
+    def get_data(self, data):
+        return data[self.dic['dataIdx']]
+
+class NeuronLayer(Layer):
+    def __init__(self, model, dic, idx):
+        Layer.__init__(self, model, dic, idx)
+        if dic['neuron']['type'] not in neurons:
+            raise CPUModelError("Layer '%s': neuron type '%s' is not supported by the CPU backend" % (self.name, dic['neuron']['type']))
+        self.func, self.grad = neurons[dic['neuron']['type']]
+        self.params = dic['neuron']['params']
+        
+    def fprop(self, inputs, acts, train):
+        self.func(inputs[0], self.params, acts, self.get_scratch)
+    
+    def bprop_acts(self, v, inp, inputs, acts, grad, add):
+        target = self.get_grad_target(grad, add)
+        self.grad(v, inputs[0], acts, self.params, target, self.get_scratch)
+        if add:
+            grad += target
+    
+class EltwiseSumLayer(Layer):
+    def fprop(self, inputs, acts, train):
+        coeffs = self.dic['coeffs']
+        first = max(0, self.dic['actsTarget'])
+        n.multiply(inputs[first], coeffs[first], acts)
+        for i, (c, x) in enumerate(zip(coeffs, inputs)):
+            if i == first:
+                continue
+            if c == 1:
+                acts += x
+            else:
+                s = self.get_scratch('term', acts.shape, acts.dtype)
+                n.multiply(x, c, s)
+                acts += s
+    
+    def bprop_acts(self, v, inp, inputs, acts, grad, add):
+        target = self.get_grad_target(grad, add)
+        n.multiply(v, self.dic['coeffs'][inp], target)
+        if add:
+            grad += target
+    
+class EltwiseMaxLayer(Layer):
+    def fprop(self, inputs, acts, train):
+        n.maximum(inputs[0], inputs[1], acts)
+        for x in inputs[2:]:
+            n.maximum(acts, x, acts)
+    
+    def bprop_acts(self, v, inp, inputs, acts, grad, add):
+        is_max = self.get_scratch('mask', acts.shape, n.bool_)
+        n.equal(inputs[inp], acts, is_max)
+        target = self.get_grad_target(grad, add)
+        n.multiply(v, is_max, target)
+        if add:
+            grad += target
+
+# When its logistic regression cost is fused with it (self.cost is set),
+# the softmax layer only remembers its input, and the cost layer computes
+# the cost and this layer's input gradient from that. The probabilities
+# are computed only when asked for with get_probs.
+class SoftmaxLayer(Layer):
+    def __init__(self, model, dic, idx):
+        Layer.__init__(self, model, dic, idx)
+        self.cost = None
+        
+    def fprop(self, inputs, acts, train):
+        self.acts = acts
+        if self.cost is not None:
+            self.logits = inputs[0]
+            return
+        col_maxes = self.get_scratch('columns', (acts.shape[1],), acts.dtype)
+        n.amax(inputs[0], axis=0, out=col_maxes)
+        n.subtract(inputs[0], col_maxes, acts)
+        n.exp(acts, acts)
+        acts /= n.sum(acts, axis=0, out=col_maxes)
+    
+    # The probabilities of the fused pair after a forward pass, computed
+    # into out (by default the layer's activity matrix)
+    def get_probs(self, out=None):
+        out = self.acts if out is None else out
+        n.subtract(self.logits, self.cost.lse, out)
+        return n.exp(out, out)
+    
+    def bprop_acts(self, v, inp, inputs, acts, grad, add):
+        target = self.get_grad_target(grad, add)
+        if self.cost is not None:
+            coeff = self.cost.dic['coeff']
+            self.get_probs(target)
+            target *= -coeff
+            target[self.cost.labels, self.cost.cases] += coeff
+        else:
+            n.multiply(v, acts, target)
+            sums = self.get_scratch('columns', (acts.shape[1],), acts.dtype)
+            n.subtract(v, n.sum(target, axis=0, out=sums), target)
+            target *= acts
+        if add:
+            grad += target
+    
+class CostLayer(Layer):
+    def __init__(self, model, dic, idx):
+        Layer.__init__(self, model, dic, idx)
+        self.cost = []
+
+# The activity matrix of the logistic regression cost holds the log
+# probabilities of the labels
+class LogregCostLayer(CostLayer):
+    def __init__(self, model, dic, idx):
+        CostLayer.__init__(self, model, dic, idx)
+        self.num_outputs = 1
+        self.softmax = None
+        
+    def fprop(self, inputs, acts, train):
+        self.labels = get_labels(inputs[0])
+        self.cases = n.arange(len(self.labels))
+        logprobs = acts.reshape(-1)
+        if self.softmax is not None:
+            logits = self.softmax.logits
+            self.lse, maxes, num_max = logsumexp(logits, self.get_scratch)
+            label_logits = logits[self.labels, self.cases]
+            n.subtract(label_logits, self.lse, logprobs)
+            correct = (label_logits == maxes) / num_max
+        else:
+            probs = inputs[1]
+            label_probs = probs[self.labels, self.cases]
+            maxes = probs.max(axis=0)
+            n.log(label_probs, logprobs)
+            correct = (label_probs == maxes) / (probs == maxes).sum(axis=0)
+        self.cost = [-float(logprobs.sum()), len(self.labels) - float(correct.sum())]
+    
+    def bprop_acts(self, v, inp, inputs, acts, grad, add):
+        if self.softmax is not None: # the softmax layer computes the gradient
+            return
+        target = self.get_grad_target(grad, add)
+        target.fill(0)
+        target[self.labels, self.cases] = self.dic['coeff'] / inputs[1][self.labels, self.cases]
+        if add:
+            grad += target
+
+class SumOfSquaresCostLayer(CostLayer):
+    def __init__(self, model, dic, idx):
+        CostLayer.__init__(self, model, dic, idx)
+        self.num_outputs = dic['numInputs'][0]
+        
+    def fprop(self, inputs, acts, train):
+        n.multiply(inputs[0], inputs[0], acts)
+        self.cost = [float(acts.sum())]
+    
+    def bprop_acts(self, v, inp, inputs, acts, grad, add):
+        target = self.get_grad_target(grad, add)
+        n.multiply(inputs[0], -2 * self.dic['coeff'], target)
+        if add:
+            grad += target
+
+class WeightLayer(Layer):
+    # Finite-difference steps of the gradient check (as in layer.cu)
+    W_STEP, B_STEP = 0.001, 0.002
+    
+    # Computes the gradient of weights[inp] (summed over cases) into grad,
+    # or adds it to grad if add
+    def bprop_weights(self, v, inp, inputs, grad, add):
+        raise NotImplementedError()
+    
+    # Computes the gradient of the biases into grad
+    def bprop_biases(self, v, grad):
+        raise NotImplementedError()
+    
+class FCLayer(WeightLayer):
+    # layer.cu's 0.1 is too coarse for these float32 costs, and WeightLayer's
+    # steps are closer to their rounding error
+    W_STEP, B_STEP = 0.01, 0.01
+    
+    def fprop(self, inputs, acts, train):
+        self.dot(self.dic['weights'][0].T, inputs[0], acts)
+        for w, x in zip(self.dic['weights'][1:], inputs[1:]):
+            s = self.get_scratch('acts', acts.shape, acts.dtype)
+            n.dot(w.T, x, out=s)
+            acts += s
+        acts += self.dic['biases'].T
+    
+    def bprop_acts(self, v, inp, inputs, acts, grad, add):
+        target = self.get_grad_target(grad, add)
+        self.dot(self.dic['weights'][inp], v, target)
+        if add:
+            grad += target
+    
+    def bprop_weights(self, v, inp, inputs, grad, add):
+        target = self.get_grad_target(grad, add)
+        self.dot(inputs[inp], v.T, target)
+        if add:
+            grad += target
+    
+    def bprop_biases(self, v, grad):
+        n.sum(v, axis=1, out=grad.reshape(-1))
+
+# Convolutional and locally-connected layers. Images are (channels, y, x,
+# cases) and the outputs (filters, modules y, modules x, cases). The filter
+# windows are strided views of the zero-padded images, copied into column
+# matrices of (filterChannels * filterPixels, modules * cases) per group.
+class LocalLayer(WeightLayer):
+    def __init__(self, model, dic, idx):
+        WeightLayer.__init__(self, model, dic, idx)
+        self.cols = [None] * len(dic['inputs'])
+        
+    # The image channels that each group of filters of input inp sees
+    def get_group_channels(self, inp):
+        d = self.dic
+        fc = d['filterChannels'][inp]
+        if d['randSparse'][inp]:
+            conns = n.array(d['filterConns'][inp])
+            return [conns[g * fc:(g + 1) * fc] for g in xrange(d['groups'][inp])]
+        return [slice(g * fc, (g + 1) * fc) for g in xrange(d['groups'][inp])]
+    
+    # Returns (padding, padded image size) of input inp
+    def get_padding(self, inp):
+        d = self.dic
+        pad = -d['padding'][inp]
+        return pad, max(d['imgSize'][inp] + pad, (d['modulesX'] - 1) * d['stride'][inp] + d['filterSize'][inp])
+    
+    # Returns the column matrix of every group of input inp
+    def get_cols(self, x, inp):
+        d = self.dic
+        channels, size, fsize, stride, mx = d['channels'][inp], d['imgSize'][inp], d['filterSize'][inp], d['stride'][inp], d['modulesX']
+        num_cases = x.shape[1]
+        imgs = x.reshape(channels, size, size, num_cases)
+        pad, padded_size = self.get_padding(inp)
+        if padded_size != size:
+            padded = self.get_scratch(('padded', inp), (channels, padded_size, padded_size, num_cases), x.dtype, fill=0)
+            padded[:, pad:pad + size, pad:pad + size, :] = imgs
+            imgs = padded
+        sc, sy, sx, sn = imgs.strides
+        windows = as_strided(imgs, shape=(channels, fsize, fsize, mx, mx, num_cases),
+                             strides=(sc, sy, sx, sy * stride, sx * stride, sn))
+        fc = d['filterChannels'][inp]
+        cols = []
+        for g, chans in enumerate(self.get_group_channels(inp)):
+            c = self.get_scratch(('cols', inp, g), (fc, fsize, fsize, mx, mx, num_cases), x.dtype)
+            if isinstance(chans, slice):
+                n.copyto(c, windows[chans])
+            else:
+                n.take(windows, chans, axis=0, out=c, mode='clip')
+            cols += [c.reshape(fc * fsize**2, mx * mx * num_cases)]
+        return cols
+    
+    # Computes the image gradient of input inp given the gradients of the
+    # column matrices of its groups into grad, or adds it to grad if add
+    def get_cols_grad(self, col_grads, inp, grad, add):
+        d = self.dic
+        channels, size, fsize, stride, mx = d['channels'][inp], d['imgSize'][inp], d['filterSize'][inp], d['stride'][inp], d['modulesX']
+        num_cases = grad.shape[1]
+        pad, padded_size = self.get_padding(inp)
+        imgs_grad = grad.reshape(channels, size, size, num_cases)
+        if padded_size != size:
+            target = self.get_scratch('padded_grad', (channels, padded_size, padded_size, num_cases), grad.dtype)
+            target.fill(0)
+        else:
+            target = imgs_grad
+            if not add:
+                target.fill(0)
+        end = stride * (mx - 1) + 1
+        for chans, cg in zip(self.get_group_channels(inp), col_grads):
+            cg = cg.reshape(-1, fsize, fsize, mx, mx, num_cases)
+            for y in xrange(fsize):
+                for x in xrange(fsize):
+                    if isinstance(chans, slice):
+                        g = target[chans, y:y + end:stride, x:x + end:stride, :]
+                        g += cg[:, y, x]
+                    else:
+                        target[chans, y:y + end:stride, x:x + end:stride, :] += cg[:, y, x]
+        if padded_size != size:
+            interior = target[:, pad:pad + size, pad:pad + size, :]
+            if add:
+                imgs_grad += interior
+            else:
+                n.copyto(imgs_grad, interior)
+    
+    # The filters of input inp, per group
+    def get_group_filters(self, inp):
+        fpg = self.dic['filters'] / self.dic['groups'][inp]
+        return [slice(g * fpg, (g + 1) * fpg) for g in xrange(self.dic['groups'][inp])]
+    
+    def describe(self):
+        d = self.dic
+        return "%dx%d/%d, %d filters" % (d['filterSize'][0], d['filterSize'][0], d['stride'][0], d['filters'])
+    
+    def fprop(self, inputs, acts, train):
+        d = self.dic
+        for inp, x in enumerate(inputs):
+            cols = self.get_cols(x, inp)
+            out = acts if inp == 0 else self.get_scratch('acts', acts.shape, acts.dtype)
+            self.fprop_cols(cols, inp, out.reshape(d['filters'], -1))
+            if inp > 0:
+                acts += out
+            self.cols[inp] = cols if train else None
+        if d['type'] == 'conv' and d['sharedBiases']:
+            filter_acts = acts.reshape(d['filters'], -1)
+            filter_acts += d['biases']
+        else:
+            acts += d['biases']
+    
+    def bprop_acts(self, v, inp, inputs, acts, grad, add):
+        self.get_cols_grad(self.bprop_cols(v, inp), inp, grad, add)
+    
+    def bprop_biases(self, v, grad):
+        d = self.dic
+        if d['type'] == 'conv' and d['sharedBiases']:
+            v = v.reshape(d['filters'], -1)
+        n.sum(v, axis=1, out=grad.reshape(-1))
+    
+class ConvLayer(LocalLayer):
+    # Computes the (filters, modules * cases) output of input inp into out
+    def fprop_cols(self, cols, inp, out):
+        w = self.dic['weights'][inp]
+        for f, c in zip(self.get_group_filters(inp), cols):
+            self.dot(w[:, f].T, c, out[f])
+    
+    # Returns the gradients of the column matrices of input inp
+    def bprop_cols(self, v, inp):
+        v = v.reshape(self.dic['filters'], -1)
+        w = self.dic['weights'][inp]
+        col_grads = []
+        for g, f in enumerate(self.get_group_filters(inp)):
+            cg = self.get_scratch(('col_grads', g), (w.shape[0], v.shape[1]), v.dtype)
+            n.dot(w[:, f], v[f], out=cg)
+            col_grads += [cg]
+        return col_grads
+    
+    def bprop_weights(self, v, inp, inputs, grad, add):
+        v = v.reshape(self.dic['filters'], -1)
+        cols = self.cols[inp] or self.get_cols(inputs[inp], inp)
+        target = self.get_grad_target(grad, add)
+        for f, c in zip(self.get_group_filters(inp), cols):
+            self.dot(c, v[f].T, target[:, f])
+        if add:
+            grad += target
+    
+# The weights of a locally-connected layer are a (filterChannels *
+# filterPixels, filters) matrix per module, which the column matrices
+# are multiplied with as stacks of (modules, filterChannels * filterPixels, cases).
+class LocalUnsharedLayer(LocalLayer):
+    def get_module_weights(self, inp):
+        d = self.dic
+        return d['weights'][inp].reshape(d['modules'], -1, d['filters'])
+    
+    def get_module_cols(self, c):
+        return c.reshape(c.shape[0], self.dic['modules'], -1).swapaxes(0, 1)
+    
+    def fprop_cols(self, cols, inp, out):
+        d = self.dic
+        w = self.get_module_weights(inp)
+        out = out.reshape(d['filters'], d['modules'], -1)
+        for f, c in zip(self.get_group_filters(inp), cols):
+            n.matmul(w[:, :, f].swapaxes(1, 2), self.get_module_cols(c), out=out[f].swapaxes(0, 1))
+    
+    def bprop_cols(self, v, inp):
+        d = self.dic
+        v = v.reshape(d['filters'], d['modules'], -1).swapaxes(0, 1)
+        w = self.get_module_weights(inp)
+        col_grads = []
+        for g, f in enumerate(self.get_group_filters(inp)):
+            cg = self.get_scratch(('col_grads', g), (w.shape[1], d['modules'] * v.shape[2]), v.dtype)
+            n.matmul(w[:, :, f], v[:, f], out=self.get_module_cols(cg))
+            col_grads += [cg]
+        return col_grads
+    
+    def bprop_weights(self, v, inp, inputs, grad, add):
+        d = self.dic
+        v = v.reshape(d['filters'], d['modules'], -1).swapaxes(0, 1)
+        cols = self.cols[inp] or self.get_cols(inputs[inp], inp)
+        target = self.get_grad_target(grad, add)
+        module_target = target.reshape(d['modules'], -1, d['filters'])
+        for f, c in zip(self.get_group_filters(inp), cols):
+            n.matmul(self.get_module_cols(c), v[:, f].swapaxes(1, 2), out=module_target[:, :, f])
+        if add:
+            grad += target
+
+# Response normalization over size x size windows of pixels, as
+# convResponseNorm: every output is its input divided by
+# (1 + scale * sum of the squared inputs in the window around it)^pow.
+# The window sums are box filters along y and then x (a separable
+# integral image), so they cost the same for any size. The gradient sums
+# over the reflected windows, i.e. over the outputs whose window contains
+# a pixel.
+class ResponseNormLayer(Layer):
+    def __init__(self, model, dic, idx):
+        Layer.__init__(self, model, dic, idx)
+        size = dic['size']
+        self.windows = get_windows(dic['imgSize'], -(size / 2), size - 1 - size / 2)
+        self.grad_windows = get_windows(dic['imgSize'], -(size - 1 - size / 2), size / 2)
+        
+    def get_images(self, x):
+        d = self.dic
+        return x.reshape(d['channels'], d['imgSize'], d['imgSize'], x.shape[1])
+    
+    def describe(self):
+        return "size %d" % self.dic['size']
+    
+    # Computes the window sums of imgs into out
+    def get_sums(self, imgs, windows, out):
+        sums_y = self.get_scratch('sums_y', imgs.shape, imgs.dtype)
+        window_sums(imgs, 1, windows, sums_y, self.get_scratch)
+        window_sums(sums_y, 2, windows, out, self.get_scratch)
+    
+    # The values whose squares are summed in the denominators
+    def get_norm_inputs(self, imgs):
+        return imgs
+    
+    def fprop(self, inputs, acts, train):
+        imgs = self.get_images(inputs[0])
+        self.norm_inputs = self.get_norm_inputs(imgs)
+        squares = self.get_scratch('squares', imgs.shape, imgs.dtype)
+        n.multiply(self.norm_inputs, self.norm_inputs, squares)
+        self.denoms = self.get_scratch('denoms', imgs.shape, imgs.dtype)
+        self.get_sums(squares, self.windows, self.denoms)
+        self.denoms *= self.dic['scale']
+        self.denoms += 1
+        acts = self.get_images(acts)
+        n.power(self.denoms, -self.dic['pow'], acts)
+        acts *= imgs
+    
+    def bprop_acts(self, v, inp, inputs, acts, grad, add):
+        v, acts = self.get_images(v), self.get_images(acts)
+        pre = self.get_scratch('pre', v.shape, v.dtype)
+        n.multiply(v, acts, pre)
+        pre *= -2 * self.dic['scale'] * self.dic['pow']
+        pre /= self.denoms
+        sums = self.get_scratch('squares', v.shape, v.dtype)
+        self.get_sums(pre, self.grad_windows, sums)
+        target = self.get_images(self.get_grad_target(grad, add))
+        n.multiply(self.norm_inputs, sums, target)
+        n.power(self.denoms, -self.dic['pow'], pre)
+        pre *= v
+        target += pre
+        if add:
+            grad += target.reshape(grad.shape)
+    
+# Contrast normalization, as ContrastNormLayer: the denominators sum the
+# squared differences of the inputs from their window means (over the
+# pixels of the window inside the image). As on the GPU, the gradient
+# treats those differences as the inputs and ignores the means.
+class ContrastNormLayer(ResponseNormLayer):
+    def __init__(self, model, dic, idx):
+        ResponseNormLayer.__init__(self, model, dic, idx)
+        starts, ends = self.windows
+        counts = ends - starts
+        self.region_sizes = (counts.reshape(-1, 1) * counts).reshape(1, counts.size, counts.size, 1)
+        
+    def get_norm_inputs(self, imgs):
+        means = self.get_scratch('means', imgs.shape, imgs.dtype)
+        self.get_sums(imgs, self.windows, means)
+        means /= self.region_sizes
+        n.subtract(imgs, means, means)
+        return means
+    
+# Response normalization across size adjacent maps, as
+# convResponseNormCrossMap, with prefix sums along the maps
+class CrossMapResponseNormLayer(ResponseNormLayer):
+    def __init__(self, model, dic, idx):
+        Layer.__init__(self, model, dic, idx)
+        size, channels = dic['size'], dic['channels']
+        if dic['blocked']:
+            self.windows = self.grad_windows = get_blocked_windows(channels, size)
+        else:
+            self.windows = get_windows(channels, -(size / 2), size - 1 - size / 2)
+            self.grad_windows = get_windows(channels, -(size - 1 - size / 2), size / 2)
+            
+    def get_sums(self, imgs, windows, out):
+        window_sums(imgs, 0, windows, out, self.get_scratch)
+
+# Max and average pooling over sizeX x sizeX windows, the window of output
+# o starting at pixel start + o * stride, as convLocalPool. Windows may
+# overlap (stride < sizeX) and hang over the edges of the image, where
+# they are clipped. The images are padded to cover every window, and the
+# pooling runs over the sizeX**2 offsets within the windows, taking a
+# strided view of all the windows' pixels at each offset.
+#
+# Max pooling remembers which offset won in every window, as uint8 (uint16
+# for windows of more than 256 pixels), so the backward pass scatters the
+# gradient to the winners, one offset at a time, without looking at the
+# windows again. Unlike on the GPU, a window whose maximum is tied passes
+# its gradient to the first of the tied pixels only.
+class PoolLayer(Layer):
+    def __init__(self, model, dic, idx):
+        Layer.__init__(self, model, dic, idx)
+        size, start, sizex, ox = dic['imgSize'], dic['start'], dic['sizeX'], dic['outputsX']
+        end = start + (ox - 1) * dic['stride'] + sizex
+        self.pad = max(0, -start)
+        self.padded_size = self.pad + max(size, end)
+        self.first = start + self.pad
+        
+        # The number of pixels of every window inside the image
+        starts = n.clip(start + n.arange(ox) * dic['stride'], 0, size)
+        counts = n.clip(start + n.arange(ox) * dic['stride'] + sizex, 0, size) - starts
+        self.region_sizes = (counts.reshape(-1, 1) * counts).reshape(1, ox, ox, 1)
+        
+        self.offsets_dtype = n.uint8 if sizex**2 <= 256 else n.uint16
+        self.offsets = None
+        
+    def get_images(self, x):
+        d = self.dic
+        return x.reshape(d['channels'], d['imgSize'], d['imgSize'], x.shape[1])
+    
+    def get_outputs(self, x):
+        d = self.dic
+        return x.reshape(d['channels'], d['outputsX'], d['outputsX'], x.shape[1])
+    
+    def describe(self):
+        d = self.dic
+        return "%s %dx%d/%d" % (d['pool'], d['sizeX'], d['sizeX'], d['stride'])
+    
+    # Returns the images padded with value so that every window is inside them
+    def get_padded(self, x, value):
+        imgs = self.get_images(x)
+        if self.padded_size == self.dic['imgSize']:
+            return imgs
+        padded = self.get_scratch('padded', (imgs.shape[0], self.padded_size, self.padded_size, imgs.shape[3]), x.dtype, fill=value)
+        padded[:, self.pad:self.pad + imgs.shape[1], self.pad:self.pad + imgs.shape[2]] = imgs
+        return padded
+    
+    # The pixels at offset (y, x) of all windows, as (channels, outputsX, outputsX, cases)
+    def get_window_pixels(self, imgs, y, x):
+        first, stride, ox = self.first, self.dic['stride'], self.dic['outputsX']
+        end = (ox - 1) * stride + 1
+        return imgs[:, first + y:first + y + end:stride, first + x:first + x + end:stride]
+    
+    def fprop(self, inputs, acts, train):
+        sizex = self.dic['sizeX']
+        acts = self.get_outputs(acts)
+        if self.dic['pool'] == 'max':
+            imgs = self.get_padded(inputs[0], -2e38)
+            n.copyto(acts, self.get_window_pixels(imgs, 0, 0))
+            offsets = self.get_scratch('offsets', acts.shape, self.offsets_dtype)
+            offsets.fill(0)
+            better = self.get_scratch('mask', acts.shape, n.bool_)
+            for k in xrange(1, sizex**2):
+                pixels = self.get_window_pixels(imgs, k / sizex, k % sizex)
+                n.greater(pixels, acts, better)
+                n.maximum(acts, pixels, acts)
+                n.copyto(offsets, k, where=better)
+            self.offsets = offsets if train else None
+        else:
+            imgs = self.get_padded(inputs[0], 0)
+            n.copyto(acts, self.get_window_pixels(imgs, 0, 0))
+            for k in xrange(1, sizex**2):
+                acts += self.get_window_pixels(imgs, k / sizex, k % sizex)
+            acts /= self.region_sizes
+    
+    def bprop_acts(self, v, inp, inputs, acts, grad, add):
+        d = self.dic
+        channels, sizex, size, psize = d['channels'], d['sizeX'], d['imgSize'], self.padded_size
+        v = self.get_outputs(v)
+        num_cases = v.shape[3]
+        imgs_grad = self.get_images(grad)
+        if psize != size:
+            target = self.get_scratch('padded_grad', (channels, psize, psize, num_cases), grad.dtype)
+            target.fill(0)
+        else:
+            target = imgs_grad
+            if not add:
+                target.fill(0)
+        part = self.get_scratch('part', v.shape, v.dtype)
+        if d['pool'] == 'max':
+            if self.offsets is None:
+                self.fprop(inputs, self.get_scratch('acts', acts.shape, acts.dtype), True)
+            chosen = self.get_scratch('mask', v.shape, n.bool_)
+            for k in xrange(sizex**2):
+                n.equal(self.offsets, k, chosen)
+                n.multiply(v, chosen, part)
+                g = self.get_window_pixels(target, k / sizex, k % sizex)
+                g += part
+        else:
+            n.divide(v, self.region_sizes, part)
+            for k in xrange(sizex**2):
+                g = self.get_window_pixels(target, k / sizex, k % sizex)
+                g += part
+        if psize != size:
+            interior = target[:, self.pad:self.pad + size, self.pad:self.pad + size]
+            if add:
+                imgs_grad += interior
+            else:
+                n.copyto(imgs_grad, interior)
+
+layer_classes = {'data': DataLayer,
+                 'fc': FCLayer,
+                 'conv': ConvLayer,
+                 'local': LocalUnsharedLayer,
+                 'softmax': SoftmaxLayer,
+                 'eltsum': EltwiseSumLayer,
+                 'eltmax': EltwiseMaxLayer,
+                 'neuron': NeuronLayer,
+                 'rnorm': ResponseNormLayer,
+                 'cnorm': ContrastNormLayer,
+                 'cmrnorm': CrossMapResponseNormLayer,
+                 'pool': PoolLayer,
+                 'cost.logreg': LogregCostLayer,
+                 'cost.sum2': SumOfSquaresCostLayer}
+
+# A NumPy implementation of the interface of the C++ module (_ConvNet),
+# running the layer list returned by the layer parsers. Like the C++
+# module, it works on the weight matrices of the layer dicts in place, so
+# syncWithHost has nothing to do. Unlike it, startBatch etc. do all their
+# work before returning.
+#
+# The activity and gradient matrices of the layers, their work arrays and
+# the weight gradients live in an arena and are reused from minibatch to
+# minibatch. A layer that shares its activity (gradient) matrix with an
+# input (actsTarget, actsGradTarget) gets that input's slot, as on the GPU.
+class CPUModel:
+    def __init__(self):
+        self.layers = []
+        self.strict_arrays = False
+        self.num_copies, self.num_copied_bytes = 0, 0
+        self.result = None
+        self.arena = Arena()
+        
+    def initModel(self, layers, minibatch_size, device_id=-1):
+        unsupported = sorted(set(l['type'] for l in layers if l['type'] not in layer_classes))
+        if unsupported:
+            raise CPUModelError("Layer type(s) not supported by the CPU backend: %s" % ", ".join(unsupported))
+        self.layer_dics = layers
+        self.minibatch_size = minibatch_size
+        self.layers = [layer_classes[l['type']](self, l, i) for i, l in enumerate(layers)]
+        for l in self.layers:
+            if l.dic['type'] == 'cost.logreg' and l.dic.get('fuseSoftmax', LogregCostParser.can_fuse_softmax(layers, l.dic)):
+                l.softmax = self.layers[l.dic['inputs'][1]]
+                l.softmax.cost = l
+        self.cost_layers = [l for l in self.layers if l.dic['type'].startswith('cost.')]
+        self.steps = schedule.get_backward_schedule(layers)
+        
+        # The layer whose activity (gradient) matrix every layer uses
+        self.acts_slots, self.grad_slots = [], []
+        for i, l in enumerate(layers):
+            target, grad_target = l.get('actsTarget', -1), l.get('actsGradTarget', -1)
+            self.acts_slots += [i if target < 0 else self.acts_slots[l['inputs'][target]]]
+            self.grad_slots += [i if grad_target < 0 else self.grad_slots[l['inputs'][grad_target]]]
+        self.arena = Arena()
+        for i in sorted(set(self.acts_slots)):
+            if not isinstance(self.layers[i], DataLayer):
+                self.get_acts_slot(i, minibatch_size, n.single)
+        for i in sorted(set(self.grad_slots[layers[s.layer]['inputs'][s.inp]] for s in self.steps if s.op == 'acts')):
+            self.get_grad_slot(i, minibatch_size, n.single)
+            
+        # Every weight matrix is updated once, with the learning parameters
+        # of the layer that owns it
+        self.weight_owners, seen = [], set()
+        for l in self.layers:
+            for i, w in enumerate(l.dic.get('weights', [])):
+                if id(w) not in seen:
+                    seen.add(id(w))
+                    self.weight_owners += [(l.dic, i)]
+                    
+    def setStrictArrays(self, strict):
+        self.strict_arrays = strict
+        
+    def getArrayCopyStats(self):
+        return self.num_copies, self.num_copied_bytes
+    
+    # The number of arrays the arena has allocated and their total size
+    def getArenaStats(self):
+        return self.arena.num_allocs, self.arena.num_alloc_bytes
+    
+    def syncWithHost(self):
+        pass
+    
+    # Arrays that aren't C-contiguous float32 are copied, as by the C++ module
+    def check_data(self, data):
+        checked = []
+        for i, d in enumerate(data):
+            if not d.flags.c_contiguous or d.dtype != n.single:
+                if self.strict_arrays:
+                    raise ValueError("Array %d of %d is not contiguous and would have to be copied" % (i, len(data)))
+                d = n.require(d, dtype=n.single, requirements='C')
+                self.num_copies += 1
+                self.num_copied_bytes += d.nbytes
+            checked += [d]
+        return checked
+    
+    def get_num_minibatches(self, data):
+        return (data[0].shape[1] + self.minibatch_size - 1) / self.minibatch_size
+    
+    def get_minibatch(self, data, i):
+        return [d[:, i * self.minibatch_size:(i + 1) * self.minibatch_size] for d in data]
+    
+    # The activity matrix of layer i for num_cases cases
+    def get_acts_slot(self, i, num_cases, dtype):
+        return self.arena.get(('acts', self.acts_slots[i]), (self.layers[i].num_outputs, num_cases), dtype)
+    
+    # The gradient with respect to the activity of layer i
+    def get_grad_slot(self, i, num_cases, dtype):
+        return self.arena.get(('grads', self.grad_slots[i]), (self.layers[i].num_outputs, num_cases), dtype)
+    
+    # Runs the net on data; returns the outputs of all layers (the logits
+    # of a softmax fused with its cost). If times is given, the time each
+    # layer took is added to times[layer index][0].
+    def fprop(self, data, train=False, times=None):
+        num_cases, dtype = data[0].shape[1], data[0].dtype
+        acts = [None] * len(self.layers)
+        for i, l in enumerate(self.layers):
+            start = time()
+            if isinstance(l, DataLayer):
+                acts[i] = l.get_data(data)
+            else:
+                acts[i] = self.get_acts_slot(i, num_cases, dtype)
+                l.fprop([acts[j] for j in l.dic['inputs']], acts[i], train)
+            if times is not None:
+                times[i][0] += time() - start
+        return acts
+    
+    # The output of layer idx after a forward pass, computing the
+    # probabilities of a fused softmax layer if necessary
+    def get_acts(self, acts, idx):
+        l = self.layers[idx]
+        if isinstance(l, SoftmaxLayer) and l.cost is not None:
+            return l.get_probs()
+        return acts[idx]
+    
+    # Runs the backward schedule after a forward pass. Returns the gradients
+    # of the weight matrices (by id) and of the biases (by layer index),
+    # summed over cases. If times is given, the time of each layer's
+    # backward steps is added to times[layer index][1].
+    def bprop(self, acts, times=None):
+        num_cases = acts[0].shape[1]
+        grads = [None] * len(self.layers)
+        weight_grads, bias_grads = {}, {}
+        for s in self.steps:
+            start = time()
+            l = self.layers[s.layer]
+            inputs = [acts[j] for j in l.dic['inputs']]
+            if s.op == 'biases':
+                b = l.dic['biases']
+                bias_grads[s.layer] = self.arena.get(('biases', s.layer), b.shape, b.dtype)
+                l.bprop_biases(grads[s.layer], bias_grads[s.layer])
+            elif s.op == 'weights':
+                w = l.dic['weights'][s.inp]
+                add = id(w) in weight_grads
+                if not add:
+                    weight_grads[id(w)] = self.arena.get(('weights', s.layer, s.inp), w.shape, w.dtype)
+                l.bprop_weights(grads[s.layer], s.inp, inputs, weight_grads[id(w)], add)
+            else:
+                j = l.dic['inputs'][s.inp]
+                add = grads[j] is not None
+                if not add:
+                    grads[j] = self.get_grad_slot(j, num_cases, acts[s.layer].dtype)
+                l.bprop_acts(grads[s.layer], s.inp, inputs, acts[s.layer], grads[j], add)
+            if times is not None:
+                times[s.layer][1] += time() - start
+        return weight_grads, bias_grads
+    
+    # Applies the gradients with momentum and weight decay, as
+    # Weights::update. The gradients are used as work arrays.
+    def update_weights(self, weight_grads, bias_grads, num_cases):
+        for dic, i in self.weight_owners:
+            w, inc, eps = dic['weights'][i], dic['weightsInc'][i], dic['epsW'][i]
+            if eps > 0 and id(w) in weight_grads:
+                grad = weight_grads[id(w)]
+                inc *= dic['momW'][i]
+                grad *= eps / num_cases
+                inc += grad
+                if dic['wc'][i] > 0:
+                    n.multiply(w, dic['wc'][i] * eps, grad)
+                    inc -= grad
+                w += inc
+        for j, grad in bias_grads.iteritems():
+            dic = self.layer_dics[j]
+            dic['biasesInc'] *= dic['momB']
+            grad *= dic['epsB'] / num_cases
+            dic['biasesInc'] += grad
+            dic['biases'] += dic['biasesInc']
+            
+    def get_costs(self):
+        return dict((l.name, list(l.cost)) for l in self.cost_layers)
+    
+    def get_cost_value(self):
+        return sum(l.dic['coeff'] * l.cost[0] for l in self.cost_layers)
+    
+    @staticmethod
+    def add_costs(total, costs):
+        for name, c in costs.iteritems():
+            if name not in total:
+                total[name] = [0.0] * len(c)
+            total[name] = [a + b for a, b in zip(total[name], c)]
+            
+    def startBatch(self, data, test=False):
+        data = self.check_data(data)
+        costs = {}
+        for i in xrange(self.get_num_minibatches(data)):
+            mini = self.get_minibatch(data, i)
+            acts = self.fprop(mini, train=not test)
+            self.add_costs(costs, self.get_costs())
+            if not test:
+                weight_grads, bias_grads = self.bprop(acts)
+                self.update_weights(weight_grads, bias_grads, mini[0].shape[1])
+        self.result = (costs, data[0].shape[1])
+        
+    def finishBatch(self):
+        result, self.result = self.result, None
+        return result
+    
+    # Runs the views of num_cases cases through the net and yields
+    # (start, end, acts, probs) for consecutive chunks of them, where probs
+    # are the outputs of layer softmaxIdx averaged over the numViews views of
+    # cases start to end. get_views(start, end) returns the data matrices for
+    # these cases, holding the views one after another (case v * (end - start) + i
+    # is view v of case start + i), so that all views of a chunk go through
+    # the net in a single forward pass of at most minibatch_size cases.
+    def iter_multiview(self, num_cases, numViews, softmaxIdx, get_views):
+        chunk_size = max(1, self.minibatch_size / numViews)
+        for start in xrange(0, num_cases, chunk_size):
+            end = min(num_cases, start + chunk_size)
+            acts = self.fprop(get_views(start, end))
+            views = self.get_acts(acts, softmaxIdx)
+            probs = self.arena.get('multiview', (views.shape[0], end - start), views.dtype)
+            views.reshape(views.shape[0], numViews, end - start).mean(axis=1, out=probs)
+            yield start, end, acts, probs
+            
+    # Returns a get_views function for iter_multiview that stacks the views
+    # of data, numViews blocks of the same num_cases cases as given to
+    # startMultiviewTest.
+    def get_view_stacker(self, data, numViews, num_cases):
+        def get_views(start, end):
+            views = []
+            for i, d in enumerate(data):
+                stacked = self.arena.get(('views', i), (d.shape[0], numViews * (end - start)), d.dtype)
+                for v in xrange(numViews):
+                    stacked[:, v * (end - start):(v + 1) * (end - start)] = d[:, v * num_cases + start:v * num_cases + end]
+                views += [stacked]
+            return views
+        return get_views
+    
+    # Returns a get_views function for iter_multiview that makes the views of
+    # the images in data[0] with the multiview augmentation pipeline (see
+    # augment.py) as they're needed. The other matrices of data are repeated
+    # for every view.
+    def get_view_maker(self, data, pipeline):
+        def get_views(start, end):
+            num_out = pipeline.num_views * (end - start)
+            views = [pipeline.apply(data[0][:, start:end], target=self.arena.get(('views', 0), (pipeline.get_output_dims(), num_out), n.single))]
+            for i, d in enumerate(data[1:]):
+                stacked = self.arena.get(('views', i + 1), (d.shape[0], num_out), d.dtype)
+                stacked.reshape(d.shape[0], pipeline.num_views, end - start)[:] = d[:, n.newaxis, start:end]
+                views += [stacked]
+            return views
+        return get_views
+    
+    # Returns the number of cases in data and a get_views function for
+    # iter_multiview, for data as given to startMultiviewTest.
+    def get_view_source(self, data, numViews, pipeline=None):
+        if pipeline is not None:
+            return data[0].shape[1], self.get_view_maker(data, pipeline)
+        if numViews == 1:
+            return data[0].shape[1], lambda start, end: [d[:, start:end] for d in data]
+        num_cases = data[0].shape[1] / numViews
+        return num_cases, self.get_view_stacker(data, numViews, num_cases)
+    
+    # Returns the (outputs, cases) outputs of layer layerIdx (a softmax
+    # layer, if numViews > 1) for data as given to startMultiviewTest,
+    # averaged over the views of every case.
+    def get_outputs(self, data, layerIdx, numViews=1, pipeline=None):
+        data = self.check_data(data)
+        num_cases, get_views = self.get_view_source(data, numViews, pipeline)
+        outputs = None
+        for start, end, acts, probs in self.iter_multiview(num_cases, numViews, layerIdx, get_views):
+            if outputs is None:
+                outputs = n.empty((probs.shape[0], num_cases), dtype=probs.dtype)
+            outputs[:, start:end] = probs
+        return outputs
+    
+    # The data is numViews blocks of the same cases, one per view. The
+    # softmax outputs of the views are averaged and the logistic regression
+    # cost logregIdx is computed from the average. The other costs are
+    # averaged over the views.
+    #
+    # If pipeline is given, data holds every case once, with uncropped
+    # images, and the views are made from them by the pipeline instead.
+    def startMultiviewTest(self, data, numViews, logregIdx, pipeline=None):
+        data = self.check_data(data)
+        logreg = self.layers[logregIdx]
+        labels_idx, softmax_idx = logreg.dic['inputs']
+        num_cases, get_views = self.get_view_source(data, numViews, pipeline)
+        costs = {}
+        for start, end, acts, probs in self.iter_multiview(num_cases, numViews, softmax_idx, get_views):
+            softmax, logreg.softmax = logreg.softmax, None
+            logreg.fprop([acts[labels_idx][:, :end - start], probs], acts[logregIdx][:, :end - start], False)
+            logreg.softmax = softmax
+            for l in self.cost_layers:
+                if l is not logreg:
+                    l.cost = [c / numViews for c in l.cost]
+            self.add_costs(costs, self.get_costs())
+        self.result = (costs, num_cases)
+        
+    # The last matrix of data is a (cases, outputs) matrix for the outputs
+    # of layer layerIdx.
+    def startFeatureWriter(self, data, layerIdx):
+        if len(data) < 2:
+            raise ValueError("Expected the data arrays followed by the feature array")
+        ftrs = data[-1]
+        data = self.check_data(data[:-1])
+        costs = {}
+        for i in xrange(self.get_num_minibatches(data)):
+            acts = self.fprop(self.get_minibatch(data, i))
+            self.add_costs(costs, self.get_costs())
+            ftrs[i * self.minibatch_size:(i + 1) * self.minibatch_size] = self.get_acts(acts, layerIdx).T
+        self.result = (costs, data[0].shape[1])
+        
+    # Compares the gradients of all weight matrices and biases on the first
+    # minibatch of data with finite differences, as ConvNet::checkGradients,
+    # and exits.
+    def checkGradients(self, data):
+        mini = self.get_minibatch(self.check_data(data), 0)
+        num_cases = mini[0].shape[1]
+        acts = self.fprop(mini, train=True)
+        base_err = self.get_cost_value()
+        weight_grads, bias_grads = self.bprop(acts)
+        num_tests, num_failures = 0, 0
+        for l in self.layers:
+            if not isinstance(l, WeightLayer):
+                continue
+            checks = [("%s weights[%d]" % (l.name, i), l.W_STEP, w, weight_grads.get(id(w))) for i, w in enumerate(l.dic['weights'])]
+            checks += [("%s biases" % l.name, l.B_STEP, l.dic['biases'], bias_grads.get(l.idx))]
+            for name, eps, w, grad in checks:
+                num_grad = n.zeros(w.shape)
+                for idx in n.ndindex(w.shape):
+                    v = w[idx]
+                    w[idx] = v + eps
+                    self.fprop(mini)
+                    num_grad[idx] = (self.get_cost_value() - base_err) / (num_cases * eps)
+                    w[idx] = v
+                    if not n.isfinite(num_grad[idx]):
+                        print "Numerical computation produced nan or inf when checking '%s': %f" % (name, num_grad[idx])
+                        print "Consider reducing the sizes of the weights or finite difference steps."
+                        print "Exiting."
+                        sys.exit(1)
+                anal_grad = (n.zeros(w.shape) if grad is None else grad) * (-1.0 / num_cases)
+                anal_norm, num_norm = n.linalg.norm(anal_grad), n.linalg.norm(num_grad)
+                rel_err = n.linalg.norm(num_grad - anal_grad) / anal_norm
+                fail = not rel_err < GC_REL_ERR_THRESH
+                if fail:
+                    print "========================"
+                    print "(****FAIL****) %s GRADIENT CHECK" % name
+                    print "========================"
+                    print "Analytic norm: %e" % anal_norm
+                    print "Numeric norm:  %e" % num_norm
+                    print "Relative error: %e" % rel_err
+                num_tests += 1
+                num_failures += fail
+        print "------------------------"
+        if num_failures > 0:
+            print "%d/%d TESTS FAILED" % (num_failures, num_tests)
+        else:
+            print "ALL %d TESTS PASSED" % num_tests
+        sys.exit(0)
+        
+    # Times the forward and backward passes of every layer on the first
+    # minibatch of data, averaged over num_iters passes, and exits
+    def benchmark(self, data, num_iters):
+        mini = self.get_minibatch(self.check_data(data), 0)
+        self.bprop(self.fprop(mini, train=True))
+        times = [[0.0, 0.0] for l in self.layers]
+        num_allocs = self.arena.num_allocs
+        for i in xrange(num_iters):
+            self.bprop(self.fprop(mini, train=True, times=times), times=times)
+        print "Layer times on %d cases, averaged over %d passes:" % (mini[0].shape[1], num_iters)
+        print "%-16s %-14s %-18s %12s %12s" % ("Layer", "Type", "Config", "fprop (ms)", "bprop (ms)")
+        for l, (t_fwd, t_bwd) in zip(self.layers, times):
+            print "%-16s %-14s %-18s %12.3f %12.3f" % (l.name, l.dic['type'], l.describe(), 1000 * t_fwd / num_iters, 1000 * t_bwd / num_iters)
+        total_fwd, total_bwd = (sum(t) for t in zip(*times))
+        print "%-16s %-14s %-18s %12.3f %12.3f" % ("Total", "", "", 1000 * total_fwd / num_iters, 1000 * total_bwd / num_iters)
+        print "Arena: %d arrays (%.2f MB), %d allocated during the timed passes" % (len(self.arena.buffers), self.arena.get_num_bytes() / 1024.0**2, self.arena.num_allocs - num_allocs)
+        sys.exit(0)
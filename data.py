@@ -26,6 +26,8 @@ import numpy as n
 from numpy.random import randn, rand, random_integers
 import os
 from util import *
+from sampler import EpochSampler
+from shmdata import SharedBatchStore
 
 BATCH_META_FILE = "batches.meta"
 
@@ -46,9 +48,18 @@ class DataProvider:
         self.data_dic = None
         self.test = test
         self.batch_idx = batch_range.index(init_batchnum)
+        self.shared_store = None
+        if dp_params and dp_params.get('shared_data'):
+            self.shared_store = SharedBatchStore(data_dir)
+        self.sampler = None
+        if dp_params and dp_params.get('shuffle') and not test:
+            self.sampler = EpochSampler(len(batch_range), self.get_source_batch, case_keys=self.get_case_keys(),
+                                        window_size=dp_params.get('shuffle_window', 2), seed=dp_params.get('shuffle_seed', 0))
 
     def get_next_batch(self):
-        if self.data_dic is None or len(self.batch_range) > 1:
+        if self.sampler is not None:
+            self.data_dic = self.sampler.get_batch(self.curr_epoch, self.batch_idx)
+        elif self.data_dic is None or len(self.batch_range) > 1:
             self.data_dic = self.get_batch(self.curr_batchnum)
         epoch, batchnum = self.curr_epoch, self.curr_batchnum
         self.advance_batch()
@@ -78,11 +89,52 @@ class DataProvider:
                     break
         else:
             dic = unpickle(self.get_data_file_name(batch_num))
+        return DataProvider.map_batch_data(self.data_dir, dic)
+    
+    # Batches may keep their data matrix in a separate .npy file, named by the
+    # 'data_file' entry (see makedata.py). It is memory-mapped read-only.
+    @staticmethod
+    def map_batch_data(data_dir, dic):
+        if 'data' not in dic and 'data_file' in dic:
+            dic['data'] = n.load(os.path.join(data_dir, dic['data_file']), mmap_mode='r')
         return dic
     
     def get_data_dims(self):
         return self.batch_meta['num_vis']
     
+    # Loads a batch to be kept in memory. With dp_params['shared_data'], the
+    # batch comes from the shared store (see shmdata.py), so that all jobs on
+    # this host that use the same data directory share one read-only copy.
+    def get_resident_batch(self, batch_num):
+        if self.shared_store is None:
+            return self.get_batch(batch_num)
+        source_file = self.get_data_file_name(batch_num)
+        if not os.path.exists(source_file): # batch in sub-batches
+            source_file += '.1'
+        return self.shared_store.get_batch(batch_num, source_file, lambda: self.get_batch(batch_num))
+    
+    # Source batch i of the batch range, for the sampler
+    def get_source_batch(self, i):
+        return self.get_batch(self.batch_range[i])
+    
+    # Entries of a batch dict that have one column per case, for the sampler
+    def get_case_keys(self):
+        return ('data',)
+    
+    # Returns the dict of the batch at batch_idx: the stored batch, or one
+    # assembled by the sampler when shuffling (for the given epoch, by default
+    # the current one).
+    def get_batch_dic(self, batch_idx, epoch=None):
+        if self.sampler is not None:
+            return self.sampler.get_batch(self.curr_epoch if epoch is None else epoch, batch_idx)
+        return self.data_dic[batch_idx]
+    
+    # Called when the model is done with the oldest batch returned by
+    # get_next_batch that it hadn't finished yet, so that providers which
+    # reuse their output buffers may recycle it.
+    def finish_batch(self):
+        pass
+    
     def advance_batch(self):
         self.batch_idx = self.get_next_batch_idx()
         self.curr_batchnum = self.batch_range[self.batch_idx]
@@ -188,13 +240,17 @@ class MemoryDataProvider(DataProvider):
         DataProvider.__init__(self, data_dir, batch_range, init_epoch, init_batchnum, dp_params, test)
         self.data_dic = []
         for i in self.batch_range:
-            self.data_dic += [self.get_batch(i)]
+            self.data_dic += [self.get_resident_batch(i)]
     
     def get_next_batch(self):
         epoch, batchnum = self.curr_epoch, self.curr_batchnum
+        dic = self.get_batch_dic(self.batch_idx)
         self.advance_batch()
 
-        return epoch, batchnum, self.data_dic[batchnum - self.batch_range[0]]
+        return epoch, batchnum, dic
+    
+    def get_source_batch(self, i):
+        return self.data_dic[i]
 
 class LabeledDataProvider(DataProvider):   
     def __init__(self, data_dir, batch_range=None, init_epoch=1, init_batchnum=None, dp_params={}, test=False):
@@ -203,19 +259,25 @@ class LabeledDataProvider(DataProvider):
     def get_num_classes(self):
         return len(self.batch_meta['label_names'])
     
+    def get_case_keys(self):
+        return ('data', 'labels')
+    
 class LabeledMemoryDataProvider(LabeledDataProvider):
     def __init__(self, data_dir, batch_range, init_epoch=1, init_batchnum=None, dp_params={}, test=False):
         LabeledDataProvider.__init__(self, data_dir, batch_range, init_epoch, init_batchnum, dp_params, test)
         self.data_dic = []
         for i in batch_range:
-            self.data_dic += [unpickle(self.get_data_file_name(i))]
+            self.data_dic += [self.get_resident_batch(i)]
             self.data_dic[-1]["labels"] = n.c_[n.require(self.data_dic[-1]['labels'], dtype=n.single)]
             
     def get_next_batch(self):
         epoch, batchnum = self.curr_epoch, self.curr_batchnum
+        dic = self.get_batch_dic(self.batch_idx)
         self.advance_batch()
-        bidx = batchnum - self.batch_range[0]
-        return epoch, batchnum, self.data_dic[bidx]
+        return epoch, batchnum, dic
+    
+    def get_source_batch(self, i):
+        return self.data_dic[i]
     
 dp_types = {"default": "The default data provider; loads one batch into memory at a time",
             "memory": "Loads the entire dataset into memory",
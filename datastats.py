@@ -0,0 +1,220 @@
+# Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as n
+import os
+import sys
+import math
+from multiprocessing import Pool, cpu_count
+from getopt import GetoptError
+from util import pickle, unpickle, UnpickleError
+from options import *
+from data import DataProvider, BATCH_META_FILE
+
+class DatasetStatsError(Exception):
+    pass
+
+# Statistics of the cases of a dataset, accumulated one batch at a time:
+# the per-dimension mean, the mean and standard deviation of every color
+# channel (if the data are images) and the number of cases of every label.
+#
+# The channel statistics are kept as (count, mean, sum of squared deviations),
+# which merge exactly (Chan et al.), so batches may be summarized separately,
+# e.g. in different processes, and merged afterwards.
+class DatasetStats:
+    def __init__(self, num_vis, num_colors=0):
+        self.num_vis, self.num_colors = num_vis, num_colors
+        self.num_cases = 0
+        self.data_sum = n.zeros(num_vis, dtype=n.float64)
+        self.channel_mean = n.zeros(num_colors, dtype=n.float64)
+        self.channel_m2 = n.zeros(num_colors, dtype=n.float64)
+        self.label_counts = n.zeros(0, dtype=n.int64)
+        
+    # Adds a (num_vis, cases) data matrix and its labels
+    def add(self, data, labels=None):
+        stats = DatasetStats(self.num_vis, self.num_colors)
+        if data.shape[0] != self.num_vis:
+            raise DatasetStatsError("Batch has dimensionality %d, expected %d" % (data.shape[0], self.num_vis))
+        stats.num_cases = data.shape[1]
+        stats.data_sum = data.sum(axis=1, dtype=n.float64)
+        if self.num_colors > 0 and stats.num_cases > 0:
+            pixels = data.reshape(self.num_colors, -1)
+            stats.channel_mean = pixels.mean(axis=1, dtype=n.float64)
+            stats.channel_m2 = n.array([((p - m)**2).sum() for p, m in zip(n.float64(pixels), stats.channel_mean)])
+        if labels is not None:
+            stats.label_counts = n.bincount(n.int64(n.ravel(labels)))
+        self.merge(stats)
+        
+    def merge(self, other):
+        if (other.num_vis, other.num_colors) != (self.num_vis, self.num_colors):
+            raise DatasetStatsError("Can't merge statistics of data of different shapes")
+        num_cases = self.num_cases + other.num_cases
+        if num_cases > 0:
+            delta = other.channel_mean - self.channel_mean
+            pixels_self, pixels_other = self.__pixels_per_channel(self.num_cases), self.__pixels_per_channel(other.num_cases)
+            pixels = pixels_self + pixels_other
+            self.channel_mean = self.channel_mean + delta * pixels_other / pixels
+            self.channel_m2 = self.channel_m2 + other.channel_m2 + delta**2 * pixels_self * pixels_other / pixels
+        self.num_cases = num_cases
+        self.data_sum = self.data_sum + other.data_sum
+        counts = n.zeros(max(len(self.label_counts), len(other.label_counts)), dtype=n.int64)
+        counts[:len(self.label_counts)] += self.label_counts
+        counts[:len(other.label_counts)] += other.label_counts
+        self.label_counts = counts
+        
+    def __pixels_per_channel(self, num_cases):
+        return float(num_cases * (self.num_vis / max(self.num_colors, 1)))
+    
+    # The batches.meta entries. label_names defaults to the label numbers.
+    def get_meta(self, label_names=None):
+        if self.num_cases == 0:
+            raise DatasetStatsError("No cases")
+        if label_names is None:
+            label_names = [str(i) for i in xrange(len(self.label_counts))]
+        if len(label_names) < len(self.label_counts):
+            raise DatasetStatsError("Labels go up to %d, but there are only %d label names" % (len(self.label_counts) - 1, len(label_names)))
+        meta = {'num_vis': self.num_vis,
+                'num_cases': self.num_cases,
+                'data_mean': (self.data_sum / self.num_cases).reshape((self.num_vis, 1)),
+                'label_names': label_names,
+                'label_counts': n.r_[self.label_counts, n.zeros(len(label_names) - len(self.label_counts), dtype=n.int64)]}
+        if self.num_colors > 0:
+            meta['num_colors'] = self.num_colors
+            meta['img_size'] = get_img_size(self.num_vis, self.num_colors)
+            meta['channel_mean'] = self.channel_mean.copy()
+            meta['channel_std'] = n.sqrt(self.channel_m2 / self.__pixels_per_channel(self.num_cases))
+        return meta
+    
+# The side of square images with num_colors colors and num_vis dimensions, or None
+def get_img_size(num_vis, num_colors):
+    size = int(round(math.sqrt(num_vis / num_colors)))
+    return size if size**2 * num_colors == num_vis else None
+
+# Loads data_batch_<batch_num> the way DataProvider.get_batch does, without needing batches.meta
+def load_batch(data_dir, batch_num):
+    path = os.path.join(data_dir, 'data_batch_%d' % batch_num)
+    if not os.path.exists(path) and os.path.exists(path + '.1'): # batch in sub-batches
+        dic = unpickle(path + '.1')
+        i = 2
+        while os.path.exists('%s.%d' % (path, i)):
+            dic['data'] = n.r_[dic['data'], unpickle('%s.%d' % (path, i))['data']]
+            i += 1
+        return dic
+    return DataProvider.map_batch_data(data_dir, unpickle(path))
+
+def get_batch_stats(args):
+    data_dir, batch_num, num_vis, num_colors = args
+    dic = load_batch(data_dir, batch_num)
+    stats = DatasetStats(num_vis, num_colors)
+    stats.add(dic['data'], dic.get('labels'))
+    return stats
+
+# Summarizes the given batches of data_dir in num_workers processes. The
+# per-batch statistics are merged in batch order, so the result doesn't
+# depend on the number of workers.
+def compute_stats(data_dir, batch_nums, num_colors=3, num_workers=1):
+    if len(batch_nums) == 0:
+        raise DatasetStatsError("No data batches in %s" % data_dir)
+    num_vis = load_batch(data_dir, batch_nums[0])['data'].shape[0]
+    if num_colors > 0 and get_img_size(num_vis, num_colors) is None:
+        raise DatasetStatsError("Data dimensionality %d is not that of square images with %d colors (use --num-colors=0 for non-image data)" % (num_vis, num_colors))
+    stats = DatasetStats(num_vis, num_colors)
+    tasks = [(data_dir, b, num_vis, num_colors) for b in batch_nums]
+    if num_workers > 1:
+        pool = Pool(processes=num_workers)
+        try:
+            for s in pool.imap(get_batch_stats, tasks):
+                stats.merge(s)
+        finally:
+            pool.terminate()
+    else:
+        for t in tasks:
+            stats.merge(get_batch_stats(t))
+    return stats
+
+# Writes batches.meta by renaming a complete temporary file over it, so that readers
+# never see a partial file. Entries of the existing file that meta doesn't replace are kept.
+def write_meta(data_dir, meta):
+    path = os.path.join(data_dir, BATCH_META_FILE)
+    if os.path.exists(path):
+        old_meta = unpickle(path)
+        old_meta.update(meta)
+        meta = old_meta
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        pickle(tmp_path, meta)
+        os.rename(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    
+# The batches that data_mean and the other statistics in batches.meta were computed on,
+# or [] if they weren't computed by this script
+def get_summarized_batches(data_dir):
+    path = os.path.join(data_dir, BATCH_META_FILE)
+    if not os.path.exists(path):
+        return []
+    return list(unpickle(path).get('stats_batches', []))
+    
+def read_label_names(path):
+    return [l.strip() for l in open(path) if l.strip()]
+
+def get_options_parser():
+    op = OptionsParser()
+    op.add_option("data-path", "data_path", StringOptionParser, "Data directory")
+    op.add_option("batch-range", "batch_range", ListOptionParser(RangeOptionParser), "Batches to summarize: the training batches (default: the batches summarized last time)", default=[])
+    op.add_option("num-colors", "num_colors", IntegerOptionParser, "Number of color channels of the images (0 if the data aren't images)", default=3)
+    op.add_option("label-names", "label_names", StringOptionParser, "File with one label name per line (default: keep the existing names, or use the label numbers)", default="")
+    op.add_option("workers", "workers", IntegerOptionParser, "Number of worker processes", default=cpu_count())
+    return op
+
+if __name__ == "__main__":
+    op = get_options_parser()
+    try:
+        op.parse()
+        data_path = op.get_value('data_path')
+        batch_nums = sum(op.get_value('batch_range'), []) or get_summarized_batches(data_path)
+        if not batch_nums:
+            raise OptionMissingException("Option --batch-range (the training batches) not supplied, and %s doesn't record the batches summarized last time" % BATCH_META_FILE)
+        stats = compute_stats(data_path, batch_nums, op.get_value('num_colors'), op.get_value('workers'))
+        label_names = None
+        if op.get_value('label_names'):
+            label_names = read_label_names(op.get_value('label_names'))
+        elif os.path.exists(os.path.join(data_path, BATCH_META_FILE)):
+            label_names = unpickle(os.path.join(data_path, BATCH_META_FILE)).get('label_names')
+        meta = stats.get_meta(label_names)
+        meta['stats_batches'] = batch_nums
+        write_meta(data_path, meta)
+        print "Summarized %d cases in %d batches of %s" % (stats.num_cases, len(batch_nums), data_path)
+        if 'channel_mean' in meta:
+            print "Channel means: %s" % ", ".join("%.3f" % m for m in meta['channel_mean'])
+            print "Channel stdevs: %s" % ", ".join("%.3f" % s for s in meta['channel_std'])
+        print "Label counts: %s" % ", ".join("%s: %d" % (l, c) for l, c in zip(meta['label_names'], meta['label_counts']))
+    except OptionMissingException, e:
+        print e
+        op.print_usage()
+    except (OptionException, GetoptError, UnpickleError, DatasetStatsError, OSError), e:
+        print "----------------"
+        print "Error:"
+        print e
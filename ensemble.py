@@ -0,0 +1,197 @@
+# Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as n
+import os
+import sys
+import getopt as opt
+from util import *
+from gpumodel import IGPUModel, ModelStateException
+from convnet import ConvNet
+from exportnet import EXPORT_FORMAT, load_inference_layers
+from options import *
+import cpunet
+
+MEMORY_MODES = ('concurrent', 'swap')
+
+class EnsembleError(Exception):
+    pass
+
+# Returns the layer dicts of the model in the given checkpoint (directory
+# or file) or exported model (see exportnet.py).
+def load_member_layers(path):
+    dic = unpickle(IGPUModel.get_checkpoint_file(path))
+    if dic.get('format') == EXPORT_FORMAT:
+        return load_inference_layers(dic['layers'])
+    return dic['model_state']['layers']
+
+# The logistic regression cost and error of the given (classes, cases)
+# probabilities, summed over cases, as computed by the logreg cost layer
+def get_logreg_costs(probs, labels):
+    cases = n.arange(len(labels))
+    label_probs = probs[labels, cases]
+    maxes = probs.max(axis=0)
+    correct = (label_probs == maxes) / (probs == maxes).sum(axis=0)
+    return [-float(n.log(label_probs).sum()), len(labels) - float(correct.sum())]
+
+# One model of the ensemble, run by the CPU backend. In swap mode, its
+# layers are loaded from disk for every batch and dropped after it, so that
+# only one member is in memory at a time.
+class EnsembleMember:
+    def __init__(self, path, weight, logreg_name, swap, minibatch_size):
+        self.path, self.weight = path, weight
+        self.swap, self.minibatch_size = swap, minibatch_size
+        layers = load_member_layers(path)
+        names = [l['name'] for l in layers]
+        if logreg_name not in names or layers[names.index(logreg_name)]['type'] != 'cost.logreg':
+            raise EnsembleError("%s has no logistic regression cost layer named '%s'" % (path, logreg_name))
+        self.labels_idx, self.softmax_idx = layers[names.index(logreg_name)]['inputs']
+        self.labels_data_idx = layers[self.labels_idx]['dataIdx']
+        self.num_classes = layers[self.softmax_idx]['outputs']
+        self.data_dims = [l['outputs'] for l in layers if l['type'] == 'data']
+        self.model = None
+        if not swap:
+            self.model = self.init_model(layers)
+            
+    def init_model(self, layers):
+        model = cpunet.CPUModel()
+        try:
+            model.initModel(layers, self.minibatch_size)
+        except cpunet.CPUModelError, e:
+            raise EnsembleError("%s: %s" % (self.path, e))
+        return model
+        
+    # Returns the member's softmax outputs for data, averaged over views as
+    # by CPUModel.startMultiviewTest
+    def get_probs(self, data, num_views, pipeline):
+        model = self.init_model(load_member_layers(self.path)) if self.swap else self.model
+        return model.get_outputs(data, self.softmax_idx, num_views, pipeline)
+    
+# Streams the test batches of the first checkpoint (-f) once through the
+# models of all checkpoints given by -f and --members, and averages their
+# softmax outputs, weighted by --weights. The members are run by the CPU
+# backend, since the C++ module can hold only one model per process. They
+# must take the same data as the first checkpoint.
+class EnsembleConvNet(ConvNet):
+    def __init__(self, op, load_dic):
+        op.set_value('cpu', True, parse=False)
+        ConvNet.__init__(self, op, load_dic)
+        
+    def init_model_state(self):
+        self.test_one = False
+        if self.ensemble_memory not in MEMORY_MODES:
+            raise ModelStateException("Unknown memory mode '%s'; should be one of %s" % (self.ensemble_memory, ", ".join(MEMORY_MODES)))
+        if not self.logreg_name:
+            raise ModelStateException("The ensemble needs the name of the models' logistic regression cost layer (--logreg-name)")
+        self.member_paths = [self.load_file] + self.members
+        weights = self.weights or [1.0] * len(self.member_paths)
+        if len(weights) != len(self.member_paths):
+            raise ModelStateException("%d weights given for %d members" % (len(weights), len(self.member_paths)))
+        if min(weights) < 0 or sum(weights) <= 0:
+            raise ModelStateException("The member weights must be non-negative and not all zero")
+        self.member_weights = [w / float(sum(weights)) for w in weights]
+        
+    def import_model(self):
+        pass
+    
+    def init_model_lib(self):
+        swap = self.ensemble_memory == 'swap'
+        self.ensemble = []
+        try:
+            for path, weight in zip(self.member_paths, self.member_weights):
+                print "Loading %s" % path
+                self.ensemble += [EnsembleMember(path, weight, self.logreg_name, swap, self.minibatch_size)]
+        except (UnpickleError, EnsembleError), e:
+            print e
+            sys.exit(1)
+        first = self.ensemble[0]
+        for m in self.ensemble[1:]:
+            if m.num_classes != first.num_classes or m.data_dims != first.data_dims:
+                print "%s does not take the same data or predict the same classes as %s" % (m.path, first.path)
+                sys.exit(1)
+        if swap:
+            del self.model_state['layers'] # the first member is loaded with every batch too
+        
+    def start_batch(self, batch_data, train=False):
+        data = batch_data[2]
+        num_views, pipeline = 1, None
+        if self.multiview_test:
+            num_views = self.test_data_provider.num_views
+            if getattr(self.test_data_provider, 'lazy_views', False):
+                pipeline = self.test_data_provider.pipeline
+        costs = {}
+        combined = None
+        for i, m in enumerate(self.ensemble):
+            probs = m.get_probs(data, num_views, pipeline)
+            labels = cpunet.get_labels(data[m.labels_data_idx][:, :probs.shape[1]])
+            costs['member %d' % i] = get_logreg_costs(probs, labels)
+            if combined is None:
+                combined = n.zeros(probs.shape, dtype=n.double)
+            combined += m.weight * probs
+        costs['ensemble'] = get_logreg_costs(combined, labels)
+        self.result = (costs, combined.shape[1])
+        
+    def finish_batch(self):
+        result, self.result = self.result, None
+        return result
+    
+    def print_test_results(self):
+        costs, num_cases = self.test_outputs[-1]
+        print "%-8s %-48s %8s %10s %10s" % ("member", "checkpoint", "weight", "logprob", "error")
+        for i, m in enumerate(self.ensemble):
+            logprob, err = costs['member %d' % i]
+            print "%-8d %-48s %8.4f %10.6f %10.6f" % (i, m.path, m.weight, logprob / num_cases, err / num_cases)
+        logprob, err = costs['ensemble']
+        print "%-8s %-48s %8s %10.6f %10.6f" % ("all", "", "", logprob / num_cases, err / num_cases)
+        print "(%d test cases)" % num_cases
+    
+    def start(self):
+        print "Testing an ensemble of %d models on batches %s (%s memory)" % (len(self.ensemble), self.options['test_batch_range'].get_str_value(), self.ensemble_memory)
+        self.test_outputs += [self.get_test_error()]
+        self.print_test_results()
+        sys.exit(0)
+        
+    @classmethod
+    def get_options_parser(cls):
+        op = ConvNet.get_options_parser()
+        for option in list(op.options):
+            if option not in ('load_file', 'test_batch_range', 'minibatch_size', 'multiview_test', 'logreg_name', 'strict_arrays', 'cpu'):
+                op.delete_option(option)
+        op.add_option("members", "members", ListOptionParser(StringOptionParser), "Checkpoints or exported models to average with the one given to -f", default=[])
+        op.add_option("weights", "weights", ListOptionParser(FloatOptionParser), "Weights of the softmax outputs of the members (-f first; default: equal)", default=[])
+        op.add_option("ensemble-memory", "ensemble_memory", StringOptionParser, "Hold the member models in memory at the same time (concurrent) or load them for every batch (swap)?", default='concurrent')
+        
+        op.options['load_file'].default = None
+        return op
+    
+if __name__ == "__main__":
+    try:
+        op = EnsembleConvNet.get_options_parser()
+        op, load_dic = IGPUModel.parse_options(op)
+        model = EnsembleConvNet(op, load_dic)
+        model.start()
+    except (UnpickleError, EnsembleError, opt.GetoptError), e:
+        print "----------------"
+        print "Error:"
+        print e
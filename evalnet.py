@@ -0,0 +1,214 @@
+# Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import glob
+import getopt as opt
+from multiprocessing import Pool
+from util import *
+from data import DataProvider, DataProviderException
+from shmdata import SharedBatchStore
+from gpumodel import IGPUModel, ModelStateException
+from convnet import ConvNet
+from options import *
+import cpunet
+
+# Tab-separated columns of the results table
+RESULTS_HEADER = ('checkpoint', 'mtime', 'epoch.batch', 'cases', 'costs')
+
+class EvalError(Exception):
+    pass
+
+# Tests the model in one checkpoint file. This runs in a worker process,
+# so it has to be a module-level function. Returns the path, the epoch,
+# batch, data path and test outputs (as ConvNet.get_test_error) of the
+# checkpoint, and an error message.
+def evaluate_checkpoint(args):
+    path, op = args
+    try:
+        load_dic = unpickle(path)
+        op.set_value('load_file', path, parse=False)
+        old_op = load_dic["op"]
+        old_op.merge_from(op)
+        old_op.eval_expr_defaults()
+        model = EvalConvNet(old_op, load_dic)
+        return path, (model.epoch, model.batchnum, model.data_path, model.get_test_error()), None
+    except (UnpickleError, OptionException, DataProviderException, ModelStateException, cpunet.CPUModelError), e:
+        return path, None, str(e)
+    except SystemExit:
+        return path, None, "unable to load the model (see above)"
+    except Exception, e: # any other failure is this checkpoint's alone
+        return path, None, "%s: %s" % (e.__class__.__name__, e)
+    
+# Returns the checkpoint files given by the glob patterns. A directory
+# stands for all the checkpoints in it, oldest first.
+def find_checkpoints(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern), key=alphanum_key)
+        if len(matches) == 0:
+            print "No checkpoints match '%s'" % pattern
+        for m in matches:
+            files = [os.path.join(m, f) for f in IGPUModel.get_checkpoint_files(m)] if os.path.isdir(m) else [m]
+            if len(files) == 0:
+                print "No checkpoints in %s" % m
+            paths += [f for f in files if f not in paths]
+    return paths
+
+# Returns the rows of the results table at path by checkpoint, as lists of
+# column values
+def read_results(path):
+    results = {}
+    if os.path.exists(path):
+        for line in open(path):
+            row = line.rstrip('\n').split('\t')
+            if len(row) == len(RESULTS_HEADER) and row[0] != RESULTS_HEADER[0]:
+                results[row[0]] = row
+    return results
+
+def write_results(path, results):
+    f = open(path + '.tmp', 'w')
+    f.write('\t'.join(RESULTS_HEADER) + '\n')
+    for name in sorted(results, key=alphanum_key):
+        f.write('\t'.join(results[name]) + '\n')
+    f.close()
+    os.rename(path + '.tmp', path)
+    
+def format_costs(costs, num_cases):
+    return "; ".join("%s: %s" % (name, ", ".join("%.6f" % (v / num_cases) for v in costs[name])) for name in sorted(costs))
+
+def parse_costs(s):
+    return dict((name, [float(v) for v in values.split(', ')]) for name, values in (c.split(': ') for c in s.split('; ')))
+
+# A test-only model for evaluate_checkpoint. It uses the layers stored in
+# the checkpoint, runs them with the CPU backend and gets its test batches
+# from the shared data store (see shmdata.py), so that the batches are
+# decoded only once for all the worker processes.
+class EvalConvNet(ConvNet):
+    def __init__(self, op, load_dic):
+        op.set_value('cpu', True, parse=False)
+        op.set_value('shared_data', True, parse=False)
+        ConvNet.__init__(self, op, load_dic)
+        
+    def init_data_providers(self):
+        class Dummy:
+            def advance_batch(self):
+                pass
+        self.dp_params['convnet'] = self
+        self.test_data_provider = DataProvider.get_instance(self.data_path, self.test_batch_range,
+                                                            type=self.dp_type, dp_params=self.dp_params, test=True)
+        self.train_data_provider = Dummy()
+        
+    def init_model_state(self):
+        self.test_one, self.test_only = False, False
+        if self.multiview_test:
+            if not hasattr(self.test_data_provider, 'num_views') or not hasattr(self.test_data_provider, 'pipeline'):
+                raise ModelStateException("Data provider '%s' doesn't support --multiview-test" % self.dp_type)
+            self.logreg_idx = self.get_layer_idx(self.logreg_name, check_type='cost.logreg')
+            
+    def import_model(self):
+        self.libmodel = cpunet.CPUModel()
+        
+    def init_model_lib(self):
+        self.libmodel.initModel(self.layers, self.minibatch_size)
+        
+    def start_batch(self, batch_data, train=False):
+        data = batch_data[2]
+        if self.multiview_test:
+            self.libmodel.startMultiviewTest(data, self.test_data_provider.num_views, self.logreg_idx, self.test_data_provider.pipeline)
+        else:
+            self.libmodel.startBatch(data, True)
+            
+# Tests the checkpoints given by --checkpoints in a pool of --eval-workers
+# processes and writes their test costs to the table at --results-path.
+# Checkpoints that the table already has a row for, with the same
+# modification time, are skipped. The other options override those of the
+# checkpoints.
+def evaluate_checkpoints(op):
+    results_path = op.get_value('results_path')
+    results = read_results(results_path)
+    jobs = []
+    for path in find_checkpoints(op.get_value('checkpoints')):
+        if path in results and results[path][1] == "%d" % os.path.getmtime(path):
+            continue
+        jobs += [(path, op)]
+    print "Testing %d checkpoints (%d already tested)" % (len(jobs), len(results))
+    
+    if len(jobs) > 0:
+        # The workers keep the shared data store open between checkpoints
+        pool = Pool(processes=min(op.get_value('eval_workers'), len(jobs)))
+        data_paths = set()
+        for path, output, err in pool.imap_unordered(evaluate_checkpoint, jobs, chunksize=1):
+            if err is not None:
+                print "Error testing %s: %s" % (path, err)
+                continue
+            epoch, batchnum, data_path, (costs, num_cases) = output
+            data_paths.add(data_path)
+            results[path] = [path, "%d" % os.path.getmtime(path), "%d.%d" % (epoch, batchnum), "%d" % num_cases, format_costs(costs, num_cases)]
+            print "%s: %s" % (path, results[path][-1])
+            write_results(results_path, results)
+        pool.close()
+        pool.join()
+        # Pool workers exit without closing their stores, so they're removed here unless other jobs use them
+        for data_path in data_paths:
+            SharedBatchStore(data_path).close()
+    write_results(results_path, results)
+    
+    best_cost = op.get_value('best_cost')
+    if best_cost:
+        scored = [(parse_costs(row[-1]).get(best_cost), name) for name, row in results.iteritems()]
+        scored = sorted((c[op.get_value('cost_idx')], name) for c, name in scored if c is not None)
+        if len(scored) == 0:
+            raise EvalError("No tested checkpoint has a cost named '%s'" % best_cost)
+        print "Best checkpoint by %s[%d]: %s (%.6f)" % (best_cost, op.get_value('cost_idx'), scored[0][1], scored[0][0])
+    print "Wrote results of %d checkpoints to %s" % (len(results), results_path)
+    
+def get_options_parser():
+    op = ConvNet.get_options_parser()
+    for option in list(op.options):
+        if option not in ('load_file', 'test_batch_range', 'minibatch_size', 'multiview_test', 'logreg_name', 'cpu', 'shared_data'):
+            op.delete_option(option)
+    op.add_option("checkpoints", "checkpoints", ListOptionParser(StringOptionParser), "Checkpoint files, checkpoint directories (all the checkpoints in them) or glob patterns to test", excuses=['load_file', 'test_batch_range'])
+    op.add_option("results-path", "results_path", StringOptionParser, "Table of test costs to write; checkpoints already in it are skipped")
+    op.add_option("eval-workers", "eval_workers", IntegerOptionParser, "Number of worker processes", default=4)
+    op.add_option("best-cost", "best_cost", StringOptionParser, "Print the checkpoint with the lowest value of this cost", default="")
+    op.add_option("cost-idx", "cost_idx", IntegerOptionParser, "Cost function return value index for --best-cost", default=0)
+    
+    op.options['load_file'].default = None
+    return op
+    
+if __name__ == "__main__":
+    try:
+        op = get_options_parser()
+        op.parse()
+        op.eval_expr_defaults()
+        evaluate_checkpoints(op)
+    except OptionMissingException, e:
+        print e
+        op.print_usage()
+    except (OptionException, EvalError, opt.GetoptError), e:
+        print "----------------"
+        print "Error:"
+        print e
@@ -0,0 +1,222 @@
+# Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as n
+import os
+import sys
+import getopt as opt
+from multiprocessing import Process, Pipe
+from util import *
+from gpumodel import IGPUModel, ModelStateException
+from convnet import ConvNet
+from options import *
+
+EXPORT_FORMAT = 'convnet-inference'
+EXPORT_VERSION = 1
+
+# Layer dict entries that only matter for training. The exported model
+# does not store them; load_inference_layers fills in neutral values
+# so that the layers can be given to the backends unchanged.
+TRAINING_KEYS = ('weightsInc', 'biasesInc', 'epsW', 'epsB', 'momW', 'momB', 'wc',
+                 'initW', 'initB', 'initWFunc', 'initBFunc', 'weightSource', 'inputLayers')
+
+# Half-precision matrices are scaled by a power of two so that their largest
+# magnitude lands just below 2^FP16_SCALE_EXP. This keeps small weights out of
+# the float16 subnormal range, and dividing by the scale again is exact.
+FP16_SCALE_EXP = 14
+
+class ExportError(Exception):
+    pass
+
+def get_fp16_scale(mat):
+    maxabs = float(n.abs(mat).max()) if mat.size > 0 else 0
+    if maxabs == 0 or not n.isfinite(maxabs):
+        return 1.0
+    return 2.0 ** (FP16_SCALE_EXP - int(n.ceil(n.log2(maxabs))))
+
+def encode_matrix(mat, fp16):
+    if not fp16:
+        return mat, 1.0
+    scale = get_fp16_scale(mat)
+    return (mat * scale).astype(n.float16), scale
+
+def decode_matrix(mat, scale):
+    mat = mat.astype(n.single) # keeps the memory order of the stored matrix
+    if scale != 1:
+        mat /= n.single(scale)
+    return mat
+
+# Returns copies of the given layer dicts without their training state,
+# with weight matrices and biases optionally stored as scaled float16.
+# Matrices shared between layers are stored once.
+def export_layers(layers, fp16=False):
+    encoded = {}
+    def encode(mat):
+        if id(mat) not in encoded:
+            encoded[id(mat)] = encode_matrix(mat, fp16)
+        return encoded[id(mat)]
+    exported = []
+    for l in layers:
+        e = dict((k, v) for k, v in l.iteritems() if k not in TRAINING_KEYS)
+        if 'weights' in l:
+            e['weights'], e['weightsScale'] = zip(*[encode(w) for w in l['weights']])
+            e['weights'], e['weightsScale'] = list(e['weights']), list(e['weightsScale'])
+            e['biases'], e['biasesScale'] = encode(l['biases'])
+        exported += [e]
+    return exported
+
+# Turns exported layer dicts back into layer dicts that the backends accept:
+# float32 weights and biases, zero increment buffers and zero learning rates.
+def load_inference_layers(exported):
+    decoded, zeros = {}, {}
+    def decode(mat, scale):
+        if id(mat) not in decoded:
+            decoded[id(mat)] = decode_matrix(mat, scale)
+            zeros[id(mat)] = n.zeros_like(decoded[id(mat)])
+        return decoded[id(mat)], zeros[id(mat)]
+    layers = []
+    for e in exported:
+        l = dict((k, v) for k, v in e.iteritems() if k not in ('weightsScale', 'biasesScale'))
+        if 'weights' in e:
+            l['weights'], l['weightsInc'] = [list(m) for m in zip(*[decode(w, s) for w, s in zip(e['weights'], e['weightsScale'])])]
+            l['biases'], l['biasesInc'] = decode(e['biases'], e['biasesScale'])
+            num_weights = len(l['weights'])
+            l['epsW'], l['momW'], l['wc'] = [0.0] * num_weights, [0.0] * num_weights, [0.0] * num_weights
+            l['epsB'], l['momB'] = 0.0, 0.0
+            l['gradConsumer'] = False
+        layers += [l]
+    return layers
+
+# Loads a model written by ExportConvNet. Returns the artifact dict with its
+# layers ready for libmodel.initModel.
+def load_inference_model(filename):
+    dic = unpickle(filename)
+    if type(dic) != dict or dic.get('format') != EXPORT_FORMAT:
+        raise ExportError("File '%s' is not an exported model." % filename)
+    if dic['version'] > EXPORT_VERSION:
+        raise ExportError("File '%s' has export version %d; this version of exportnet.py reads up to version %d." % (filename, dic['version'], EXPORT_VERSION))
+    dic['layers'] = load_inference_layers(dic['layers'])
+    return dic
+
+class ExportConvNet(ConvNet):
+    def __init__(self, op, load_dic):
+        ConvNet.__init__(self, op, load_dic)
+    
+    def get_gpus(self):
+        self.need_gpu = self.op.get_value('check_export')
+        if self.need_gpu:
+            ConvNet.get_gpus(self)
+    
+    def init_data_providers(self):
+        class Dummy:
+            def advance_batch(self):
+                pass
+        if self.need_gpu:
+            ConvNet.init_data_providers(self)
+        else:
+            self.train_data_provider = self.test_data_provider = Dummy()
+    
+    def init_model_state(self):
+        if self.op.get_value('multiview_test'):
+            self.logreg_idx = self.get_layer_idx(self.op.get_value('logreg_name'), check_type='cost.logreg')
+    
+    # The C++ module allows only one model per process, so each model
+    # given to --check-export is loaded and tested in its own process.
+    def import_model(self):
+        pass
+    
+    def init_model_lib(self):
+        pass
+    
+    def get_test_error_with(self, layers):
+        def run(conn):
+            self.layers = layers
+            ConvNet.import_model(self)
+            ConvNet.init_model_lib(self)
+            conn.send(self.get_test_error())
+        parent_conn, child_conn = Pipe(duplex=False)
+        p = Process(target=run, args=(child_conn,))
+        p.start()
+        try:
+            test_error = parent_conn.recv()
+        except EOFError:
+            test_error = None
+        p.join()
+        if test_error is None:
+            raise ExportError("Testing process exited with code %d." % p.exitcode)
+        return test_error
+    
+    def check_export_accuracy(self, exported):
+        self.test_one = False
+        print "Testing checkpoint on batches %s..." % self.options['test_batch_range'].get_str_value()
+        full_costs, full_cases = self.get_test_error_with(self.layers)
+        print "Testing exported model..."
+        exp_costs, exp_cases = self.get_test_error_with(load_inference_layers(exported))
+        print "%-20s %12s %12s %12s" % ("cost", "checkpoint", "exported", "delta")
+        for name in sorted(full_costs.keys()):
+            for i, (f, e) in enumerate(zip(full_costs[name], exp_costs[name])):
+                f, e = f / full_cases, e / exp_cases
+                print "%-20s %12.6f %12.6f %+12.6f" % ("%s[%d]" % (name, i), f, e, e - f)
+    
+    def start(self):
+        fp16 = self.op.get_value('fp16')
+        checkpoint_file = IGPUModel.get_checkpoint_file(self.load_file)
+        exported = export_layers(self.layers, fp16=fp16)
+        pickle(self.export_path, {'format': EXPORT_FORMAT,
+                                  'version': EXPORT_VERSION,
+                                  'dtype': 'float16' if fp16 else 'float32',
+                                  'layers': exported,
+                                  'source_model': self.load_file,
+                                  'epoch': self.epoch,
+                                  'batchnum': self.batchnum},
+               compress=self.op.get_value('zip_save'))
+        print "Wrote %s (%.2f MB; checkpoint %s: %.2f MB)" % (self.export_path, os.path.getsize(self.export_path) / 1024.0**2,
+                                                               checkpoint_file, os.path.getsize(checkpoint_file) / 1024.0**2)
+        if self.check_export:
+            self.check_export_accuracy(exported)
+        sys.exit(0)
+    
+    @classmethod
+    def get_options_parser(cls):
+        op = ConvNet.get_options_parser()
+        for option in list(op.options):
+            if option not in ('gpu', 'load_file', 'test_batch_range', 'zip_save', 'strict_arrays', 'cpu'):
+                op.delete_option(option)
+        op.add_option("export-path", "export_path", StringOptionParser, "Write the inference-only model to this file")
+        op.add_option("fp16", "fp16", BooleanOptionParser, "Store weights and biases as scaled half-precision floats?", default=1)
+        op.add_option("check-export", "check_export", BooleanOptionParser, "Compare the test costs of the checkpoint and the exported model on --test-range?", default=0)
+        
+        op.options['load_file'].default = None
+        return op
+    
+if __name__ == "__main__":
+    try:
+        op = ExportConvNet.get_options_parser()
+        op, load_dic = IGPUModel.parse_options(op)
+        model = ExportConvNet(op, load_dic)
+        model.start()
+    except (UnpickleError, ExportError, opt.GetoptError), e:
+        print "----------------"
+        print "Error:"
+        print e 
@@ -0,0 +1,172 @@
+# Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as n
+import os
+import hashlib
+from layer import LayerWithInputParser
+
+# Layers whose output is random, so caching it would change the model
+STOCHASTIC_LAYER_TYPES = ('rscale',)
+
+class FeatureCacheError(Exception):
+    pass
+
+# Returns the indices of the layers of the frozen prefix of the net: the
+# layers with no gradient consumers at or below them, whose outputs
+# therefore never change during training. Data and cost layers are never
+# part of it, and neither are layers that share weights, since those may be
+# trained through the layer they share them with.
+def get_frozen_layers(layers):
+    frozen = set()
+    for i, l in enumerate(layers):
+        if l['type'] == 'data' or l['type'].startswith('cost.') or l['type'] in STOCHASTIC_LAYER_TYPES:
+            continue
+        if LayerWithInputParser.grad_consumers_below(l) or max([s >= 0 for s in l.get('weightSourceLayerIndices', [])] + [False]):
+            continue
+        if i in [s for l2 in layers for s in l2.get('weightSourceLayerIndices', [])]:
+            continue
+        if all(layers[j]['type'] == 'data' or j in frozen for j in l['inputs']):
+            frozen.add(i)
+    return frozen
+
+# The frozen layers whose outputs are used by the rest of the net
+def get_frontier(layers, frozen):
+    return sorted(set(j for i, l in enumerate(layers) if i not in frozen for j in l.get('inputs', []) if j in frozen))
+
+# Builds the layer list of the trainable suffix of the net: the layers that
+# aren't frozen, with every frontier layer replaced by a data layer that
+# produces its cached outputs. The data layers of the original net that the
+# suffix still uses (e.g. labels) come first.
+#
+# The layers are shallow copies, so they share their weight matrices with
+# the original layers and syncing the suffix model updates the full net.
+#
+# Returns (suffix layers, data sources, index map). The data sources say,
+# for every data matrix the suffix takes, where it comes from:
+# ('data', index in the original provider's output) or ('layer', frontier layer index).
+# The index map maps layer indices of the full net to those of the suffix.
+def make_suffix_layers(layers, frozen, frontier):
+    trainable = [i for i in xrange(len(layers)) if i not in frozen]
+    used = set(j for i in trainable for j in layers[i].get('inputs', []))
+    data_layers = [i for i in trainable if layers[i]['type'] == 'data' and i in used]
+    other_layers = [i for i in trainable if layers[i]['type'] != 'data']
+    order = data_layers + frontier + other_layers
+    index_map = dict((old, new) for new, old in enumerate(order))
+    sources = [('data', layers[i]['dataIdx']) for i in data_layers] + [('layer', i) for i in frontier]
+    
+    suffix = []
+    for new, old in enumerate(order):
+        l = layers[old]
+        if old in frontier or l['type'] == 'data':
+            suffix += [{'name': l['name'], 'type': 'data', 'dataIdx': new, 'outputs': l['outputs'],
+                        'actsTarget': -1, 'actsGradTarget': -1, 'gradConsumer': False,
+                        'usesActs': True, 'usesInputs': True, 'forceOwnActs': True,
+                        'conserveMem': l.get('conserveMem', False)}]
+            continue
+        c = dict(l)
+        c['inputs'] = [index_map[j] for j in l['inputs']]
+        c['inputLayers'] = [suffix[j] for j in c['inputs']]
+        # Data layers' outputs are the data matrices themselves, which must not be overwritten
+        if c['actsTarget'] >= 0 and l['inputs'][c['actsTarget']] in frontier:
+            c['actsTarget'] = -1
+        if 'weightSourceLayerIndices' in c:
+            c['weightSourceLayerIndices'] = [index_map[j] if j >= 0 else j for j in l['weightSourceLayerIndices']]
+        suffix += [c]
+    return suffix, sources, index_map
+
+# The name a data source of the suffix (see make_suffix_layers) is cached
+# under: that of the frontier layer, or .data<index> for a matrix of the
+# original provider's output
+def get_source_name(layers, source):
+    s, i = source
+    return layers[i]['name'] if s == 'layer' else '.data%d' % i
+
+# Memory-mapped outputs of the frontier layers, one file per layer and batch,
+# along with the other data matrices the suffix of the net takes (labels).
+# The cache lives in a subdirectory of cache_dir named by a hash of key and of
+# the weights of the frozen layers, so a cache is never used with a net or
+# data it wasn't made from.
+class FeatureCache:
+    def __init__(self, cache_dir, layers, frozen, key):
+        h = hashlib.md5(repr(key))
+        for i in sorted(frozen):
+            l = layers[i]
+            h.update('%s:%s:%s' % (l['name'], l['type'], l['inputs']))
+            for name in ('weights', 'biases'):
+                if name in l:
+                    for w in (l[name] if type(l[name]) == list else [l[name]]):
+                        h.update(n.ascontiguousarray(w).data)
+        self.path = os.path.join(cache_dir, h.hexdigest())
+        
+    def get_file(self, kind, batchnum, layer_name):
+        return os.path.join(self.path, '%s_%d_%s.npy' % (kind, batchnum, layer_name))
+    
+    def has(self, kind, batchnum, layer_name):
+        return os.path.exists(self.get_file(kind, batchnum, layer_name))
+    
+    # Stores ftrs, a (cases, dims) matrix, as a (dims, cases) one, ready to be fed to the net
+    def write(self, kind, batchnum, layer_name, ftrs):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        path = self.get_file(kind, batchnum, layer_name)
+        tmp_path = '%s.%d.tmp.npy' % (path[:-4], os.getpid())
+        out = n.lib.format.open_memmap(tmp_path, mode='w+', dtype=n.single, shape=(ftrs.shape[1], ftrs.shape[0]))
+        out[:] = ftrs.T
+        del out
+        os.rename(tmp_path, path)
+        
+    def load(self, kind, batchnum, layer_name):
+        path = self.get_file(kind, batchnum, layer_name)
+        if not os.path.exists(path):
+            raise FeatureCacheError("Cached matrix '%s' of %s batch %d missing from %s" % (layer_name, kind, batchnum, self.path))
+        return n.load(path, mmap_mode='r')
+    
+# Feeds the suffix of the net from the cache alone: provider dp only keeps
+# track of the current batch, so its data are never loaded or augmented.
+# Everything else is delegated to dp.
+class FrozenPrefixDataProvider:
+    lazy_views = False # the cache holds the outputs of all views
+    
+    def __init__(self, dp, cache, kind, layers, sources):
+        self.dp, self.cache, self.kind = dp, cache, kind
+        self.sources = [(s, i, get_source_name(layers, (s, i)), layers[i]['outputs'] if s == 'layer' else None) for s, i in sources]
+        
+    def get_next_batch(self):
+        epoch, batchnum = self.dp.curr_epoch, self.dp.curr_batchnum
+        self.dp.advance_batch()
+        return epoch, batchnum, [self.cache.load(self.kind, batchnum, name) for s, i, name, dims in self.sources]
+    
+    # The same view of the cache over another provider of the same batches
+    def wrap(self, dp):
+        other = FrozenPrefixDataProvider(dp, self.cache, self.kind, [], [])
+        other.sources = self.sources
+        return other
+    
+    def get_data_dims(self, idx=0):
+        s, i, name, dims = self.sources[idx]
+        return self.dp.get_data_dims(i) if s == 'data' else dims
+    
+    def __getattr__(self, name):
+        return getattr(self.dp, name)
@@ -37,6 +37,8 @@ import shutil
 import platform
 from os import linesep as NL
 
+CHECKPOINT_REGEX = re.compile(r'^\d+\.\d+$')
+
 class ModelStateException(Exception):
     pass
 
@@ -146,10 +148,11 @@ class IGPUModel:
             next_data = self.get_next_batch()
             
             batch_output = self.finish_batch()
-            self.train_outputs += [batch_output]
+            self.train_data_provider.finish_batch()
+            self.train_outputs.append(batch_output)
             self.print_train_results()
 
-            if self.get_num_batches_done() % self.testing_freq == 0:
+            if self.is_test_due():
                 self.sync_with_host()
                 self.test_outputs += [self.get_test_error()]
                 self.print_test_results()
@@ -168,6 +171,10 @@ class IGPUModel:
     def print_model_state(self):
         pass
     
+    # Whether to test (and save) after the batch just trained on
+    def is_test_due(self):
+        return self.get_num_batches_done() % self.testing_freq == 0
+    
     def get_num_batches_done(self):
         return len(self.train_batch_range) * (self.epoch - 1) + self.batchnum - self.train_batch_range[0] + 1
     
@@ -229,6 +236,7 @@ class IGPUModel:
             if load_next: # load next batch
                 next_data = self.get_next_batch(train=False)
             test_outputs += [self.finish_batch()]
+            self.test_data_provider.finish_batch()
             if self.test_only: # Print the individual batch results for safety
                 print "batch %d: %s" % (data[1], str(test_outputs[-1]))
             if not load_next:
@@ -248,6 +256,9 @@ class IGPUModel:
     def has_var(self, var_name):
         return var_name in self.model_state
         
+    def get_checkpoint_dir(self):
+        return os.path.join(self.save_path, self.save_file)
+        
     def save_state(self):
         for att in self.model_state:
             if hasattr(self, att):
@@ -256,7 +267,7 @@ class IGPUModel:
         dic = {"model_state": self.model_state,
                "op": self.op}
             
-        checkpoint_dir = os.path.join(self.save_path, self.save_file)
+        checkpoint_dir = self.get_checkpoint_dir()
         checkpoint_file = "%d.%d" % (self.epoch, self.batchnum)
         checkpoint_file_full_path = os.path.join(checkpoint_dir, checkpoint_file)
         if not os.path.exists(checkpoint_dir):
@@ -264,17 +275,29 @@ class IGPUModel:
     
         pickle(checkpoint_file_full_path, dic,compress=self.zip_save)
         
-        for f in sorted(os.listdir(checkpoint_dir), key=alphanum_key):
+        # Only checkpoints are deleted; other files in the directory still count towards its size
+        for f in IGPUModel.get_checkpoint_files(checkpoint_dir):
             if sum(os.path.getsize(os.path.join(checkpoint_dir, f2)) for f2 in os.listdir(checkpoint_dir)) > self.max_filesize_mb*1024*1024 and f != checkpoint_file:
                 os.remove(os.path.join(checkpoint_dir, f))
             else:
                 break
             
+    # Returns the names of the checkpoint files in the given directory, oldest first
     @staticmethod
-    def load_checkpoint(load_dir):
+    def get_checkpoint_files(checkpoint_dir):
+        return sorted([f for f in os.listdir(checkpoint_dir) if CHECKPOINT_REGEX.match(f)], key=alphanum_key)
+        
+    # Returns the path of the most recent checkpoint file in load_dir,
+    # or load_dir itself if it is a file.
+    @staticmethod
+    def get_checkpoint_file(load_dir):
         if os.path.isdir(load_dir):
-            return unpickle(os.path.join(load_dir, sorted(os.listdir(load_dir), key=alphanum_key)[-1]))
-        return unpickle(load_dir)
+            return os.path.join(load_dir, IGPUModel.get_checkpoint_files(load_dir)[-1])
+        return load_dir
+
+    @staticmethod
+    def load_checkpoint(load_dir):
+        return unpickle(IGPUModel.get_checkpoint_file(load_dir))
 
     @staticmethod
     def get_options_parser():
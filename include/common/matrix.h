@@ -100,6 +100,15 @@ extern "C" {
 
 #define MTYPE_MAX numeric_limits<MTYPE>::max()
 
+/*
+ * Elementwise operations and reductions are split over OpenMP threads
+ * (when compiled with -fopenmp) for matrices with at least this many elements.
+ * Smaller matrices are processed serially.
+ */
+#ifndef MATRIX_PARALLEL_THRESHOLD
+#define MATRIX_PARALLEL_THRESHOLD 32768
+#endif
+
 class Matrix {
 private:
     MTYPE* _data;
@@ -111,18 +120,12 @@ private:
     void _init(MTYPE* data, long int numRows, long int numCols, bool transpose, bool ownsData);
     void _tileTo2(Matrix& target) const;
     void _copyAllTo(Matrix& target) const;
-    MTYPE _sum_column(long int col) const;
-    MTYPE _sum_row(long int row) const;
-    MTYPE _aggregate(MTYPE(*agg_func)(MTYPE, MTYPE), MTYPE initialValue) const;
-    void _aggregate(long int axis, Matrix& target, MTYPE(*agg_func)(MTYPE, MTYPE), MTYPE initialValue) const;
-    MTYPE _aggregateRow(long int row, MTYPE(*agg_func)(MTYPE, MTYPE), MTYPE initialValue) const;
-    MTYPE _aggregateCol(long int row, MTYPE(*agg_func)(MTYPE, MTYPE), MTYPE initialValue) const;
     void _updateDims(long int numRows, long int numCols);
-    void _applyLoop(MTYPE(*func)(MTYPE));
-    void _applyLoop(MTYPE (*func)(MTYPE), Matrix& target);
-    void _applyLoop2(const Matrix& a, MTYPE(*func)(MTYPE, MTYPE), Matrix& target) const;
-    void _applyLoop2(const Matrix& a, MTYPE (*func)(MTYPE,MTYPE, MTYPE), MTYPE scalar, Matrix& target) const;
-    void _applyLoopScalar(const MTYPE scalar, MTYPE(*func)(MTYPE, MTYPE), Matrix& target) const;
+    void _resizeForAxis(long int axis, Matrix& target) const;
+#ifdef NUMPY_INTERFACE
+    // Number and size of the numpy arrays that had to be copied because they could not be aliased
+    static long int _numArrayCopies, _numArrayCopyBytes;
+#endif
     void _checkBounds(long int startRow, long int endRow, long int startCol, long int endCol) const;
     void _divideByVector(const Matrix& vec, Matrix& target);
     inline long int _getNumColsBackEnd() const {
@@ -136,6 +139,9 @@ public:
     Matrix(long int numRows, long int numCols);
 #ifdef NUMPY_INTERFACE
     Matrix(const PyArrayObject *src);
+    static bool canAlias(const PyArrayObject *src);
+    static long int getNumArrayCopies();
+    static long int getNumArrayCopyBytes();
 #endif
     Matrix(const Matrix &like);
     Matrix(MTYPE* data, long int numRows, long int numCols);
@@ -28,9 +28,19 @@
 #define QUEUE_H_
 #include <pthread.h>
 #include <stdlib.h>
+#include <string.h>
+#include <errno.h>
+#include <sys/time.h>
 
 /*
- * A thread-safe circular queue that automatically grows but never shrinks.
+ * A thread-safe circular queue for any number of producers and consumers.
+ *
+ * An unbounded queue (capacity 0) grows its storage whenever it is full,
+ * but never shrinks. A bounded queue grows up to its capacity and then
+ * makes enqueue block until a consumer has made room.
+ *
+ * The timed versions of enqueue and dequeue give up after the given number
+ * of milliseconds and return false. A timeout of 0 makes them non-blocking.
  */
 template <class T>
 class Queue {
@@ -39,74 +49,163 @@ private:
     int _numElements;
     int _head, _tail;
     int _maxSize;
+    int _capacity;
     pthread_mutex_t *_queueMutex;
-    pthread_cond_t *_queueCV;
+    pthread_cond_t *_notEmptyCV, *_notFullCV;
 
-    void _init(int initialSize) {
+    void _init(int initialSize, int capacity) {
         _numElements = 0;
         _head = 0;
         _tail = 0;
-        _maxSize = initialSize;
-        _elements = new T[initialSize];
-        _queueCV = (pthread_cond_t*)(malloc(sizeof (pthread_cond_t)));
+        _capacity = capacity;
+        _maxSize = capacity > 0 && capacity < initialSize ? capacity : initialSize;
+        _elements = new T[_maxSize];
+        _notEmptyCV = (pthread_cond_t*)(malloc(sizeof (pthread_cond_t)));
+        _notFullCV = (pthread_cond_t*)(malloc(sizeof (pthread_cond_t)));
         _queueMutex = (pthread_mutex_t*)(malloc(sizeof (pthread_mutex_t)));
         pthread_mutex_init(_queueMutex, NULL);
-        pthread_cond_init(_queueCV, NULL);
+        pthread_cond_init(_notEmptyCV, NULL);
+        pthread_cond_init(_notFullCV, NULL);
     }
 
     void expand() {
-        T *newStorage = new T[_maxSize * 2];
+        int newSize = _capacity > 0 && _capacity < _maxSize * 2 ? _capacity : _maxSize * 2;
+        T *newStorage = new T[newSize];
         memcpy(newStorage, _elements + _head, (_maxSize - _head) * sizeof(T));
         memcpy(newStorage + _maxSize - _head, _elements, _tail * sizeof(T));
         delete[] _elements;
         _elements = newStorage;
         _head = 0;
         _tail = _numElements;
-        _maxSize *= 2;
+        _maxSize = newSize;
+    }
+
+    bool isFull() const {
+        return _capacity > 0 && _numElements == _capacity;
+    }
+
+    /*
+     * Absolute time timeoutMs milliseconds from now, for pthread_cond_timedwait.
+     */
+    static struct timespec getDeadline(long timeoutMs) {
+        struct timeval now;
+        gettimeofday(&now, NULL);
+        long nsec = now.tv_usec * 1000 + (timeoutMs % 1000) * 1000000;
+        struct timespec deadline;
+        deadline.tv_sec = now.tv_sec + timeoutMs / 1000 + nsec / 1000000000;
+        deadline.tv_nsec = nsec % 1000000000;
+        return deadline;
+    }
+
+    /*
+     * Waits on the given condition variable while pred() holds.
+     * Returns false if the deadline passed first. The mutex must be held.
+     */
+    bool waitWhile(pthread_cond_t *cv, bool (Queue::*pred)() const, long timeoutMs) {
+        if (timeoutMs < 0) {
+            while ((this->*pred)()) {
+                pthread_cond_wait(cv, _queueMutex);
+            }
+            return true;
+        }
+        struct timespec deadline = getDeadline(timeoutMs);
+        while ((this->*pred)()) {
+            if (pthread_cond_timedwait(cv, _queueMutex, &deadline) == ETIMEDOUT) {
+                return !(this->*pred)();
+            }
+        }
+        return true;
+    }
+
+    bool isEmpty() const {
+        return _numElements == 0;
+    }
+
+    void push(T el) {
+        if (_numElements == _maxSize) {
+            expand();
+        }
+        _elements[_tail] = el;
+        _tail = (_tail + 1) % _maxSize;
+        _numElements++;
+        pthread_cond_signal(_notEmptyCV);
+    }
+
+    T pop() {
+        T el = _elements[_head];
+        _head = (_head + 1) % _maxSize;
+        _numElements--;
+        pthread_cond_signal(_notFullCV);
+        return el;
     }
 public:
+    /*
+     * capacity: maximum number of elements, or 0 for an unbounded queue.
+     */
+    Queue(int initialSize, int capacity) {
+        _init(initialSize, capacity);
+    }
+
     Queue(int initialSize) {
-        _init(initialSize);
+        _init(initialSize, 0);
     }
 
     Queue()  {
-        _init(1);
+        _init(1, 0);
     }
 
     ~Queue() {
         pthread_mutex_destroy(_queueMutex);
-        pthread_cond_destroy(_queueCV);
+        pthread_cond_destroy(_notEmptyCV);
+        pthread_cond_destroy(_notFullCV);
         delete[] _elements;
         free(_queueMutex);
-        free(_queueCV);
+        free(_notEmptyCV);
+        free(_notFullCV);
     }
 
+    /*
+     * Blocks until not full.
+     */
     void enqueue(T el) {
+        enqueue(el, -1);
+    }
+
+    /*
+     * Waits at most timeoutMs milliseconds (forever if negative) for room in the queue.
+     * Returns false if the element was not enqueued.
+     */
+    bool enqueue(T el, long timeoutMs) {
         pthread_mutex_lock(_queueMutex);
-        if(_numElements == _maxSize) {
-            expand();
+        bool ok = waitWhile(_notFullCV, &Queue::isFull, timeoutMs);
+        if (ok) {
+            push(el);
         }
-        _elements[_tail] = el;
-        _tail = (_tail + 1) % _maxSize;
-        _numElements++;
-
-        pthread_cond_signal(_queueCV);
         pthread_mutex_unlock(_queueMutex);
+        return ok;
     }
 
     /*
      * Blocks until not empty.
      */
     T dequeue() {
+        T el;
+        dequeue(el, -1);
+        return el;
+    }
+
+    /*
+     * Waits at most timeoutMs milliseconds (forever if negative) for an element.
+     * Returns false if no element was dequeued, in which case el is left unchanged.
+     */
+    bool dequeue(T& el, long timeoutMs) {
         pthread_mutex_lock(_queueMutex);
-        if(_numElements == 0) {
-            pthread_cond_wait(_queueCV, _queueMutex);
+        bool ok = waitWhile(_notEmptyCV, &Queue::isEmpty, timeoutMs);
+        if (ok) {
+            el = pop();
         }
-        T el = _elements[_head];
-        _head = (_head + 1) % _maxSize;
-        _numElements--;
         pthread_mutex_unlock(_queueMutex);
-        return el;
+        return ok;
     }
 
     /*
@@ -115,6 +214,10 @@ public:
     inline int getNumElements() const {
         return _numElements;
     }
+
+    inline int getCapacity() const {
+        return _capacity;
+    }
 };
 
 #endif /* QUEUE_H_ */
@@ -40,6 +40,13 @@
 #include "worker.cuh"
 #include "weights.cuh"
 
+/*
+ * Maximum number of workers waiting for the trainer thread. Once this many
+ * batches are queued, startBatch blocks until the trainer takes one, so the
+ * Python side cannot queue up an unbounded number of batches.
+ */
+#define WORKER_QUEUE_CAPACITY 4
+
 class Worker;
 class WorkResult;
 class Layer;
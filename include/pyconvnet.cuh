@@ -39,6 +39,8 @@ PyObject* checkGradients(PyObject *self, PyObject *args);
 PyObject* syncWithHost(PyObject *self, PyObject *args);
 PyObject* startMultiviewTest(PyObject *self, PyObject *args);
 PyObject* startFeatureWriter(PyObject *self, PyObject *args);
+PyObject* setStrictArrays(PyObject *self, PyObject *args);
+PyObject* getArrayCopyStats(PyObject *self, PyObject *args);
 
 #endif	/* PYCONVNET3_CUH */
 
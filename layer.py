@@ -1096,7 +1096,19 @@ class LogregCostParser(CostParser):
         
         print "Initialized logistic regression cost '%s'" % name
         return dic
-    
+
+    # Whether the softmax input of logistic regression cost dic is used by
+    # nothing else, so that the CPU backend can compute the pair together
+    # from the softmax layer's inputs without materializing probabilities.
+    @staticmethod
+    def can_fuse_softmax(layers, dic):
+        softmax_idx = dic['inputs'][1]
+        return sum(softmax_idx in l['inputs'] for l in layers if 'inputs' in l) == 1
+
+    def optimize(self, layers):
+        CostParser.optimize(self, layers)
+        self.dic['fuseSoftmax'] = LogregCostParser.can_fuse_softmax(layers, self.dic)
+
 class SumOfSquaresCostParser(CostParser):
     def __init__(self):
         CostParser.__init__(self, num_inputs=1)
@@ -0,0 +1,220 @@
+# Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as n
+import os
+import sys
+import re
+from multiprocessing import Pool, cpu_count
+from getopt import GetoptError
+from util import pickle, unpickle, UnpickleError
+from options import *
+from datastats import DatasetStats, write_meta, read_label_names, DatasetStatsError
+
+IMAGE_EXTENSIONS = ('.npy', '.ppm', '.pgm')
+PNM_HEADER_REGEX = re.compile('^(P[56])\s+(?:#.*\s+)*(\d+)\s+(?:#.*\s+)*(\d+)\s+(?:#.*\s+)*(\d+)\s', re.MULTILINE)
+FORMAT_PICKLE, FORMAT_MMAP = 'pickle', 'mmap'
+
+class MakeDataError(Exception):
+    pass
+
+# Reads a binary PPM (color) or PGM (grayscale) file into a (height, width, colors) uint8 array
+def read_pnm(path):
+    raw = open(path, 'rb').read()
+    m = PNM_HEADER_REGEX.match(raw)
+    if not m:
+        raise MakeDataError("%s is not a binary PPM/PGM file" % path)
+    colors = 3 if m.group(1) == 'P6' else 1
+    width, height, maxval = int(m.group(2)), int(m.group(3)), int(m.group(4))
+    dtype = n.uint8 if maxval < 256 else n.dtype('>u2')
+    img = n.frombuffer(raw, dtype=dtype, count=width * height * colors, offset=m.end()).reshape(height, width, colors)
+    if maxval != 255:
+        img = n.uint8(n.round(img * (255.0 / maxval)))
+    return img
+
+def read_image(path):
+    if path.endswith('.npy'):
+        img = n.load(path)
+    else:
+        img = read_pnm(path)
+    return img.reshape(img.shape[:2] + (-1,))
+
+# Bilinear resizing of a (height, width, colors) image, one axis at a time
+def resize_image(img, height, width):
+    def resize_axis(x, size, axis):
+        old_size = x.shape[axis]
+        if old_size == size:
+            return x
+        pos = n.clip((n.arange(size) + 0.5) * (float(old_size) / size) - 0.5, 0, old_size - 1)
+        lo = n.int32(n.floor(pos))
+        hi = n.minimum(lo + 1, old_size - 1)
+        shape = [1] * x.ndim
+        shape[axis] = size
+        frac = (pos - lo).reshape(shape)
+        return x.take(lo, axis=axis) * (1 - frac) + x.take(hi, axis=axis) * frac
+    out = resize_axis(resize_axis(n.float32(img), height, 0), width, 1)
+    return n.uint8(n.clip(n.round(out), 0, 255))
+
+# Makes an image img_size x img_size: 'resize' scales the whole image,
+# 'crop' scales its shorter side to img_size and takes the center.
+def fit_image(img, img_size, mode):
+    h, w = img.shape[:2]
+    if mode == 'crop':
+        scale = float(img_size) / min(h, w)
+        h, w = max(img_size, int(round(h * scale))), max(img_size, int(round(w * scale)))
+        img = resize_image(img, h, w)
+        top, left = (h - img_size) / 2, (w - img_size) / 2
+        return img[top:top + img_size, left:left + img_size]
+    return resize_image(img, img_size, img_size)
+
+# The images of a dataset: either files in a directory, in name order, or
+# the cases of a (cases, height, width[, colors]) .npy array, which is mapped
+# rather than loaded. files are the names of the images of directory path,
+# if already listed (e.g. those of one batch).
+class ImageSource:
+    def __init__(self, path, files=None):
+        self.path = path
+        if files is not None:
+            self.files = files
+            self.num_images = len(self.files)
+        elif os.path.isdir(path):
+            self.files = sorted(f for f in os.listdir(path) if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS)
+            self.num_images = len(self.files)
+        else:
+            self.files = None
+            self.array = n.load(path, mmap_mode='r')
+            if self.array.ndim not in (3, 4):
+                raise MakeDataError("%s has shape %s; expected (cases, height, width[, colors])" % (path, self.array.shape))
+            self.num_images = self.array.shape[0]
+        if self.num_images == 0:
+            raise MakeDataError("No images in %s" % path)
+        
+    def get_image(self, i):
+        if self.files is not None:
+            return read_image(os.path.join(self.path, self.files[i]))
+        img = n.asarray(self.array[i])
+        return img.reshape(img.shape[:2] + (-1,))
+    
+    def get_name(self, i):
+        return self.files[i] if self.files is not None else str(i)
+    
+def read_labels(path):
+    if path.endswith('.npy'):
+        return [int(l) for l in n.load(path).ravel()]
+    return [int(l) for l in open(path).read().split()]
+
+# Writes batch number batch_num from images start to end. files are the
+# names of those images if src_path is a directory. Runs in the pool's processes.
+def make_batch(args):
+    (src_path, files, out_path, batch_num, start, end, labels, img_size, num_colors, mode, format) = args
+    src = ImageSource(src_path, files)
+    first = 0 if files is not None else start
+    data = n.empty((num_colors, img_size, img_size, end - start), dtype=n.uint8)
+    for i in xrange(first, first + end - start):
+        img = src.get_image(i)
+        if img.shape[2] == 1 and num_colors == 3:
+            img = n.repeat(img, 3, axis=2)
+        if img.shape[2] != num_colors:
+            raise MakeDataError("Image %s has %d colors, expected %d" % (src.get_name(i), img.shape[2], num_colors))
+        data[..., i - first] = fit_image(img, img_size, mode).transpose(2, 0, 1)
+    data = data.reshape(-1, end - start)
+    dic = {'labels': labels, 'batch_label': 'batch %d' % batch_num,
+           'filenames': [src.get_name(i) for i in xrange(first, first + end - start)]}
+    name = 'data_batch_%d' % batch_num
+    if format == FORMAT_MMAP:
+        dic['data_file'] = name + '.npy'
+        n.save(os.path.join(out_path, dic['data_file']), data)
+    else:
+        dic['data'] = data
+    pickle(os.path.join(out_path, name), dic)
+    stats = DatasetStats(data.shape[0], num_colors)
+    stats.add(data, labels)
+    return stats
+
+# Packs the images of src_path into batches of batch_size cases, in num_workers
+# processes, and returns the merged statistics of the batches.
+def make_batches(src_path, out_path, labels, img_size, batch_size, first_batch=1, mode='crop', format=FORMAT_PICKLE, num_workers=1):
+    src = ImageSource(src_path)
+    if len(labels) != src.num_images:
+        raise MakeDataError("%d images but %d labels" % (src.num_images, len(labels)))
+    if format not in (FORMAT_PICKLE, FORMAT_MMAP):
+        raise MakeDataError("Unknown batch format: %s" % format)
+    num_colors = src.get_image(0).shape[2]
+    if not os.path.exists(out_path):
+        os.makedirs(out_path)
+    tasks = [(src_path, src.files[start:start + batch_size] if src.files is not None else None, out_path, first_batch + b,
+              start, min(start + batch_size, src.num_images), labels[start:start + batch_size], img_size, num_colors, mode, format)
+             for b, start in enumerate(xrange(0, src.num_images, batch_size))]
+    stats = None
+    pool = Pool(processes=num_workers)
+    try:
+        for t, s in zip(tasks, pool.imap(make_batch, tasks)):
+            print "Wrote batch %d (%d cases)" % (t[3], t[5] - t[4])
+            sys.stdout.flush()
+            if stats is None:
+                stats = s
+            else:
+                stats.merge(s)
+    finally:
+        pool.terminate()
+    return stats
+
+def get_options_parser():
+    op = OptionsParser()
+    op.add_option("images", "images", StringOptionParser, "Directory of .npy/.ppm/.pgm images, or .npy array of images (cases, height, width[, colors])")
+    op.add_option("labels", "labels", StringOptionParser, "Label of every image: text file with one number per line, or .npy array")
+    op.add_option("output-path", "output_path", StringOptionParser, "Directory to write the batches to")
+    op.add_option("img-size", "img_size", IntegerOptionParser, "Width and height of the output images")
+    op.add_option("fit", "fit", StringOptionParser, "How to make images square: 'crop' (center) or 'resize'", default='crop')
+    op.add_option("batch-size", "batch_size", IntegerOptionParser, "Number of cases per batch", default=10000)
+    op.add_option("first-batch", "first_batch", IntegerOptionParser, "Number of the first batch written", default=1)
+    op.add_option("format", "format", StringOptionParser, "'pickle' or 'mmap' (data matrices in separate .npy files, mapped when loaded)", default=FORMAT_PICKLE)
+    op.add_option("label-names", "label_names", StringOptionParser, "File with one label name per line (default: the label numbers)", default="")
+    op.add_option("write-meta", "write_meta", BooleanOptionParser, "Write batches.meta with the statistics of these batches?", default=1)
+    op.add_option("workers", "workers", IntegerOptionParser, "Number of worker processes", default=cpu_count())
+    return op
+
+if __name__ == "__main__":
+    op = get_options_parser()
+    try:
+        op.parse()
+        if op.get_value('fit') not in ('crop', 'resize'):
+            raise MakeDataError("Unknown --fit mode: %s" % op.get_value('fit'))
+        labels = read_labels(op.get_value('labels'))
+        stats = make_batches(op.get_value('images'), op.get_value('output_path'), labels, op.get_value('img_size'), op.get_value('batch_size'),
+                             first_batch=op.get_value('first_batch'), mode=op.get_value('fit'), format=op.get_value('format'), num_workers=op.get_value('workers'))
+        if op.get_value('write_meta'):
+            label_names = read_label_names(op.get_value('label_names')) if op.get_value('label_names') else None
+            meta = stats.get_meta(label_names)
+            num_batches = (stats.num_cases - 1) / op.get_value('batch_size') + 1
+            meta['stats_batches'] = range(op.get_value('first_batch'), op.get_value('first_batch') + num_batches)
+            write_meta(op.get_value('output_path'), meta)
+            print "Wrote %s" % os.path.join(op.get_value('output_path'), 'batches.meta')
+    except OptionMissingException, e:
+        print e
+        op.print_usage()
+    except (OptionException, GetoptError, UnpickleError, MakeDataError, DatasetStatsError, IOError, OSError), e:
+        print "----------------"
+        print "Error:"
+        print e
@@ -0,0 +1,228 @@
+# Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import cPickle
+import numpy as n
+from math import ceil
+
+class MetricsLogError(Exception):
+    pass
+
+class MetricsLog:
+    """
+    Stores the (cost dictionary, number of cases) pairs returned by finishBatch,
+    one per trained batch, in growable arrays keyed by cost name. It supports
+    the subset of the list interface that the training loop uses (append, len,
+    indexing), so it can replace model_state["train_outputs"].
+    
+    The costs are stored as returned by finishBatch, i.e. summed over the cases of the batch.
+    
+    Appended rows are written incrementally to a side file by flush(). Once
+    flushed, a pickled MetricsLog only holds a reference to that file, the
+    number of rows it covers and the chunk that ends them; call attach() with
+    the checkpoint directory after unpickling it.
+    """
+    FILE_NAME = 'train_outputs.metrics'
+    
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.length = 0
+        self.num_cases = n.zeros(capacity, dtype=n.int64)
+        self.costs = {}
+        self.path = None
+        self.tip = None # Id of the side file chunk that holds the last flushed rows
+        self.flushed = 0 # Number of rows that agree with the side file
+        self.pending = None
+        
+    @staticmethod
+    def from_list(outputs):
+        """Converts the list kept in model_state["train_outputs"] by older checkpoints. The
+        cost values in these lists were already divided by the number of cases."""
+        log = MetricsLog(capacity=max(1024, len(outputs)))
+        for costs, num_cases in outputs:
+            log.append((dict((name, [v * num_cases for v in values]) for name, values in costs.iteritems()), num_cases))
+        return log
+    
+    def __len__(self):
+        self._check_attached()
+        return self.length
+    
+    def __getitem__(self, idx):
+        self._check_attached()
+        if idx < 0:
+            idx += self.length
+        if idx < 0 or idx >= self.length:
+            raise IndexError("MetricsLog index out of range")
+        return dict((name, list(c[idx,:])) for name, c in self.costs.iteritems()), int(self.num_cases[idx])
+    
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+    
+    def _check_attached(self):
+        if self.pending is not None:
+            raise MetricsLogError("Metrics log refers to file '%s', but it has not been attached to a checkpoint directory" % self.pending[0])
+    
+    def _grow(self, capacity):
+        self.num_cases = n.r_[self.num_cases[:self.length], n.zeros(capacity - self.length, dtype=n.int64)]
+        for name, c in self.costs.iteritems():
+            self.costs[name] = n.r_[c[:self.length,:], n.zeros((capacity - self.length, c.shape[1]))]
+        self.capacity = capacity
+        
+    def _add_cost(self, name, num_values):
+        self.costs[name] = n.zeros((self.capacity, num_values))
+        
+    def append(self, cost_output):
+        self._check_attached()
+        costs, num_cases = cost_output
+        if self.length == self.capacity:
+            self._grow(max(1024, 2 * self.capacity))
+        for name, values in costs.iteritems():
+            if name not in self.costs:
+                self._add_cost(name, len(values))
+            self.costs[name][self.length,:] = values
+        self.num_cases[self.length] = num_cases
+        self.length += 1
+        
+    def get_cost_names(self):
+        self._check_attached()
+        return self.costs.keys()
+    
+    def get_series(self, name, idx=0, max_points=None):
+        """Returns (batch indices, costs per case) for the idx-th value of the given cost.
+        If max_points is given, consecutive batches are averaged so that at most
+        max_points points are returned."""
+        self._check_attached()
+        if name not in self.costs:
+            raise MetricsLogError("No cost named '%s' in metrics log" % name)
+        sums, num_cases = self.costs[name][:self.length, idx], self.num_cases[:self.length]
+        if max_points is None or self.length <= max_points:
+            return n.arange(self.length), sums / num_cases
+        step = int(ceil(self.length / float(max_points)))
+        starts = n.arange(0, self.length, step)
+        # Weight each batch by its number of cases, as if the block were one big batch
+        y = n.add.reduceat(sums, starts) / n.add.reduceat(num_cases, starts)
+        x = starts + (n.minimum(starts + step, self.length) - starts - 1) / 2.0
+        return x, y
+    
+    def _write_rows(self, f, start, end, parent):
+        """Appends rows [start, end) to the side file as a chunk that continues the chunk
+        parent (None for a chunk starting at row 0). Returns the chunk's id, its offset in the file."""
+        f.seek(0, os.SEEK_END)
+        chunk_id = f.tell()
+        cPickle.dump((chunk_id, parent, self.num_cases[start:end], dict((name, c[start:end,:]) for name, c in self.costs.iteritems())), f, protocol=cPickle.HIGHEST_PROTOCOL)
+        return chunk_id
+    
+    def flush(self, path):
+        """Appends the rows appended since the last flush to the side file at the given path.
+        The file is never truncated: it holds a tree of chunks, each continuing an earlier
+        one, so that a run resumed from an older checkpoint in the same directory starts a
+        new branch and the newer checkpoints keep theirs. If the path has changed, all rows
+        are written as a new root chunk."""
+        self._check_attached()
+        if path != self.path:
+            self.flushed, self.tip = 0, None
+        if self.length > self.flushed or self.tip is None:
+            f = open(path, 'ab')
+            self.tip = self._write_rows(f, self.flushed, self.length, self.tip)
+            f.close()
+        self.path = path
+        self.flushed = self.length
+        
+    @staticmethod
+    def _read_chunks(path):
+        """Returns the chunks of a side file by id, as (parent, num_cases, costs), and the id
+        of the last one. Files written before chunks had ids hold a single chain."""
+        chunks, last = {}, None
+        f = open(path, 'rb')
+        while True:
+            try:
+                chunk = cPickle.load(f)
+            except EOFError:
+                break
+            if len(chunk) == 2:
+                chunk = (len(chunks), last) + chunk
+            chunks[chunk[0]] = chunk[1:]
+            last = chunk[0]
+        f.close()
+        return chunks, last
+        
+    def attach(self, dir):
+        """Loads the rows referenced by an unpickled log from the side file in the given directory.
+        Returns the number of referenced rows that the file doesn't have (all of them if it is
+        missing); the log then holds only the rows before those."""
+        if self.pending is None:
+            return 0
+        name, length, tip = self.pending
+        path = os.path.join(dir, name)
+        self.pending = None
+        chain = []
+        if os.path.exists(path):
+            try:
+                chunks, last = self._read_chunks(path)
+            except (cPickle.UnpicklingError, ValueError, TypeError), e:
+                raise MetricsLogError("Metrics log file '%s' is corrupt: %s" % (path, e))
+            chunk_id = last if tip is None else tip
+            while chunk_id in chunks:
+                parent, num_cases, costs = chunks[chunk_id]
+                chain += [(num_cases, costs)]
+                chunk_id = parent
+            chain.reverse()
+        self._grow(max(self.capacity, length))
+        row = 0
+        for num_cases, costs in chain:
+            rows = min(num_cases.shape[0], length - row)
+            self.num_cases[row:row + rows] = num_cases[:rows]
+            for cost_name, c in costs.iteritems():
+                if cost_name not in self.costs:
+                    self._add_cost(cost_name, c.shape[1])
+                self.costs[cost_name][row:row + rows,:] = c[:rows,:]
+            row += rows
+            if row == length:
+                break
+        self.length = row
+        if row == length and tip is not None:
+            # The next flush continues this checkpoint's branch
+            self.path, self.tip, self.flushed = path, tip, length
+        return length - row
+        
+    def __getstate__(self):
+        if self.pending is not None or (self.path is not None and self.flushed == self.length):
+            name, length, tip = self.pending if self.pending is not None else (os.path.basename(self.path), self.length, self.tip)
+            return {'file_name': name, 'length': length, 'tip': tip}
+        # Not backed by a file, so it has to be pickled in full
+        dic = self.__dict__.copy()
+        dic['num_cases'] = self.num_cases[:self.length]
+        dic['costs'] = dict((name, c[:self.length,:]) for name, c in self.costs.iteritems())
+        dic['capacity'] = self.length
+        dic['path'] = None
+        return dic
+    
+    def __setstate__(self, dic):
+        if 'file_name' in dic:
+            self.__init__()
+            self.pending = (dic['file_name'], dic['length'], dic.get('tip'))
+        else:
+            self.__dict__.update(dic)
@@ -143,7 +143,7 @@ class OptionsParser:
                 o.set_value(dic[o.prefixed_letter])
             else:
                 # check if excused or has default
-                excused = max([o2.prefixed_letter in dic for o2 in self.options.values() if o2.excuses == self.EXCLUDE_ALL or o.name in o2.excuses])
+                excused = max([False] + [o2.prefixed_letter in dic for o2 in self.options.values() if o2.excuses == self.EXCLUDE_ALL or o.name in o2.excuses])
                 if not excused and o.default is None:
                     raise OptionMissingException("Option %s (%s) not supplied" % (o.prefixed_letter, o.desc))
                 o.set_default()
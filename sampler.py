@@ -0,0 +1,132 @@
+# Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as n
+import numpy.random as nr
+
+class SamplerException(Exception):
+    pass
+
+# Presents the cases of a list of source batches in a new random order
+# every epoch, without rewriting the batches on disk.
+#
+# Each epoch, the source batches are shuffled and split into windows of
+# window_size batches. The cases of each window are permuted together and
+# dealt into as many output batches as the window has source batches, so an
+# epoch still has one output batch per source batch (of the same sizes) and
+# each output batch reads from at most window_size source batches. Only the batches of the
+# current window are kept in memory.
+#
+# The permutations depend only on the seed, the epoch and the window, so a
+# model resumed from a checkpoint sees the same batches it would have seen.
+#
+# get_source_batch(i) must return the dict of the i-th source batch.
+# case_keys names the entries of that dict that hold one column per case
+# (along their last axis); the output batches contain only those.
+class EpochSampler:
+    def __init__(self, num_batches, get_source_batch, case_keys=('data',), window_size=2, seed=0):
+        if window_size < 1:
+            raise SamplerException("Shuffle window must contain at least one batch; got %d." % window_size)
+        self.num_batches = num_batches
+        self.get_source_batch = get_source_batch
+        self.case_keys = case_keys
+        self.window_size = min(window_size, num_batches)
+        self.seed = seed
+        self.window = None # (epoch, window index)
+        self.sources = {}
+        
+    def get_batch_order(self, epoch):
+        return nr.RandomState([self.seed, epoch]).permutation(self.num_batches)
+    
+    # Loads the source batches of window w and deals their cases into output
+    # batches. For every output batch, self.assignment holds the source (index
+    # into window_batches) and the case index within that source of each column.
+    def __load_window(self, epoch, w):
+        if self.window == (epoch, w):
+            return
+        window_batches = self.get_batch_order(epoch)[w * self.window_size:(w + 1) * self.window_size]
+        self.sources = dict((i, self.sources[i] if i in self.sources else self.get_source_batch(i)) for i in window_batches)
+        self.window_batches = window_batches
+        
+        num_cases = [self.sources[i][self.case_keys[0]].shape[-1] for i in window_batches]
+        src_ids = n.repeat(n.arange(len(window_batches)), num_cases)
+        case_ids = n.concatenate([n.arange(c) for c in num_cases])
+        perm = nr.RandomState([self.seed, epoch, w]).permutation(len(src_ids))
+        # Output batches have the sizes of the window's source batches
+        self.assignment = [(src_ids[p], case_ids[p]) for p in n.split(perm, n.cumsum(num_cases)[:-1])]
+        self.window = (epoch, w)
+
+    # Returns the index of the source batch whose size output batch batch_idx
+    # of the given epoch has, without loading anything.
+    def get_source_idx(self, epoch, batch_idx):
+        w, slot = batch_idx / self.window_size, batch_idx % self.window_size
+        return self.get_batch_order(epoch)[w * self.window_size + slot]
+    
+    # Returns output batch batch_idx (counting from 0) of the given epoch.
+    def get_batch(self, epoch, batch_idx):
+        w, slot = batch_idx / self.window_size, batch_idx % self.window_size
+        self.__load_window(epoch, w)
+        src_ids, case_ids = self.assignment[slot]
+        sources = [self.sources[i] for i in self.window_batches]
+        
+        out = {}
+        for key in self.case_keys:
+            first = n.asarray(sources[0][key])
+            out[key] = n.empty(first.shape[:-1] + (len(src_ids),), dtype=first.dtype)
+        for s, src in enumerate(sources):
+            pos = n.flatnonzero(src_ids == s)
+            # Read every source in ascending case order
+            pos = pos[n.argsort(case_ids[pos], kind='mergesort')]
+            for key in self.case_keys:
+                out[key][..., pos] = n.asarray(src[key])[..., case_ids[pos]]
+        return out
+
+# Two-sided 95% quantiles of Student's t distribution by degrees of freedom.
+# Beyond the table, the normal quantile is close enough.
+T_QUANTILES_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262,
+                  10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 25: 2.060, 30: 2.042}
+
+# Returns the half-width of the 95% confidence interval of the mean of the
+# given independent estimates (nan for fewer than two)
+def get_confidence_halfwidth(values):
+    if len(values) < 2:
+        return float('nan')
+    df = len(values) - 1
+    t = T_QUANTILES_95[max(d for d in T_QUANTILES_95 if d <= df)] if df <= max(T_QUANTILES_95) else 1.960
+    return t * n.std(values, ddof=1) / n.sqrt(len(values))
+
+# Returns the sorted indices of a sample of size cases from the cases with
+# the given integer labels, stratified by label: every label gets its
+# proportional share of the sample (the remainders going to the labels with
+# the largest fractional shares), drawn without replacement with rng.
+def get_stratified_sample(labels, size, rng):
+    size = min(size, len(labels))
+    classes, inverse, counts = n.unique(labels, return_inverse=True, return_counts=True)
+    shares = counts * float(size) / len(labels)
+    take = n.floor(shares).astype(n.int)
+    take[n.argsort(take - shares)[:size - take.sum()]] += 1
+    order = n.argsort(inverse, kind='mergesort')
+    starts = n.r_[0, n.cumsum(counts)[:-1]]
+    sample = [order[s + rng.permutation(c)[:k]] for s, c, k in zip(starts, counts, take)]
+    return n.sort(n.concatenate(sample))
@@ -0,0 +1,127 @@
+# Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from layer import LayerWithInputParser
+
+# Approximate floating-point operations per output value and input of the
+# layers without weights. Unlisted types cost one per output.
+FLOPS_PER_OUTPUT = {'softmax': 3, 'rgb2yuv': 5, 'rgb2lab': 20, 'resize': 8, 'rscale': 8, 'cnorm': 2}
+
+# A unit of backward work: computing the gradient of layer's weights[inp]
+# ('weights'), of its biases ('biases'), or of the activity of its input
+# inp ('acts').
+class BackwardStep:
+    def __init__(self, layer, op, inp, flops):
+        self.layer, self.op, self.inp, self.flops = layer, op, inp, flops
+        
+    def __repr__(self):
+        return "%s(%s%s)" % (self.op, self.layer, '' if self.inp is None else '[%d]' % self.inp)
+
+def get_weight_flops(l, inp):
+    if l['type'] == 'fc':
+        return 2 * l['numInputs'][inp] * l['outputs']
+    return 2 * l['modules'] * l['filters'] * l['filterPixels'][inp] * l['filterChannels'][inp]
+
+# Floating-point operations per case of computing layer l from input inp.
+# The gradient with respect to the weights or the input costs about the same.
+def get_flops(l, inp):
+    if l['type'] in ('fc', 'conv', 'local'):
+        return get_weight_flops(l, inp)
+    if l['type'] == 'pool':
+        return l['outputs'] * l['sizeX']**2
+    if l['type'] in ('rnorm', 'cnorm'):
+        return l['outputs'] * l['size']**2 * FLOPS_PER_OUTPUT.get(l['type'], 1)
+    if l['type'] == 'cmrnorm':
+        return l['outputs'] * l['size']
+    if l['type'] == 'blur':
+        return l['outputs'] * 2 * len(l['filter'])
+    return l['outputs'] * FLOPS_PER_OUTPUT.get(l['type'], 1)
+
+def is_weight_layer(l):
+    return 'weights' in l
+
+# Whether layer l or some layer below it needs the gradient
+def needs_grad(l):
+    return l['type'] != 'data' and bool(LayerWithInputParser.grad_consumers_below(l))
+
+# The backward pass, as the steps it takes in order: from the cost layers
+# (with nonzero coefficients) down, a layer computes the gradients of its
+# weights and biases whose learning rates are nonzero, and the gradient
+# with respect to every input that has a gradient consumer at or below it.
+# Nothing is computed for layers or inputs with no gradient consumer below.
+#
+# The CUDA backend applies the same rules as it goes (see Layer::bprop),
+# the CPU backend runs this schedule.
+def get_backward_schedule(layers):
+    steps = []
+    for i in reversed(xrange(len(layers))):
+        l = layers[i]
+        if l['type'] == 'data':
+            continue
+        if l['type'].startswith('cost.'):
+            if l.get('coeff', 1) == 0:
+                continue
+        elif not needs_grad(l):
+            continue
+        if is_weight_layer(l):
+            if l['epsB'] > 0:
+                steps += [BackwardStep(i, 'biases', None, l['outputs'])]
+            for j in xrange(len(l['inputs'])):
+                if l['epsW'][j] > 0:
+                    steps += [BackwardStep(i, 'weights', j, get_weight_flops(l, j))]
+        # The input that shares the layer's activity gradient matrix
+        # (actsGradTarget) gets its gradient last, since computing it
+        # overwrites the layer's own gradient
+        inputs = range(len(l['inputs']))
+        if l.get('actsGradTarget', -1) >= 0:
+            inputs.remove(l['actsGradTarget'])
+            inputs += [l['actsGradTarget']]
+        for j in inputs:
+            if needs_grad(layers[l['inputs'][j]]):
+                steps += [BackwardStep(i, 'acts', j, get_flops(l, j))]
+    return steps
+
+# The backward pass without any pruning: every gradient of every layer
+def get_full_backward_flops(layers):
+    flops = 0
+    for l in layers:
+        if l['type'] == 'data':
+            continue
+        if is_weight_layer(l):
+            flops += l['outputs'] + sum(get_weight_flops(l, j) for j in xrange(len(l['inputs'])))
+        flops += sum(get_flops(l, j) for j in xrange(len(l['inputs'])))
+    return flops
+
+def get_forward_flops(layers):
+    return sum(get_flops(l, j) for l in layers if l['type'] != 'data' for j in xrange(len(l['inputs'])))
+
+# Prints the cost of the backward schedule and the work it skips, per case
+def print_backward_report(layers):
+    steps = get_backward_schedule(layers)
+    flops, full = sum(s.flops for s in steps), get_full_backward_flops(layers)
+    print "Forward pass: %.2f MFLOPs per case" % (get_forward_flops(layers) / 1e6)
+    print "Backward pass: %.2f MFLOPs per case; %.2f MFLOPs (%.1f%%) skipped for gradients nothing consumes" % (flops / 1e6, (full - flops) / 1e6, 100.0 * (full - flops) / max(full, 1))
+    skipped = [l['name'] for i, l in enumerate(layers) if l['type'] != 'data' and not l['type'].startswith('cost.') and not needs_grad(l)]
+    if skipped:
+        print "No backward pass through: %s" % ", ".join(skipped)
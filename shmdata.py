@@ -0,0 +1,145 @@
+# Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as n
+import os
+import fcntl
+import hashlib
+import shutil
+import atexit
+from util import pickle, unpickle
+
+# Where shared batches live. Files in /dev/shm are backed by memory, so every
+# process that maps them shares the same pages.
+SHARED_DATA_ROOT = '/dev/shm' if os.path.isdir('/dev/shm') else '/tmp'
+REFS_FILE = 'refs'
+OTHER_VALUES_FILE = 'other.pickle'
+
+class SharedDataError(Exception):
+    pass
+
+# Decoded batches of a dataset, shared by all the processes on a host that
+# use the same data directory.
+#
+# Every batch is written once, by the first process that needs it, as one
+# .npy file per array in a directory under SHARED_DATA_ROOT. The other
+# processes map those files read-only instead of loading the batch
+# themselves. A batch is only reused if its source file hasn't changed.
+#
+# Every process that uses the store holds a shared lock on its refs file,
+# which acts as the reference count: the last process to close the store
+# (or to exit) removes it. Since the kernel drops the locks of a process that
+# dies, a crashed job doesn't keep the data around forever; it is removed
+# by the next job to close the store.
+class SharedBatchStore:
+    def __init__(self, data_dir, root=SHARED_DATA_ROOT):
+        self.data_dir = os.path.realpath(data_dir)
+        self.path = os.path.join(root, 'convnet-data-%s' % hashlib.md5(self.data_dir).hexdigest())
+        self.refs_fd = None
+        self.__attach()
+        atexit.register(self.close)
+        
+    # Takes a shared lock on the refs file. A closing process may delete the
+    # store between our open and our lock, in which case we start over.
+    def __attach(self):
+        while True:
+            if not os.path.isdir(self.path):
+                try:
+                    os.makedirs(self.path)
+                except OSError:
+                    if not os.path.isdir(self.path):
+                        raise SharedDataError("Unable to create shared data directory %s" % self.path)
+            refs_path = os.path.join(self.path, REFS_FILE)
+            try:
+                fd = os.open(refs_path, os.O_RDWR | os.O_CREAT, 0666)
+            except OSError:
+                continue # the directory was just deleted
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            try:
+                if os.fstat(fd).st_ino == os.stat(refs_path).st_ino:
+                    self.refs_fd = fd
+                    return
+            except OSError:
+                pass
+            os.close(fd)
+            
+    def __get_batch_path(self, batch_num, source_file):
+        st = os.stat(source_file)
+        return os.path.join(self.path, 'data_batch_%d_%d_%d' % (batch_num, st.st_size, int(st.st_mtime)))
+    
+    @staticmethod
+    def __is_mappable(value):
+        return isinstance(value, n.ndarray) and value.dtype != n.object
+    
+    # Returns batch batch_num, whose source file is source_file, from the store.
+    # If the store doesn't have it yet, it gets it from load_batch() and adds
+    # it. The arrays of the returned dict are read-only.
+    def get_batch(self, batch_num, source_file, load_batch):
+        if self.refs_fd is None:
+            raise SharedDataError("Shared data store %s is closed" % self.path)
+        path = self.__get_batch_path(batch_num, source_file)
+        if not os.path.isdir(path):
+            lock_fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0666)
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX) # wait for anyone already writing it
+                if not os.path.isdir(path):
+                    self.__write_batch(path, load_batch())
+            finally:
+                os.close(lock_fd)
+        return self.__read_batch(path)
+    
+    # Writes to a temporary directory first, so that a batch directory is always complete
+    def __write_batch(self, path, dic):
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        os.mkdir(tmp_path)
+        try:
+            for k, v in dic.iteritems():
+                if self.__is_mappable(v):
+                    n.save(os.path.join(tmp_path, '%s.npy' % k), v)
+            pickle(os.path.join(tmp_path, OTHER_VALUES_FILE), dict((k, v) for k, v in dic.iteritems() if not self.__is_mappable(v)))
+            os.rename(tmp_path, path)
+        except:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        
+    def __read_batch(self, path):
+        dic = unpickle(os.path.join(path, OTHER_VALUES_FILE))
+        for f in os.listdir(path):
+            if f.endswith('.npy'):
+                dic[f[:-4]] = n.load(os.path.join(path, f), mmap_mode='r')
+        return dic
+    
+    # Drops this process's reference, and removes the store if it was the last one.
+    # Arrays returned by get_batch remain valid after the store is removed.
+    def close(self):
+        if self.refs_fd is None:
+            return
+        fcntl.flock(self.refs_fd, fcntl.LOCK_UN)
+        try:
+            fcntl.flock(self.refs_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            shutil.rmtree(self.path, ignore_errors=True)
+        except IOError:
+            pass # still in use
+        os.close(self.refs_fd)
+        self.refs_fd = None
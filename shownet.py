@@ -25,6 +25,8 @@
 import numpy
 import sys
 import getopt as opt
+import glob
+from multiprocessing import Pool
 from util import *
 from math import sqrt, ceil, floor
 import os
@@ -35,20 +37,48 @@ from convnet import ConvNet
 from options import *
 
 try:
+    import matplotlib
+    # Report mode only writes figures to files, so it must not need a display.
+    # The backend has to be chosen before pylab is imported.
+    if any(a.startswith('--report-dir') for a in sys.argv[1:]):
+        matplotlib.use('Agg')
     import pylab as pl
 except:
     print "This script requires the matplotlib python library (Ubuntu/Fedora package name python-matplotlib). Please install it."
     sys.exit(1)
 
+REPORT_SUMMARY_FILE = 'summary'
+# Training costs are averaged over blocks of batches so that cost plots have at most this many points
+MAX_COST_PLOT_POINTS = 5000
+
 class ShowNetError(Exception):
     pass
 
+# Writes the report for a single checkpoint. This runs in a worker process,
+# so it has to be a module-level function.
+def write_checkpoint_report(args):
+    load_path, out_dir, op = args
+    try:
+        load_dic = IGPUModel.load_checkpoint(load_path)
+        op.set_value('load_file', load_path, parse=False)
+        old_op = load_dic["op"]
+        old_op.merge_from(op)
+        old_op.eval_expr_defaults()
+        model = ShowConvNet(old_op, load_dic)
+        return load_path, model.write_report(out_dir), None
+    except (UnpickleError, ShowNetError, OptionException), e:
+        return load_path, None, str(e)
+    except SystemExit:
+        return load_path, None, "unable to load the model (see above)"
+    except Exception, e: # any other failure is this checkpoint's alone
+        return load_path, None, "%s: %s" % (e.__class__.__name__, e)
+
 class ShowConvNet(ConvNet):
     def __init__(self, op, load_dic):
         ConvNet.__init__(self, op, load_dic)
     
     def get_gpus(self):
-        self.need_gpu = self.op.get_value('show_preds') or self.op.get_value('write_features')
+        self.need_gpu = (self.op.get_value('show_preds') or self.op.get_value('write_features')) and not self.op.get_value('report_dir')
         if self.need_gpu:
             ConvNet.get_gpus(self)
     
@@ -67,6 +97,7 @@ class ShowConvNet(ConvNet):
             
     def init_model_state(self):
         #ConvNet.init_model_state(self)
+        self.init_train_outputs()
         if self.op.get_value('show_preds'):
             self.sotmax_idx = self.get_layer_idx(self.op.get_value('show_preds'), check_type='softmax')
         if self.op.get_value('write_features'):
@@ -77,25 +108,23 @@ class ShowConvNet(ConvNet):
             ConvNet.init_model_lib(self)
 
     def plot_cost(self):
-        if self.show_cost not in self.train_outputs[0][0]:
+        if self.show_cost not in self.train_outputs.get_cost_names():
             raise ShowNetError("Cost function with name '%s' not defined by given convnet." % self.show_cost)
-        train_errors = [o[0][self.show_cost][self.cost_idx] for o in self.train_outputs]
+        x, train_errors = self.train_outputs.get_series(self.show_cost, idx=self.cost_idx, max_points=MAX_COST_PLOT_POINTS)
         test_errors = [o[0][self.show_cost][self.cost_idx] for o in self.test_outputs]
 
         numbatches = len(self.train_batch_range)
-        test_errors = numpy.row_stack(test_errors)
-        test_errors = numpy.tile(test_errors, (1, self.testing_freq))
-        test_errors = list(test_errors.flatten())
-        test_errors += [test_errors[-1]] * max(0,len(train_errors) - len(test_errors))
-        test_errors = test_errors[:len(train_errors)]
-
-        numepochs = len(train_errors) / float(numbatches)
+        num_train = len(self.train_outputs)
+        numepochs = num_train / float(numbatches)
         pl.figure(1)
-        x = range(0, len(train_errors))
         pl.plot(x, train_errors, 'k-', label='Training set')
-        pl.plot(x, test_errors, 'r-', label='Test set')
+        if len(test_errors) > 0:
+            # Each test result is drawn over the batches up to the next test
+            interval = self.get_test_interval()
+            test_x = [min(i * interval, num_train - 1) for i in xrange(len(test_errors))] + [num_train - 1]
+            pl.plot(test_x, test_errors + [test_errors[-1]], 'r-', drawstyle='steps-post', label='Test set')
         pl.legend()
-        ticklocs = range(numbatches, len(train_errors) - len(train_errors) % numbatches + 1, numbatches)
+        ticklocs = range(numbatches, num_train - num_train % numbatches + 1, numbatches)
         epoch_label_gran = int(ceil(numepochs / 20.)) # aim for about 20 labels
         epoch_label_gran = int(ceil(float(epoch_label_gran) / 10) * 10) # but round to nearest 10
         ticklabels = map(lambda x: str((x[1] / numbatches)) if x[0] % epoch_label_gran == epoch_label_gran-1 else '', enumerate(ticklocs))
@@ -248,6 +277,7 @@ class ShowConvNet(ConvNet):
             # load the next batch while the current one is computing
             next_data = self.get_next_batch(train=False)
             self.finish_batch()
+            self.test_data_provider.finish_batch()
             path_out = os.path.join(self.feature_path, 'data_batch_%d' % batch)
             pickle(path_out, {'data': ftrs, 'labels': data[1]})
             print "Wrote feature file %s" % path_out
@@ -256,6 +286,109 @@ class ShowConvNet(ConvNet):
         pickle(os.path.join(self.feature_path, 'batches.meta'), {'source_model':self.load_file,
                                                                  'num_vis':num_ftrs})
                 
+    def get_summary(self):
+        summary = {'checkpoint_file': os.path.basename(self.checkpoint_file),
+                   'mtime': os.path.getmtime(self.checkpoint_file),
+                   'epoch': self.epoch,
+                   'batchnum': self.batchnum,
+                   'batches_done': len(self.train_outputs),
+                   'train': {},
+                   'test': dict(self.test_outputs[-1][0]) if len(self.test_outputs) > 0 else {},
+                   'best_test': {},
+                   'weights': {}}
+        if len(self.train_outputs) > 0:
+            costs, num_cases = self.train_outputs[-1]
+            summary['train'] = dict((errname, [v / num_cases for v in values]) for errname, values in costs.iteritems())
+        for errname in summary['test']:
+            summary['best_test'][errname] = [min(o[0][errname][i] for o in self.test_outputs) for i in xrange(len(summary['test'][errname]))]
+        for l in self.layers:
+            if 'weights' in l:
+                summary['weights'][l['name']] = [float(n.mean(n.abs(w))) for w in l['weights']]
+        return summary
+    
+    # Writes cost curves, filters and summary statistics to out_dir
+    # instead of showing them.
+    def write_report(self, out_dir):
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        self.checkpoint_file = IGPUModel.get_checkpoint_file(self.load_file)
+        cost_names = []
+        if len(self.train_outputs) > 0:
+            cost_names = [self.show_cost] if self.show_cost else sorted(self.train_outputs.get_cost_names())
+        for cost_name in cost_names:
+            self.show_cost = cost_name
+            self.plot_cost()
+            pl.savefig(os.path.join(out_dir, 'cost-%s.png' % cost_name))
+            pl.close('all')
+        if self.show_filters:
+            self.plot_filters()
+            pl.savefig(os.path.join(out_dir, 'filters-%s.png' % self.show_filters))
+            pl.close('all')
+
+        summary = self.get_summary()
+        f = open(os.path.join(out_dir, 'summary.txt'), 'w')
+        f.write("Checkpoint: %s\n" % self.checkpoint_file)
+        f.write("Epoch: %d, batch: %d, batches trained: %d\n" % (summary['epoch'], summary['batchnum'], summary['batches_done']))
+        for errname in sorted(summary['test']):
+            f.write("%s: train %s, test %s, best test %s\n" % (errname, ", ".join("%6f" % v for v in summary['train'].get(errname, [])),
+                                                                ", ".join("%6f" % v for v in summary['test'][errname]),
+                                                                ", ".join("%6f" % v for v in summary['best_test'][errname])))
+        for name in sorted(summary['weights']):
+            f.write("Layer '%s' weights: %s\n" % (name, ", ".join("%e" % w for w in summary['weights'][name])))
+        f.close()
+        pickle(os.path.join(out_dir, REPORT_SUMMARY_FILE), summary)
+        return summary
+    
+    # Finds the checkpoint directories given by --report-checkpoints and writes one report per
+    # checkpoint into --report-dir, using a process pool. Checkpoints whose report
+    # is already up to date are skipped.
+    @staticmethod
+    def write_reports(op):
+        report_dir = op.get_value('report_dir')
+        if not os.path.exists(report_dir):
+            os.makedirs(report_dir)
+        paths = []
+        for pattern in op.get_value('report_checkpoints'):
+            matches = sorted(glob.glob(pattern), key=alphanum_key)
+            if len(matches) == 0:
+                print "No checkpoints match '%s'" % pattern
+            paths += [p for p in matches if p not in paths]
+        
+        jobs, summaries = [], {}
+        for path in paths:
+            name = os.path.basename(os.path.normpath(path))
+            out_dir = os.path.join(report_dir, name)
+            try:
+                checkpoint_file = IGPUModel.get_checkpoint_file(path)
+                summary = unpickle(os.path.join(out_dir, REPORT_SUMMARY_FILE))
+                if summary['checkpoint_file'] == os.path.basename(checkpoint_file) and summary['mtime'] == os.path.getmtime(checkpoint_file):
+                    print "Report for %s is up to date" % path
+                    summaries[name] = summary
+                    continue
+            except (UnpickleError, IndexError, KeyError):
+                pass
+            jobs += [(path, out_dir, op)]
+        
+        if len(jobs) > 0:
+            # One checkpoint per worker process, so that the memory held by each model is freed
+            pool = Pool(processes=min(op.get_value('report_workers'), len(jobs)), maxtasksperchild=1)
+            for path, summary, err in pool.imap_unordered(write_checkpoint_report, jobs, chunksize=1):
+                if err is not None:
+                    print "Error writing report for %s: %s" % (path, err)
+                else:
+                    print "Wrote report for %s" % path
+                    summaries[os.path.basename(os.path.normpath(path))] = summary
+            pool.close()
+            pool.join()
+        
+        f = open(os.path.join(report_dir, 'summary.txt'), 'w')
+        for name in sorted(summaries, key=alphanum_key):
+            s = summaries[name]
+            costs = ", ".join("%s: %s" % (errname, ", ".join("%6f" % v for v in s['test'][errname])) for errname in sorted(s['test']))
+            f.write("%s\t%d.%d\t%s\n" % (name, s['epoch'], s['batchnum'], costs))
+        f.close()
+        print "Wrote summary of %d checkpoints to %s" % (len(summaries), os.path.join(report_dir, 'summary.txt'))
+    
     def start(self):
         self.op.print_values()
         if self.show_cost:
@@ -273,7 +406,7 @@ class ShowConvNet(ConvNet):
     def get_options_parser(cls):
         op = ConvNet.get_options_parser()
         for option in list(op.options):
-            if option not in ('gpu', 'load_file', 'train_batch_range', 'test_batch_range'):
+            if option not in ('gpu', 'load_file', 'train_batch_range', 'test_batch_range', 'strict_arrays', 'cpu'):
                 op.delete_option(option)
         op.add_option("show-cost", "show_cost", StringOptionParser, "Show specified objective function", default="")
         op.add_option("show-filters", "show_filters", StringOptionParser, "Show learned filters in specified layer", default="")
@@ -286,14 +419,30 @@ class ShowConvNet(ConvNet):
         op.add_option("only-errors", "only_errors", BooleanOptionParser, "Show only mistaken predictions (to be used with --show-preds)", default=False, requires=['show_preds'])
         op.add_option("write-features", "write_features", StringOptionParser, "Write test data features from given layer", default="", requires=['feature-path'])
         op.add_option("feature-path", "feature_path", StringOptionParser, "Write test data features to this path (to be used with --write-features)", default="")
+        op.add_option("report-dir", "report_dir", StringOptionParser, "Write cost curves, filters and summaries of the checkpoints given to --report-checkpoints to this directory", default="")
+        op.add_option("report-checkpoints", "report_checkpoints", ListOptionParser(StringOptionParser), "Checkpoint directories or glob patterns (to be used with --report-dir)", default=[], excuses=OptionsParser.EXCLUDE_ALL, requires=['report_dir'])
+        op.add_option("report-workers", "report_workers", IntegerOptionParser, "Number of worker processes (to be used with --report-dir)", default=4)
         
         op.options['load_file'].default = None
         return op
     
+    @staticmethod
+    def parse_options(op):
+        try:
+            if op.parse()['report_checkpoints'].value_given:
+                # The report workers merge these options with each checkpoint's own options
+                return op, None
+        except OptionException:
+            pass # IGPUModel.parse_options reports the error
+        return IGPUModel.parse_options(op)
+    
 if __name__ == "__main__":
     try:
         op = ShowConvNet.get_options_parser()
-        op, load_dic = IGPUModel.parse_options(op)
+        op, load_dic = ShowConvNet.parse_options(op)
+        if op.get_value('report_checkpoints'):
+            ShowConvNet.write_reports(op)
+            sys.exit(0)
         model = ShowConvNet(op, load_dic)
         model.start()
     except (UnpickleError, ShowNetError, opt.GetoptError), e:
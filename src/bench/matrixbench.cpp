@@ -0,0 +1,203 @@
+/* 
+ * Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+ * All rights reserved.
+ *
+ * Redistribution and use in source and binary forms, with or without modification,
+ * are permitted provided that the following conditions are met:
+ *
+ * - Redistributions of source code must retain the above copyright notice,
+ *   this list of conditions and the following disclaimer.
+ * 
+ * - Redistributions in binary form must reproduce the above copyright notice,
+ *   this list of conditions and the following disclaimer in the documentation
+ *   and/or other materials provided with the distribution.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+ * AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+ * IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ * ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+ * LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+ * DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+ * LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ * ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+ * NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+ * EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+ */
+
+/*
+ * Correctness checks and benchmark for the elementwise operations and
+ * reductions of the CPU Matrix class. Builds against src/common/matrix.cpp
+ * and CBLAS only:
+ *
+ *     make matrixbench
+ *     ./bin/matrixbench [rows] [cols] [repeats]
+ *
+ * Every operation is checked against a plain getCell() loop for all
+ * combinations of transposed operands, then timed with one thread and with
+ * all OpenMP threads (when built with -fopenmp). Returns nonzero if any
+ * check fails.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <sys/time.h>
+#include <matrix.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+using namespace std;
+
+static double now() {
+    struct timeval tv;
+    gettimeofday(&tv, NULL);
+    return tv.tv_sec + tv.tv_usec / 1e6;
+}
+
+static void setNumThreads(int numThreads) {
+#ifdef _OPENMP
+    omp_set_num_threads(numThreads);
+#endif
+}
+
+static int getMaxThreads() {
+#ifdef _OPENMP
+    return omp_get_num_procs();
+#else
+    return 1;
+#endif
+}
+
+/*
+ * A rows x cols matrix of random values, stored transposed if trans is set.
+ */
+static Matrix& makeMatrix(long int rows, long int cols, bool trans) {
+    Matrix& m = trans ? *new Matrix(new MTYPE[rows * cols], rows, cols, true) : *new Matrix(rows, cols);
+    for (long int i = 0; i < rows * cols; i++) {
+        m.getData()[i] = 2 * MYRAND - 1;
+    }
+    return m;
+}
+
+static bool near(MTYPE a, MTYPE b, MTYPE tol) {
+    return fabs(a - b) <= tol * (1 + fabs(a) + fabs(b));
+}
+
+static int numFailures = 0;
+
+static void check(bool ok, const char* op, bool transA, bool transB) {
+    if (!ok) {
+        fprintf(stderr, "FAILED: %s (a %s, b %s)\n", op, transA ? "transposed" : "row-major", transB ? "transposed" : "row-major");
+        numFailures++;
+    }
+}
+
+static void checkOps(long int rows, long int cols) {
+    for (int t = 0; t < 4; t++) {
+        const bool transA = t & 1, transB = t & 2;
+        Matrix& a = makeMatrix(rows, cols, transA);
+        Matrix& b = makeMatrix(rows, cols, transB);
+        Matrix& rowVec = makeMatrix(1, cols, false);
+        Matrix& colVec = makeMatrix(rows, 1, false);
+        Matrix c, d;
+        bool ok;
+
+        a.add(b, 0.5, c);
+        ok = true;
+        for (long int i = 0; i < rows; i++) for (long int j = 0; j < cols; j++) ok &= near(c(i, j), a(i, j) + 0.5 * b(i, j), 1e-6);
+        check(ok, "add", transA, transB);
+
+        a.maxWith(b, c);
+        ok = true;
+        for (long int i = 0; i < rows; i++) for (long int j = 0; j < cols; j++) ok &= c(i, j) == std::max(a(i, j), b(i, j));
+        check(ok, "maxWith", transA, transB);
+
+        a.biggerThanScalar(0.25, c);
+        ok = true;
+        for (long int i = 0; i < rows; i++) for (long int j = 0; j < cols; j++) ok &= c(i, j) == (a(i, j) > 0.25);
+        check(ok, "biggerThanScalar", transA, transB);
+
+        a.addVector(rowVec, 2, c);
+        a.eltWiseMultByVector(colVec, d);
+        ok = true;
+        for (long int i = 0; i < rows; i++) for (long int j = 0; j < cols; j++) ok &= near(c(i, j), a(i, j) + 2 * rowVec(0, j), 1e-6);
+        check(ok, "addVector", transA, transB);
+        ok = true;
+        for (long int i = 0; i < rows; i++) for (long int j = 0; j < cols; j++) ok &= near(d(i, j), a(i, j) * colVec(i, 0), 1e-6);
+        check(ok, "eltWiseMultByVector", transA, transB);
+
+        a.sum(0, c);
+        a.max(1, d);
+        ok = true;
+        for (long int j = 0; j < cols; j++) {
+            double s = 0;
+            for (long int i = 0; i < rows; i++) s += a(i, j);
+            ok &= near(c(0, j), s, 1e-4);
+        }
+        check(ok, "sum(0)", transA, transB);
+        ok = true;
+        for (long int i = 0; i < rows; i++) {
+            MTYPE mx = -MTYPE_MAX;
+            for (long int j = 0; j < cols; j++) mx = std::max(mx, a(i, j));
+            ok &= d(i, 0) == mx;
+        }
+        check(ok, "max(1)", transA, transB);
+
+        double s2 = 0;
+        for (long int i = 0; i < rows; i++) for (long int j = 0; j < cols; j++) s2 += a(i, j) * a(i, j);
+        check(near(a.norm2(), s2, 1e-4), "norm2", transA, transB);
+
+        delete[] (transA ? a.getData() : NULL);
+        delete[] (transB ? b.getData() : NULL);
+        delete &a; delete &b; delete &rowVec; delete &colVec;
+    }
+}
+
+/*
+ * Seconds per call of the given operation, averaged over repeats calls.
+ */
+#define TIME_OP(name, expr) do { \
+    double times[2]; \
+    for (int p = 0; p < 2; p++) { \
+        setNumThreads(p == 0 ? 1 : getMaxThreads()); \
+        expr; \
+        double t = now(); \
+        for (int r = 0; r < repeats; r++) { expr; } \
+        times[p] = (now() - t) / repeats; \
+    } \
+    printf("%-28s %10.3f ms %10.3f ms %8.2fx\n", name, times[0] * 1000, times[1] * 1000, times[0] / times[1]); \
+} while (0)
+
+int main(int argc, char** argv) {
+    long int rows = argc > 1 ? atol(argv[1]) : 2048;
+    long int cols = argc > 2 ? atol(argv[2]) : 2048;
+    int repeats = argc > 3 ? atoi(argv[3]) : 20;
+
+    // Small matrices stay serial, large ones take the threaded paths
+    checkOps(7, 13);
+    checkOps(301, 257);
+    printf("Correctness checks: %s\n", numFailures == 0 ? "passed" : "FAILED");
+
+    Matrix& a = makeMatrix(rows, cols, false);
+    Matrix& b = makeMatrix(rows, cols, false);
+    Matrix& bT = makeMatrix(rows, cols, true);
+    Matrix& rowVec = makeMatrix(1, cols, false);
+    Matrix& colVec = makeMatrix(rows, 1, false);
+    Matrix c(rows, cols), v;
+
+    printf("%ldx%ld matrices, %d threads, parallel threshold %d elements\n", rows, cols, getMaxThreads(), MATRIX_PARALLEL_THRESHOLD);
+    printf("%-28s %13s %13s %9s\n", "operation", "1 thread", "all threads", "speedup");
+    TIME_OP("add", a.add(b, 0.5, c));
+    TIME_OP("add (transposed operand)", a.add(bT, 0.5, c));
+    TIME_OP("maxWith", a.maxWith(b, c));
+    TIME_OP("biggerThanScalar", a.biggerThanScalar(0, c));
+    TIME_OP("addVector (row)", c.addVector(rowVec));
+    TIME_OP("addVector (column)", c.addVector(colVec));
+    TIME_OP("eltWiseMultByVector (row)", c.eltWiseMultByVector(rowVec));
+    TIME_OP("apply(EXP)", a.apply(Matrix::EXP, c));
+    TIME_OP("sum()", a.sum());
+    TIME_OP("sum(0)", a.sum(0, v));
+    TIME_OP("sum(1)", a.sum(1, v));
+    TIME_OP("max(0) (transposed)", bT.max(0, v));
+    return numFailures == 0 ? 0 : 1;
+}
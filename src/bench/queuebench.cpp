@@ -0,0 +1,172 @@
+/* 
+ * Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+ * All rights reserved.
+ *
+ * Redistribution and use in source and binary forms, with or without modification,
+ * are permitted provided that the following conditions are met:
+ *
+ * - Redistributions of source code must retain the above copyright notice,
+ *   this list of conditions and the following disclaimer.
+ * 
+ * - Redistributions in binary form must reproduce the above copyright notice,
+ *   this list of conditions and the following disclaimer in the documentation
+ *   and/or other materials provided with the distribution.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+ * AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+ * IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ * ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+ * LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+ * DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+ * LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ * ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+ * NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+ * EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+ */
+
+/*
+ * Stress test and throughput benchmark for Queue<T> (include/common/queue.h).
+ * Needs only pthreads:
+ *
+ *     make queuebench
+ *     ./bin/queuebench [producers] [consumers] [items] [capacity]
+ *
+ * Every item is a distinct integer, so the consumers can check that each one
+ * was dequeued exactly once. Returns nonzero if any check fails.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <vector>
+#include <queue.h>
+#include <thread.h>
+
+using namespace std;
+
+static double now() {
+    struct timeval tv;
+    gettimeofday(&tv, NULL);
+    return tv.tv_sec + tv.tv_usec / 1e6;
+}
+
+#define CHECK(cond, msg) do { if (!(cond)) { fprintf(stderr, "FAILED: %s\n", msg); return false; } } while (0)
+
+class Producer : public Thread {
+private:
+    Queue<long>& _queue;
+    long _start, _end;
+protected:
+    void* run() {
+        for (long i = _start; i < _end; i++) {
+            _queue.enqueue(i);
+        }
+        return NULL;
+    }
+public:
+    Producer(Queue<long>& queue, long start, long end) : Thread(true), _queue(queue), _start(start), _end(end) {
+    }
+};
+
+/*
+ * Dequeues until it gets a negative item. Half of the consumers use the
+ * timed dequeue so that both code paths are exercised.
+ */
+class Consumer : public Thread {
+private:
+    Queue<long>& _queue;
+    vector<char>& _seen;
+    bool _timed;
+protected:
+    void* run() {
+        while (true) {
+            long el;
+            if (_timed) {
+                if (!_queue.dequeue(el, 1)) {
+                    continue;
+                }
+            } else {
+                el = _queue.dequeue();
+            }
+            if (el < 0) {
+                break;
+            }
+            // Every item is written by exactly one consumer, so this does not need a lock
+            _seen[el]++;
+        }
+        return NULL;
+    }
+public:
+    Consumer(Queue<long>& queue, vector<char>& seen, bool timed) : Thread(true), _queue(queue), _seen(seen), _timed(timed) {
+    }
+};
+
+static bool testTimeouts() {
+    Queue<long> q(1, 2);
+    long el = 0;
+    double t = now();
+    CHECK(!q.dequeue(el, 50), "timed dequeue on empty queue returned an element");
+    CHECK(now() - t >= 0.045, "timed dequeue returned before its timeout");
+    CHECK(!q.dequeue(el, 0), "non-blocking dequeue on empty queue returned an element");
+    CHECK(q.enqueue(1, 0) && q.enqueue(2, 0), "non-blocking enqueue failed on non-full queue");
+    t = now();
+    CHECK(!q.enqueue(3, 50), "timed enqueue succeeded on full queue");
+    CHECK(now() - t >= 0.045, "timed enqueue returned before its timeout");
+    CHECK(q.getNumElements() == 2, "bounded queue holds more than its capacity");
+    CHECK(q.dequeue(el, 0) && el == 1 && q.dequeue() == 2, "queue is not FIFO");
+    return true;
+}
+
+/*
+ * Runs the given number of producers and consumers over one queue.
+ * Returns false if some item was lost or duplicated.
+ */
+static bool runStress(int numProducers, int numConsumers, long numItems, int capacity) {
+    Queue<long> q(16, capacity);
+    vector<char> seen(numItems, 0);
+    vector<Producer*> producers;
+    vector<Consumer*> consumers;
+
+    double t = now();
+    for (int i = 0; i < numConsumers; i++) {
+        consumers.push_back(new Consumer(q, seen, i % 2 == 1));
+        consumers.back()->start();
+    }
+    for (int i = 0; i < numProducers; i++) {
+        producers.push_back(new Producer(q, numItems * i / numProducers, numItems * (i + 1) / numProducers));
+        producers.back()->start();
+    }
+    for (int i = 0; i < numProducers; i++) {
+        producers[i]->join();
+        delete producers[i];
+    }
+    for (int i = 0; i < numConsumers; i++) {
+        q.enqueue(-1);
+    }
+    for (int i = 0; i < numConsumers; i++) {
+        consumers[i]->join();
+        delete consumers[i];
+    }
+    t = now() - t;
+
+    printf("%d producers, %d consumers, capacity %8d: %10ld items in %.3f sec (%.2f M items/sec)\n",
+           numProducers, numConsumers, capacity, numItems, t, numItems / t / 1e6);
+    for (long i = 0; i < numItems; i++) {
+        CHECK(seen[i] == 1, "item lost or dequeued more than once");
+    }
+    CHECK(q.getNumElements() == 0, "queue not empty after all consumers finished");
+    return true;
+}
+
+int main(int argc, char** argv) {
+    int numProducers = argc > 1 ? atoi(argv[1]) : 4;
+    int numConsumers = argc > 2 ? atoi(argv[2]) : 4;
+    long numItems = argc > 3 ? atol(argv[3]) : 1000000;
+    int capacity = argc > 4 ? atoi(argv[4]) : 64;
+
+    bool ok = testTimeouts();
+    ok = runStress(1, 1, numItems, 1) && ok;
+    ok = runStress(numProducers, numConsumers, numItems, capacity) && ok;
+    ok = runStress(numProducers, numConsumers, numItems, 0) && ok;
+    printf(ok ? "All queue checks passed.\n" : "Queue checks FAILED.\n");
+    return ok ? 0 : 1;
+}
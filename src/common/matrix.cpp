@@ -26,6 +26,10 @@
 
 #include <matrix.h>
 #include <matrix_funcs.h>
+#include <vector>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 
 #if defined(_WIN64) || defined(_WIN32)
 double sqrt(int _X) {return sqrt((double) _X);}
@@ -34,6 +38,205 @@ double log(int _X) {return log((double) _X);}
 
 using namespace std;
 
+/*
+ * Function objects that let the loops below inline the functions in matrix_funcs.h.
+ * Each maps an element of x and the corresponding element of y to an element of the target.
+ */
+template <MTYPE (*func)(MTYPE)>
+struct UnaryOp {
+    inline MTYPE operator()(MTYPE x, MTYPE y) const {
+        return func(x);
+    }
+};
+
+template <MTYPE (*func)(MTYPE, MTYPE)>
+struct BinaryOp {
+    inline MTYPE operator()(MTYPE x, MTYPE y) const {
+        return func(x, y);
+    }
+};
+
+template <MTYPE (*func)(MTYPE, MTYPE)>
+struct ScalarOp {
+    const MTYPE _scalar;
+    ScalarOp(MTYPE scalar) : _scalar(scalar) {
+    }
+    inline MTYPE operator()(MTYPE x, MTYPE y) const {
+        return func(x, _scalar);
+    }
+};
+
+template <MTYPE (*func)(MTYPE, MTYPE, MTYPE)>
+struct ScaledBinaryOp {
+    const MTYPE _scalar;
+    ScaledBinaryOp(MTYPE scalar) : _scalar(scalar) {
+    }
+    inline MTYPE operator()(MTYPE x, MTYPE y) const {
+        return func(x, y, _scalar);
+    }
+};
+
+/*
+ * The loops below walk the target in its storage order: numLines lines
+ * (rows if it's not transposed, columns if it is) of lineLen contiguous elements.
+ * This returns the strides of m's data along such a walk.
+ */
+static inline void getStrides(const Matrix& m, const Matrix& target, long int& lineStride, long int& eltStride) {
+    if (m.isTrans() == target.isTrans()) {
+        lineStride = target.getLeadingDim();
+        eltStride = 1;
+    } else {
+        lineStride = 1;
+        eltStride = target.getFollowingDim();
+    }
+}
+
+/*
+ * target := op(x, y), elementwise. All three must have the same dimensions.
+ */
+template <class Op>
+static void eltWiseLoop(const Op& op, const Matrix& x, const Matrix& y, Matrix& target) {
+    const MTYPE *xData = x.getData(), *yData = y.getData();
+    MTYPE* tgtData = target.getData();
+    const long int numElements = target.getNumElements();
+    if (x.isTrans() == target.isTrans() && y.isTrans() == target.isTrans()) {
+        #pragma omp parallel for if(numElements >= MATRIX_PARALLEL_THRESHOLD)
+        for (long int i = 0; i < numElements; i++) {
+            tgtData[i] = op(xData[i], yData[i]);
+        }
+    } else {
+        const long int numLines = target.getFollowingDim(), lineLen = target.getLeadingDim();
+        long int xLineStride, xEltStride, yLineStride, yEltStride;
+        getStrides(x, target, xLineStride, xEltStride);
+        getStrides(y, target, yLineStride, yEltStride);
+        #pragma omp parallel for if(numElements >= MATRIX_PARALLEL_THRESHOLD)
+        for (long int l = 0; l < numLines; l++) {
+            MTYPE* tgtLine = tgtData + l * lineLen;
+            const MTYPE* xLine = xData + l * xLineStride;
+            const MTYPE* yLine = yData + l * yLineStride;
+            for (long int j = 0; j < lineLen; j++) {
+                tgtLine[j] = op(xLine[j * xEltStride], yLine[j * yEltStride]);
+            }
+        }
+    }
+}
+
+/*
+ * target := op(target, tile(vec)), where vec is a row vector as wide as
+ * target or a column vector as tall as it.
+ */
+template <class Op>
+static void vectorLoop(const Op& op, const Matrix& vec, Matrix& target) {
+    const bool rowVector = vec.getNumRows() == 1;
+    // Whether vec runs along the lines of target's storage or across them
+    const bool alongLines = rowVector != target.isTrans();
+    const long int numLines = target.getFollowingDim(), lineLen = target.getLeadingDim();
+    const MTYPE* vecData = vec.getData();
+    MTYPE* tgtData = target.getData();
+    #pragma omp parallel for if(target.getNumElements() >= MATRIX_PARALLEL_THRESHOLD)
+    for (long int l = 0; l < numLines; l++) {
+        MTYPE* tgtLine = tgtData + l * lineLen;
+        if (alongLines) {
+            for (long int j = 0; j < lineLen; j++) {
+                tgtLine[j] = op(tgtLine[j], vecData[j]);
+            }
+        } else {
+            const MTYPE v = vecData[l];
+            for (long int j = 0; j < lineLen; j++) {
+                tgtLine[j] = op(tgtLine[j], v);
+            }
+        }
+    }
+}
+
+#define AGG_LANES   8
+#define AGG_BLOCK   1024
+
+/*
+ * Folds n contiguous values into initialValue with agg, which must be
+ * associative up to rounding. combine merges two partial results (for
+ * _addSquare that is _add). The values are spread over AGG_LANES independent
+ * accumulators so that the compiler can vectorize the main loop.
+ */
+template <MTYPE (*agg)(MTYPE, MTYPE), MTYPE (*combine)(MTYPE, MTYPE)>
+static inline MTYPE aggregateLine(const MTYPE* data, long int n, MTYPE initialValue) {
+    MTYPE lanes[AGG_LANES];
+    for (int k = 0; k < AGG_LANES; k++) {
+        lanes[k] = initialValue;
+    }
+    long int i = 0;
+    for (; i + AGG_LANES <= n; i += AGG_LANES) {
+        for (int k = 0; k < AGG_LANES; k++) {
+            lanes[k] = agg(data[i + k], lanes[k]);
+        }
+    }
+    MTYPE v = initialValue;
+    for (; i < n; i++) {
+        v = agg(data[i], v);
+    }
+    for (int k = 0; k < AGG_LANES; k++) {
+        v = combine(lanes[k], v);
+    }
+    return v;
+}
+
+template <MTYPE (*agg)(MTYPE, MTYPE), MTYPE (*combine)(MTYPE, MTYPE)>
+static MTYPE aggregateAll(const Matrix& m, MTYPE initialValue) {
+    const MTYPE* data = m.getData();
+    const long int n = m.getNumElements();
+#ifdef _OPENMP
+    if (n >= MATRIX_PARALLEL_THRESHOLD) {
+        vector<MTYPE> partials(omp_get_max_threads(), initialValue);
+        #pragma omp parallel num_threads(partials.size())
+        {
+            const long int t = omp_get_thread_num(), numThreads = omp_get_num_threads();
+            const long int start = n * t / numThreads, end = n * (t + 1) / numThreads;
+            partials[t] = aggregateLine<agg, combine>(data + start, end - start, initialValue);
+        }
+        MTYPE v = initialValue;
+        for (size_t t = 0; t < partials.size(); t++) {
+            v = combine(partials[t], v);
+        }
+        return v;
+    }
+#endif
+    return aggregateLine<agg, combine>(data, n, initialValue);
+}
+
+/*
+ * Aggregates m along the given axis into target, which must already have the right size.
+ */
+template <MTYPE (*agg)(MTYPE, MTYPE), MTYPE (*combine)(MTYPE, MTYPE)>
+static void aggregateAxis(const Matrix& m, long int axis, MTYPE initialValue, Matrix& target) {
+    const long int numLines = m.getFollowingDim(), lineLen = m.getLeadingDim();
+    const MTYPE* data = m.getData();
+    MTYPE* tgtData = target.getData();
+    if ((axis == 0) == m.isTrans()) {
+        // Every result is the aggregate of one storage line
+        #pragma omp parallel for if(m.getNumElements() >= MATRIX_PARALLEL_THRESHOLD)
+        for (long int l = 0; l < numLines; l++) {
+            tgtData[l] = aggregateLine<agg, combine>(data + l * lineLen, lineLen, initialValue);
+        }
+    } else {
+        // Every result collects one position of all lines. Each thread takes
+        // blocks of AGG_BLOCK positions and folds in the lines one by one.
+        const long int numBlocks = (lineLen + AGG_BLOCK - 1) / AGG_BLOCK;
+        #pragma omp parallel for if(m.getNumElements() >= MATRIX_PARALLEL_THRESHOLD)
+        for (long int b = 0; b < numBlocks; b++) {
+            const long int start = b * AGG_BLOCK, end = std::min(lineLen, start + AGG_BLOCK);
+            for (long int j = start; j < end; j++) {
+                tgtData[j] = initialValue;
+            }
+            for (long int l = 0; l < numLines; l++) {
+                const MTYPE* line = data + l * lineLen;
+                for (long int j = start; j < end; j++) {
+                    tgtData[j] = agg(line[j], tgtData[j]);
+                }
+            }
+        }
+    }
+}
+
 void Matrix::_init(MTYPE* data, long int numRows, long int numCols, bool transpose, bool ownsData) {
     _updateDims(numRows, numCols);
     _ownsData = ownsData;
@@ -68,23 +271,80 @@ Matrix::Matrix(MTYPE* data, long int numRows, long int numCols, bool transpose)
 }
 
 #ifdef NUMPY_INTERFACE
+#define COPY_TILE   64
+
+long int Matrix::_numArrayCopies = 0;
+long int Matrix::_numArrayCopyBytes = 0;
+
+/*
+ * Copies a strided rows x cols array into dense storage, row-major or (if colMajor)
+ * column-major. The copy goes tile by tile so that the strided reads of one tile
+ * stay in cache while its contiguous output lines are written.
+ */
+static void copyStrided(const char* src, long int rows, long int cols, long int rowStride, long int colStride,
+                        MTYPE* dst, bool colMajor) {
+    for (long int i0 = 0; i0 < rows; i0 += COPY_TILE) {
+        const long int i1 = std::min(rows, i0 + COPY_TILE);
+        for (long int j0 = 0; j0 < cols; j0 += COPY_TILE) {
+            const long int j1 = std::min(cols, j0 + COPY_TILE);
+            if (colMajor) {
+                for (long int j = j0; j < j1; j++) {
+                    const char* srcCol = src + j * colStride;
+                    MTYPE* dstCol = dst + j * rows;
+                    for (long int i = i0; i < i1; i++) {
+                        dstCol[i] = *reinterpret_cast<const MTYPE*>(srcCol + i * rowStride);
+                    }
+                }
+            } else {
+                for (long int i = i0; i < i1; i++) {
+                    const char* srcRow = src + i * rowStride;
+                    MTYPE* dstRow = dst + i * cols;
+                    for (long int j = j0; j < j1; j++) {
+                        dstRow[j] = *reinterpret_cast<const MTYPE*>(srcRow + j * colStride);
+                    }
+                }
+            }
+        }
+    }
+}
+
+/*
+ * Whether Matrix(src) will use src's memory rather than a copy of it.
+ */
+bool Matrix::canAlias(const PyArrayObject *src) {
+    return src == NULL || src->flags & NPY_CONTIGUOUS || src->flags & NPY_FORTRAN;
+}
+
+long int Matrix::getNumArrayCopies() {
+    return _numArrayCopies;
+}
+
+long int Matrix::getNumArrayCopyBytes() {
+    return _numArrayCopyBytes;
+}
+
+/*
+ * Aliases contiguous arrays. Anything else is copied (and counted), keeping the
+ * array's faster axis contiguous in the copy. Writes to a copy do not reach the array.
+ */
 Matrix::Matrix(const PyArrayObject *src) {
     this->_data = NULL;
     this->_trans = CblasNoTrans;
     if (src != NULL) {
         this->_updateDims(PyArray_DIM(src,0), PyArray_DIM(src,1));
-        if (src->flags & NPY_CONTIGUOUS || src->flags & NPY_FORTRAN) {
+        if (canAlias(src)) {
             this->_data = (MTYPE*) src->data;
             this->_ownsData = false;
             this->_trans = src->flags & NPY_CONTIGUOUS ? CblasNoTrans : CblasTrans;
         } else {
-            this->_data = new MTYPE[PyArray_DIM(src,0) * PyArray_DIM(src,1)];
-            for (long int i = 0; i < PyArray_DIM(src,0); i++) {
-                for (long int j = 0; j < PyArray_DIM(src,1); j++) {
-                    (*this)(i,j) = *reinterpret_cast<MTYPE*>(PyArray_GETPTR2(src,i,j));
-                }
-            }
+            const long int rowStride = PyArray_STRIDE(src, 0), colStride = PyArray_STRIDE(src, 1);
+            const bool colMajor = labs(rowStride) < labs(colStride);
+            this->_data = new MTYPE[this->_numElements];
+            this->_trans = colMajor ? CblasTrans : CblasNoTrans;
+            copyStrided(src->data, this->_numRows, this->_numCols, rowStride, colStride, this->_data, colMajor);
             this->_ownsData = true;
+            _numArrayCopies++;
+            _numArrayCopyBytes += getNumDataBytes();
         }
     }
 }
@@ -175,17 +435,17 @@ void Matrix::equalsScalar(MTYPE scalar) {
 
 void Matrix::biggerThanScalar(MTYPE scalar, Matrix& target) const {
     target.resize(*this);
-    _applyLoopScalar(scalar, &_bigger, target);
+    eltWiseLoop(ScalarOp<&_bigger>(scalar), *this, *this, target);
 }
 
 void Matrix::smallerThanScalar(MTYPE scalar, Matrix& target) const {
     target.resize(*this);
-    _applyLoopScalar(scalar, &_smaller, target);
+    eltWiseLoop(ScalarOp<&_smaller>(scalar), *this, *this, target);
 }
 
 void Matrix::equalsScalar(MTYPE scalar, Matrix& target) const {
     target.resize(*this);
-    _applyLoopScalar(scalar, &_equal, target);
+    eltWiseLoop(ScalarOp<&_equal>(scalar), *this, *this, target);
 }
 
 void Matrix::add(const Matrix &m) {
@@ -218,20 +478,13 @@ void Matrix::subtract(const Matrix &m, MTYPE scale, Matrix& target) {
 
 void Matrix::add(const Matrix &m, MTYPE scale, Matrix &target) {
     assert(this->isSameDims(m));
-    if (isTrans() != m.isTrans() || isTrans() != target.isTrans()) {
-        if (&target != this) {
-            target.resize(*this);
-        }
-        if(scale == 1) {
-            this->_applyLoop2(m, &_add, target);
-        } else {
-            this->_applyLoop2(m, &_addWithScale, scale, target);
-        }
+    if (&target != this) {
+        target.resize(*this);
+    }
+    if(scale == 1) {
+        eltWiseLoop(BinaryOp<&_add>(), *this, m, target);
     } else {
-        if (&target != this) {
-            copy(target);
-        }
-        CBLAS_AXPY(getNumElements(), scale, m._data, 1, target._data, 1);
+        eltWiseLoop(ScaledBinaryOp<&_addWithScale>(scale), *this, m, target);
     }
 }
 
@@ -241,7 +494,7 @@ void Matrix::addScalar(MTYPE scalar) {
 
 void Matrix::addScalar(MTYPE scalar, Matrix& target) const {
     target.resize(*this);
-    _applyLoopScalar(scalar, &_add, target);
+    eltWiseLoop(ScalarOp<&_add>(scalar), *this, *this, target);
 }
 
 void Matrix::maxWithScalar(MTYPE scalar) {
@@ -250,7 +503,7 @@ void Matrix::maxWithScalar(MTYPE scalar) {
 
 void Matrix::maxWithScalar(MTYPE scalar, Matrix& target) const {
     target.resize(*this);
-    _applyLoopScalar(scalar, &_max, target);
+    eltWiseLoop(ScalarOp<&_max>(scalar), *this, *this, target);
 }
 
 void Matrix::minWithScalar(MTYPE scalar) {
@@ -259,7 +512,7 @@ void Matrix::minWithScalar(MTYPE scalar) {
 
 void Matrix::minWithScalar(MTYPE scalar, Matrix& target) const {
     target.resize(*this);
-    _applyLoopScalar(scalar, &_min, target);
+    eltWiseLoop(ScalarOp<&_min>(scalar), *this, *this, target);
 }
 
 void Matrix::biggerThan(Matrix& a) {
@@ -269,7 +522,7 @@ void Matrix::biggerThan(Matrix& a) {
 void Matrix::biggerThan(Matrix& a, Matrix& target) const {
     assert(isSameDims(a));
     target.resize(*this);
-    _applyLoop2(a, &_bigger, target);
+    eltWiseLoop(BinaryOp<&_bigger>(), *this, a, target);
 }
 
 void Matrix::smallerThan(Matrix& a) {
@@ -279,7 +532,7 @@ void Matrix::smallerThan(Matrix& a) {
 void Matrix::smallerThan(Matrix& a, Matrix& target) const {
     assert(isSameDims(a));
     target.resize(*this);
-    _applyLoop2(a, &_smaller, target);
+    eltWiseLoop(BinaryOp<&_smaller>(), *this, a, target);
 }
 
 void Matrix::equals(Matrix& a) {
@@ -289,7 +542,7 @@ void Matrix::equals(Matrix& a) {
 void Matrix::equals(Matrix& a, Matrix& target) const {
     assert(isSameDims(a));
     target.resize(*this);
-    _applyLoop2(a, &_equal, target);
+    eltWiseLoop(BinaryOp<&_equal>(), *this, a, target);
 }
 
 void Matrix::notEquals(Matrix& a) {
@@ -299,7 +552,7 @@ void Matrix::notEquals(Matrix& a) {
 void Matrix::notEquals(Matrix& a, Matrix& target) const {
     assert(isSameDims(a));
     target.resize(*this);
-    _applyLoop2(a, &_notEqual, target);
+    eltWiseLoop(BinaryOp<&_notEqual>(), *this, a, target);
 }
 
 void Matrix::minWith(Matrix &a) {
@@ -309,7 +562,7 @@ void Matrix::minWith(Matrix &a) {
 void Matrix::minWith(Matrix &a, Matrix& target) const {
     assert(isSameDims(a));
     target.resize(*this);
-    _applyLoop2(a, &_min, target);
+    eltWiseLoop(BinaryOp<&_min>(), *this, a, target);
 }
 
 void Matrix::maxWith(Matrix &a) {
@@ -319,7 +572,7 @@ void Matrix::maxWith(Matrix &a) {
 void Matrix::maxWith(Matrix &a, Matrix& target) const {
     assert(isSameDims(a));
     target.resize(*this);
-    _applyLoop2(a, &_max, target);
+    eltWiseLoop(BinaryOp<&_max>(), *this, a, target);
 }
 
 /* this := this + scale*tile(vec) */
@@ -330,11 +583,10 @@ void Matrix::addVector(const Matrix& vec, MTYPE scale, Matrix& target) {
     assert(std::min(vec.getNumCols(), vec.getNumRows()) == 1);
     const bool rowVector = vec.getNumRows() == 1;
     assert((rowVector && vec.getNumCols() == target.getNumCols()) || (!rowVector && vec.getNumRows() == target.getNumRows()));
-    const long int loopTil = rowVector ? target.getNumRows() : target.getNumCols();
-    const long int dataInc = ((rowVector && target.isTrans()) || (!rowVector && !target.isTrans())) ? 1 : (rowVector ? target.getNumCols() : target.getNumRows());
-    const long int myStride = ((target.isTrans() && rowVector) || (!target.isTrans() && !rowVector)) ? loopTil : 1;
-    for (long int i = 0; i < loopTil; i++) {
-        CBLAS_AXPY(vec.getNumElements(), scale, vec._data, 1, target._data + dataInc * i, myStride);
+    if (scale == 1) {
+        vectorLoop(BinaryOp<&_add>(), vec, target);
+    } else {
+        vectorLoop(ScaledBinaryOp<&_addWithScale>(scale), vec, target);
     }
 }
 
@@ -355,7 +607,6 @@ void Matrix::eltWiseMultByVector(const Matrix& vec) {
     eltWiseMultByVector(vec, *this);
 }
 
-/* omg test these */
 void Matrix::eltWiseMultByVector(const Matrix& vec, Matrix& target) {
     if(&target != this) {
         copy(target);
@@ -363,12 +614,7 @@ void Matrix::eltWiseMultByVector(const Matrix& vec, Matrix& target) {
     assert(std::min(vec.getNumCols(), vec.getNumRows()) == 1);
     const bool rowVector = vec.getNumRows() == 1;
     assert((rowVector && vec.getNumCols() == target.getNumCols()) || (!rowVector && vec.getNumRows() == target.getNumRows()));
-    const long int dataInc = ((rowVector && !target.isTrans()) || (!rowVector && target.isTrans())) ? 1 : (rowVector ? target.getNumRows() : target.getNumCols());
-    const long int myStride = ((!target.isTrans() && !rowVector) || (target.isTrans() && rowVector)) ? 1 : vec.getNumElements();
-    const long int numScaling = rowVector ? target.getNumRows() : target.getNumCols();
-    for (long int i = 0; i < vec.getNumElements(); i++) {
-        CBLAS_SCAL(numScaling, vec._data[i], target._data + dataInc * i, myStride);
-    }
+    vectorLoop(BinaryOp<&_mult>(), vec, target);
 }
 
 /* return := scale * this * b */
@@ -533,7 +779,7 @@ void Matrix::_copyAllTo(Matrix& target) const {
 }
 
 MTYPE Matrix::min() const {
-    return _aggregate(&_min, MTYPE_MAX);
+    return aggregateAll<&_min, &_min>(*this, MTYPE_MAX);
 }
 
 Matrix& Matrix::min(long int axis) const {
@@ -543,11 +789,12 @@ Matrix& Matrix::min(long int axis) const {
 }
 
 void Matrix::min(long int axis, Matrix& target) const {
-    _aggregate(axis, target, &_min, MTYPE_MAX);
+    _resizeForAxis(axis, target);
+    aggregateAxis<&_min, &_min>(*this, axis, MTYPE_MAX, target);
 }
 
 MTYPE Matrix::max() const {
-    return _aggregate(&_max, -MTYPE_MAX);
+    return aggregateAll<&_max, &_max>(*this, -MTYPE_MAX);
 }
 
 Matrix& Matrix::max(long int axis) const {
@@ -557,11 +804,12 @@ Matrix& Matrix::max(long int axis) const {
 }
 
 void Matrix::max(long int axis, Matrix& target) const {
-    _aggregate(axis, target, &_max, -MTYPE_MAX);
+    _resizeForAxis(axis, target);
+    aggregateAxis<&_max, &_max>(*this, axis, -MTYPE_MAX, target);
 }
 
 MTYPE Matrix::sum() const {
-    return _aggregate(&_add, 0);
+    return aggregateAll<&_add, &_add>(*this, 0);
 }
 
 MTYPE Matrix::norm() const {
@@ -569,7 +817,7 @@ MTYPE Matrix::norm() const {
 }
 
 MTYPE Matrix::norm2() const {
-    return _aggregate(&_addSquare, 0);
+    return aggregateAll<&_addSquare, &_add>(*this, 0);
 }
 
 Matrix& Matrix::sum(long int axis) const {
@@ -579,46 +827,16 @@ Matrix& Matrix::sum(long int axis) const {
 }
 
 void Matrix::sum(long int axis, Matrix& target) const {
-    _aggregate(axis, target, &_add, 0);
+    _resizeForAxis(axis, target);
+    aggregateAxis<&_add, &_add>(*this, axis, 0, target);
 }
 
-void Matrix::_aggregate(long int axis, Matrix& target, MTYPE (*agg_func)(MTYPE, MTYPE), MTYPE initialValue) const {
+void Matrix::_resizeForAxis(long int axis, Matrix& target) const {
     if (axis == 0) {
         target.resize(1, this->_numCols);
-        for (long int j = 0; j < this->_numCols; j++) {
-            target(0, j) = _aggregateCol(j, agg_func, initialValue);
-        }
     } else {
         target.resize(this->_numRows, 1);
-        for (long int i = 0; i < this->_numRows; i++) {
-            target(i, 0) = _aggregateRow(i, agg_func, initialValue);
-        }
-    }
-}
-
-MTYPE Matrix::_aggregateRow(long int row, MTYPE (*agg_func)(MTYPE, MTYPE), MTYPE initialValue) const {
-    MTYPE v = initialValue;
-    for (long int j = 0; j < this->_numCols; j++) {
-        v = agg_func((*this)(row, j), v);
-    }
-    return v;
-}
-
-MTYPE Matrix::_aggregateCol(long int col, MTYPE (*agg_func)(MTYPE, MTYPE), MTYPE initialValue) const {
-    MTYPE v = initialValue;
-    for (long int i = 0; i < this->_numRows; i++) {
-        v = agg_func((*this)(i, col), v);
-    }
-    return v;
-}
-
-MTYPE Matrix::_aggregate(MTYPE (*agg_func)(MTYPE, MTYPE), MTYPE initialValue) const {
-    MTYPE v = initialValue;
-    MTYPE* ptr = _data;
-    for (long int i = 0; i < getNumElements(); i++, ptr++) {
-        v = agg_func(*ptr, v);
     }
-    return v;
 }
 
 void Matrix::printShape(const char* name) const {
@@ -661,13 +879,13 @@ void Matrix::apply(Matrix::FUNCTION f, Matrix& target) {
     } else if(f == LOG) {
         MKL_LOG(this->getNumElements(), this->_data, target._data);
     } else if (f == ZERO) {
-        _applyLoop(&_zero, target);
+        eltWiseLoop(UnaryOp<&_zero>(), *this, *this, target);
     } else if (f == ONE) {
-        _applyLoop(&_one, target);
+        eltWiseLoop(UnaryOp<&_one>(), *this, *this, target);
     } else if(f == ABS) {
-        _applyLoop(&_abs, target);
+        eltWiseLoop(UnaryOp<&_abs>(), *this, *this, target);
     } else if(f == SIGN) {
-        _applyLoop(&_sign, target);
+        eltWiseLoop(UnaryOp<&_sign>(), *this, *this, target);
     } else if (f == LOGISTIC1) {
         if(&target != this) {
             copy(target);
@@ -697,7 +915,7 @@ void Matrix::eltWiseMult(const Matrix& a, Matrix& target) const {
     if (a.isTrans() == this->isTrans()) {
         MKL_VECMUL(getNumElements(), this->_data, a._data, target._data);
     } else {
-        this->_applyLoop2(a, &_mult, target);
+        eltWiseLoop(BinaryOp<&_mult>(), *this, a, target);
     }
 }
 
@@ -711,7 +929,7 @@ void Matrix::eltWiseDivide(const Matrix& a, Matrix &target) const {
     if (a.isTrans() == this->isTrans() && a.isTrans() == target.isTrans()) {
         MKL_VECDIV(getNumElements(), this->_data, a._data, target._data);
     } else {
-        this->_applyLoop2(a, &_divide, target);
+        eltWiseLoop(BinaryOp<&_divide>(), *this, a, target);
     }
 }
 
@@ -755,45 +973,44 @@ void Matrix::randomizeNormal(VSLStreamStatePtr stream) {
 #else
 
 void Matrix::apply(Matrix::FUNCTION f, Matrix& target) {
-    MTYPE (*func)(MTYPE);
+    target.resize(*this);
     if(f == EXP) {
-        func = &_exp;
+        eltWiseLoop(UnaryOp<&_exp>(), *this, *this, target);
     } else if(f == TANH) {
-        func = &_tanh;
+        eltWiseLoop(UnaryOp<&_tanh>(), *this, *this, target);
     } else if(f == RECIPROCAL) {
-        func = &_recip;
+        eltWiseLoop(UnaryOp<&_recip>(), *this, *this, target);
     } else if (f == SQUARE) {
-        func = &_square;
+        eltWiseLoop(UnaryOp<&_square>(), *this, *this, target);
     } else if(f == LOG) {
-        func = &_log;
+        eltWiseLoop(UnaryOp<&_log>(), *this, *this, target);
     } else if(f == ZERO) {
-        func = &_zero;
+        eltWiseLoop(UnaryOp<&_zero>(), *this, *this, target);
     } else if (f == ONE) {
-        func = &_one;
+        eltWiseLoop(UnaryOp<&_one>(), *this, *this, target);
     } else if(f == LOGISTIC1) {
-        func = &_sigma1;
+        eltWiseLoop(UnaryOp<&_sigma1>(), *this, *this, target);
     } else if(f == LOGISTIC2) {
-        func = &_sigma2;
+        eltWiseLoop(UnaryOp<&_sigma2>(), *this, *this, target);
     } else if (f == ABS) {
-        func = &_abs;
+        eltWiseLoop(UnaryOp<&_abs>(), *this, *this, target);
     } else if (f == SIGN) {
-        func = &_sign;
+        eltWiseLoop(UnaryOp<&_sign>(), *this, *this, target);
     } else {
         throw "Matrix::apply: Unknown function type";
     }
-    this->_applyLoop(func, target);
 }
 
 void Matrix::eltWiseMult(const Matrix& a, Matrix& target) const {
     assert(isSameDims(a));
     target.resize(*this);
-    this->_applyLoop2(a, &_mult, target);
+    eltWiseLoop(BinaryOp<&_mult>(), *this, a, target);
 }
 
 void Matrix::eltWiseDivide(const Matrix& a, Matrix& target) const {
     assert(isSameDims(a));
     target.resize(*this);
-    this->_applyLoop2(a, &_divide, target);
+    eltWiseLoop(BinaryOp<&_divide>(), *this, a, target);
 }
 
 void Matrix::eltWiseMult(const Matrix& a) {
@@ -804,8 +1021,11 @@ void Matrix::eltWiseDivide(const Matrix& a) {
     eltWiseDivide(a, *this);
 }
 
+/* rand() is not thread-safe, so this stays serial */
 void Matrix::randomizeUniform() {
-    this->_applyLoop(&_rand);
+    for (long int i = 0; i < getNumElements(); i++) {
+        _data[i] = _rand(_data[i]);
+    }
 }
 
 void Matrix::randomizeNormal() {
@@ -851,58 +1071,20 @@ Matrix& Matrix::reshaped(long int numRows, long int numCols) {
     return *new Matrix(_data, numRows, numCols, isTrans());
 }
 
-void Matrix::_applyLoop(MTYPE (*func)(MTYPE), Matrix& target) {
-    MTYPE *ptr = this->_data, *tgtPtr = target._data;
-    for (long int i = 0; i < getNumElements(); i++, ptr++, tgtPtr++) {
-        *tgtPtr = (*func)(*ptr);
-    }
-}
-
-void Matrix::_applyLoop(MTYPE (*func)(MTYPE)) {
-    _applyLoop(func, *this);
-}
-
-void Matrix::_applyLoop2(const Matrix& a, MTYPE (*func)(MTYPE,MTYPE), Matrix& target) const {
-    for (long int i = 0; i < getNumRows(); i++) {
-        for (long int j = 0; j < getNumCols(); j++) {
-            target(i, j) = (*func)((*this)(i, j), a(i, j));
-        }
-    }
-}
-
-void Matrix::_applyLoop2(const Matrix& a, MTYPE (*func)(MTYPE,MTYPE, MTYPE), MTYPE scalar, Matrix& target) const {
-    for (long int i = 0; i < getNumRows(); i++) {
-        for (long int j = 0; j < getNumCols(); j++) {
-            target(i, j) = (*func)((*this)(i, j), a(i, j), scalar);
-        }
-    }
-}
-
-void Matrix::_applyLoopScalar(const MTYPE scalar, MTYPE(*func)(MTYPE, MTYPE), Matrix& target) const {
-    MTYPE *myPtr = _data;
-    MTYPE *targetPtr = target._data;
-    for (long int i = 0; i < getNumElements(); i++, myPtr++, targetPtr++) {
-        *targetPtr = (*func)(*myPtr, scalar);
-    }
-}
-
+/* the element order does not matter here, so these walk the data directly */
 bool Matrix::hasNan() const {
-    for (long int r = 0; r < _numRows; r++) {
-        for (long int c = 0; c < _numCols; c++) {
-            if (isnan((*this)(r,c))) {
-                return true;
-            }
+    for (long int i = 0; i < _numElements; i++) {
+        if (isnan(_data[i])) {
+            return true;
         }
     }
     return false;
 }
 
 bool Matrix::hasInf() const {
-    for (long int r = 0; r < _numRows; r++) {
-        for (long int c = 0; c < _numCols; c++) {
-            if (isinf((*this)(r,c))) {
-                return true;
-            }
+    for (long int i = 0; i < _numElements; i++) {
+        if (isinf(_data[i])) {
+            return true;
         }
     }
     return false;
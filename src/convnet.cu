@@ -41,7 +41,8 @@ using namespace std;
  * ConvNet
  * =======================
  */
-ConvNet::ConvNet(PyListObject* layerParams, int minibatchSize, int deviceID) : Thread(false),  _deviceID(deviceID), _data(NULL) {
+ConvNet::ConvNet(PyListObject* layerParams, int minibatchSize, int deviceID) : Thread(false),  _deviceID(deviceID), _data(NULL),
+                                                                                 _workerQueue(WORKER_QUEUE_CAPACITY, WORKER_QUEUE_CAPACITY) {
     try {
         int numLayers = PyList_GET_SIZE(layerParams);
     
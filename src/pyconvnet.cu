@@ -43,6 +43,7 @@
 
 using namespace std;
 static ConvNet* model = NULL;
+static bool strictArrays = false;
 
 static PyMethodDef _ConvNetMethods[] = {  { "initModel",          initModel,          METH_VARARGS },
                                               { "startBatch",         startBatch,         METH_VARARGS },
@@ -51,6 +52,8 @@ static PyMethodDef _ConvNetMethods[] = {  { "initModel",          initModel,
                                               { "startMultiviewTest", startMultiviewTest, METH_VARARGS },
                                               { "startFeatureWriter",  startFeatureWriter,         METH_VARARGS },
                                               { "syncWithHost",       syncWithHost,       METH_VARARGS },
+                                              { "setStrictArrays",    setStrictArrays,    METH_VARARGS },
+                                              { "getArrayCopyStats",  getArrayCopyStats,  METH_VARARGS },
                                               { NULL, NULL }
 };
 
@@ -66,6 +69,32 @@ void INITNAME() {
 }
 #endif
 
+/*
+ * Hands the worker to the trainer thread. This blocks while the worker queue
+ * is full, so the GIL is released to let other Python threads run meanwhile.
+ */
+static void enqueueWorker(Worker* wr) {
+    Py_BEGIN_ALLOW_THREADS
+    model->getWorkerQueue().enqueue(wr);
+    Py_END_ALLOW_THREADS
+}
+
+/*
+ * Converts the arrays handed to a worker. Arrays that are not contiguous
+ * have to be copied; in strict mode they raise ValueError instead.
+ */
+static MatrixV* getWorkerMatrixV(PyListObject* pyList) {
+    if (strictArrays) {
+        for (int i = 0; i < PyList_GET_SIZE(pyList); i++) {
+            if (!Matrix::canAlias((PyArrayObject*)PyList_GET_ITEM(pyList, i))) {
+                PyErr_Format(PyExc_ValueError, "Array %d of %d is not contiguous and would have to be copied", i, (int)PyList_GET_SIZE(pyList));
+                return NULL;
+            }
+        }
+    }
+    return getMatrixV((PyObject*)pyList);
+}
+
 PyObject* initModel(PyObject *self, PyObject *args) {
     assert(model == NULL);
 
@@ -99,10 +128,14 @@ PyObject* startBatch(PyObject *self, PyObject *args) {
         &test)) {
         return NULL;
     }
-    MatrixV& mvec = *getMatrixV((PyObject*)data);
+    MatrixV* pmvec = getWorkerMatrixV(data);
+    if (pmvec == NULL) {
+        return NULL;
+    }
+    MatrixV& mvec = *pmvec;
     
     TrainingWorker* wr = new TrainingWorker(*model, *new CPUData(mvec), test);
-    model->getWorkerQueue().enqueue(wr);
+    enqueueWorker(wr);
     return Py_BuildValue("i", 0);
 }
 
@@ -119,10 +152,14 @@ PyObject* startMultiviewTest(PyObject *self, PyObject *args) {
         &logregIdx)) {
         return NULL;
     }
-    MatrixV& mvec = *getMatrixV((PyObject*)data);
+    MatrixV* pmvec = getWorkerMatrixV(data);
+    if (pmvec == NULL) {
+        return NULL;
+    }
+    MatrixV& mvec = *pmvec;
     
     MultiviewTestWorker* wr = new MultiviewTestWorker(*model, *new CPUData(mvec), numViews, logregIdx);
-    model->getWorkerQueue().enqueue(wr);
+    enqueueWorker(wr);
     return Py_BuildValue("i", 0);
 }
 
@@ -135,12 +172,25 @@ PyObject* startFeatureWriter(PyObject *self, PyObject *args) {
         &layerIdx)) {
         return NULL;
     }
-    MatrixV& mvec = *getMatrixV((PyObject*)data);
+    if (PyList_GET_SIZE(data) < 2) {
+        PyErr_SetString(PyExc_ValueError, "Expected the data arrays followed by the feature array");
+        return NULL;
+    }
+    // The features are written into the last array, so a copy of it would lose them
+    if (!Matrix::canAlias((PyArrayObject*)PyList_GET_ITEM(data, PyList_GET_SIZE(data) - 1))) {
+        PyErr_SetString(PyExc_ValueError, "Feature array is not contiguous");
+        return NULL;
+    }
+    MatrixV* pmvec = getWorkerMatrixV(data);
+    if (pmvec == NULL) {
+        return NULL;
+    }
+    MatrixV& mvec = *pmvec;
     Matrix& ftrs = *mvec.back();
     mvec.pop_back();
     
     FeatureWorker* wr = new FeatureWorker(*model, *new CPUData(mvec), ftrs, layerIdx);
-    model->getWorkerQueue().enqueue(wr);
+    enqueueWorker(wr);
     return Py_BuildValue("i", 0);
 }
 
@@ -177,7 +227,11 @@ PyObject* checkGradients(PyObject *self, PyObject *args) {
         &PyList_Type, &data)) {
         return NULL;
     }
-    MatrixV& mvec = *getMatrixV((PyObject*)data);
+    MatrixV* pmvec = getWorkerMatrixV(data);
+    if (pmvec == NULL) {
+        return NULL;
+    }
+    MatrixV& mvec = *pmvec;
     
     GradCheckWorker* wr = new GradCheckWorker(*model, *new CPUData(mvec));
     model->getWorkerQueue().enqueue(wr);
@@ -203,3 +257,22 @@ PyObject* syncWithHost(PyObject *self, PyObject *args) {
     return Py_BuildValue("i", 0);
 }
 
+/*
+ * In strict mode, the start* functions raise ValueError instead of copying
+ * arrays that are not contiguous.
+ */
+PyObject* setStrictArrays(PyObject *self, PyObject *args) {
+    int strict;
+    if (!PyArg_ParseTuple(args, "i", &strict)) {
+        return NULL;
+    }
+    strictArrays = strict;
+    return Py_BuildValue("i", 0);
+}
+
+/*
+ * Returns the number and total size in bytes of the arrays that had to be copied so far.
+ */
+PyObject* getArrayCopyStats(PyObject *self, PyObject *args) {
+    return Py_BuildValue("ll", Matrix::getNumArrayCopies(), Matrix::getNumArrayCopyBytes());
+}
@@ -30,6 +30,8 @@ from math import sqrt
 
 import gzip
 import zipfile
+import zlib
+from chunkfile import ChunkFileWriter, ChunkFileReader, ChunkFileError, CHUNK_MAGIC
 
 class UnpickleError(Exception):
     pass
@@ -38,12 +40,10 @@ VENDOR_ID_REGEX = re.compile('^vendor_id\s+: (\S+)')
 GPU_LOCK_NO_SCRIPT = -2
 GPU_LOCK_NO_LOCK = -1
 
-try:
-    import magic
-    ms = magic.open(magic.MAGIC_NONE)
-    ms.load()
-except ImportError: # no magic module
-    ms = None
+# Leading bytes of the file formats that unpickle understands
+GZIP_MAGIC = '\x1f\x8b'
+ZIP_MAGIC = 'PK\x03\x04'
+FORMAT_RAW, FORMAT_GZIP, FORMAT_ZIP, FORMAT_CHUNKED = 'raw', 'gzip', 'zip', 'chunked'
 
 def get_gpu_lock(id=-1):
     import imp
@@ -57,29 +57,53 @@ def get_gpu_lock(id=-1):
         return id if got_id else GPU_LOCK_NO_LOCK
     return GPU_LOCK_NO_SCRIPT if id < 0 else id
 
+# With compress=True, the pickle is written to a chunk file (see chunkfile.py),
+# whose blocks are compressed in parallel as they are pickled.
 def pickle(filename, data, compress=False):
     if compress:
-        fo = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
-        fo.writestr('data', cPickle.dumps(data, -1))
+        fo = ChunkFileWriter(filename)
     else:
         fo = open(filename, "wb")
-        cPickle.dump(data, fo, protocol=cPickle.HIGHEST_PROTOCOL)
+    cPickle.dump(data, fo, protocol=cPickle.HIGHEST_PROTOCOL)
     fo.close()
-    
+
+# Determines the format of a pickle file from its first few bytes
+def get_file_format(filename):
+    fo = open(filename, 'rb')
+    magic = fo.read(4)
+    fo.close()
+    if magic == CHUNK_MAGIC:
+        return FORMAT_CHUNKED
+    if magic.startswith(GZIP_MAGIC):
+        return FORMAT_GZIP
+    if magic == ZIP_MAGIC:
+        return FORMAT_ZIP
+    return FORMAT_RAW
+
 def unpickle(filename):
     if not os.path.exists(filename):
         raise UnpickleError("Path '%s' does not exist." % filename)
-    if ms is not None and ms.file(filename).startswith('gzip'):
-        fo = gzip.open(filename, 'rb')
-        dict = cPickle.load(fo)
-    elif ms is not None and ms.file(filename).startswith('Zip'):
-        fo = zipfile.ZipFile(filename, 'r', zipfile.ZIP_DEFLATED)
-        dict = cPickle.loads(fo.read('data'))
-    else:
-        fo = open(filename, 'rb')
-        dict = cPickle.load(fo)
-    
-    fo.close()
+    fmt = get_file_format(filename)
+    try:
+        fo = ChunkFileReader(filename) if fmt == FORMAT_CHUNKED else open(filename, 'rb')
+    except ChunkFileError, e:
+        raise UnpickleError(e)
+    try:
+        # Compressed files are unpickled straight from the decompressor
+        if fmt == FORMAT_GZIP:
+            stream = gzip.GzipFile(fileobj=fo, mode='rb')
+        elif fmt == FORMAT_ZIP: # Written by old versions of pickle(compress=True)
+            zf = zipfile.ZipFile(fo, 'r')
+            if 'data' not in zf.namelist():
+                raise UnpickleError("Zip file '%s' has no member named 'data'." % filename)
+            stream = zf.open('data')
+        else:
+            stream = fo
+        dict = cPickle.load(stream)
+    except (zipfile.BadZipfile, zlib.error, IOError, EOFError, cPickle.UnpicklingError), e:
+        raise UnpickleError("Unable to load '%s' (%s file): %s" % (filename, fmt, e))
+    finally:
+        fo.close()
     return dict
 
 def tryint(s):
@@ -0,0 +1,223 @@
+# Copyright (c) 2011, Alex Krizhevsky (akrizhevsky@gmail.com)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice,
+#   this list of conditions and the following disclaimer.
+# 
+# - Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+# NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE,
+# EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as n
+import os
+import sys
+from multiprocessing import Pool, cpu_count
+from getopt import GetoptError
+from util import pickle, unpickle, UnpickleError
+from options import *
+from data import DataProvider, BATCH_META_FILE
+from datastats import load_batch, write_meta, get_summarized_batches
+
+WHITENING_FILE = 'whitening.meta'
+WHITENING_KINDS = ('zca', 'pca')
+
+class WhiteningError(Exception):
+    pass
+
+# Streaming estimate of the mean and covariance of the columns of data
+# matrices. Keeps (count, mean, sum of outer products of deviations) in
+# float64, which merge exactly, so batches can be accumulated separately.
+class CovarianceAccumulator:
+    def __init__(self, num_dims):
+        self.num_dims = num_dims
+        self.count = 0
+        self.mean = n.zeros(num_dims, dtype=n.float64)
+        self.comoment = n.zeros((num_dims, num_dims), dtype=n.float64)
+        
+    def add(self, data):
+        acc = CovarianceAccumulator(self.num_dims)
+        acc.count = data.shape[1]
+        if acc.count > 0:
+            acc.mean = data.mean(axis=1, dtype=n.float64)
+            dev = n.float64(data) - acc.mean[:, n.newaxis]
+            acc.comoment = n.dot(dev, dev.T)
+        self.merge(acc)
+        
+    def merge(self, other):
+        if other.num_dims != self.num_dims:
+            raise WhiteningError("Can't merge covariances of %d and %d dimensions" % (self.num_dims, other.num_dims))
+        count = self.count + other.count
+        if other.count > 0:
+            delta = other.mean - self.mean
+            self.comoment += other.comoment + n.outer(delta, delta) * (float(self.count) * other.count / count)
+            self.mean += delta * (float(other.count) / count)
+        self.count = count
+    
+    def get_covariance(self):
+        if self.count < 2:
+            raise WhiteningError("Need at least 2 cases to estimate a covariance, got %d" % self.count)
+        return self.comoment / (self.count - 1)
+    
+# Fits a whitening transform x -> W (x - mean) to the accumulated data.
+#
+# PCA projects onto the num_components (default: all) principal components
+# and scales each to unit variance. ZCA additionally rotates back to the
+# original space, which keeps whitened images looking like images.
+# epsilon is added to the eigenvalues, so that low-variance directions
+# aren't blown up.
+def fit_whitening(acc, kind='zca', epsilon=0.1, num_components=0):
+    if kind not in WHITENING_KINDS:
+        raise WhiteningError("Unknown whitening kind: %s (known: %s)" % (kind, ", ".join(WHITENING_KINDS)))
+    evals, evecs = n.linalg.eigh(acc.get_covariance())
+    order = evals.argsort()[::-1]
+    evals, evecs = n.maximum(evals[order], 0), evecs[:, order]
+    if kind == 'pca' and num_components > 0:
+        evals, evecs = evals[:num_components], evecs[:, :num_components]
+    W = evecs.T / n.sqrt(evals + epsilon)[:, n.newaxis]
+    if kind == 'zca':
+        W = n.dot(evecs, W)
+    W = n.single(W)
+    mean = n.single(acc.mean.reshape((acc.num_dims, 1)))
+    return {'kind': kind, 'epsilon': epsilon, 'num_cases': acc.count,
+            'W': W, 'mean': mean, 'W_mean': n.dot(W, mean),
+            'explained_variance': evals.sum() / max(n.trace(acc.get_covariance()), 1e-30)}
+
+# Whitens data, a (dims, cases) matrix, in one matrix product. Writes the
+# result to target if given.
+def apply_whitening(transform, data, target=None):
+    out = n.dot(transform['W'], n.require(data, dtype=n.single), out=target)
+    out -= transform['W_mean']
+    return out
+
+def get_batch_covariance(args):
+    data_dir, batch_num = args
+    data = load_batch(data_dir, batch_num)['data']
+    acc = CovarianceAccumulator(data.shape[0])
+    acc.add(data)
+    return acc
+
+# Accumulates the covariance of the given batches in num_workers processes
+def accumulate_covariance(data_dir, batch_nums, num_workers=1):
+    acc = None
+    tasks = [(data_dir, b) for b in batch_nums]
+    pool = Pool(processes=num_workers) if num_workers > 1 else None
+    try:
+        for a in (pool.imap(get_batch_covariance, tasks) if pool else map(get_batch_covariance, tasks)):
+            if acc is None:
+                acc = a
+            else:
+                acc.merge(a)
+    finally:
+        if pool:
+            pool.terminate()
+    if acc is None:
+        raise WhiteningError("No batches to fit the whitening transform to")
+    return acc
+
+def get_whitening_file(data_dir):
+    return os.path.join(data_dir, WHITENING_FILE)
+
+# Returns the transform stored in data_dir, or None
+def load_whitening(data_dir):
+    path = get_whitening_file(data_dir)
+    return unpickle(path) if os.path.exists(path) else None
+
+def save_whitening(data_dir, transform):
+    tmp_path = get_whitening_file(data_dir) + '.%d.tmp' % os.getpid()
+    pickle(tmp_path, transform)
+    os.rename(tmp_path, get_whitening_file(data_dir))
+    
+# Returns the transform stored in data_dir if it was fit with the same
+# parameters and batches, and otherwise fits and stores a new one.
+def get_whitening(data_dir, batch_nums, kind='zca', epsilon=0.1, num_components=0, num_workers=1):
+    params = {'kind': kind, 'epsilon': epsilon, 'num_components': num_components, 'batch_nums': list(batch_nums)}
+    transform = load_whitening(data_dir)
+    if transform is not None and transform.get('params') == params:
+        return transform
+    transform = fit_whitening(accumulate_covariance(data_dir, batch_nums, num_workers), kind, epsilon, num_components)
+    transform['params'] = params
+    save_whitening(data_dir, transform)
+    return transform
+
+def whiten_batch(args):
+    data_dir, out_dir, batch_num = args
+    transform = load_whitening(data_dir)
+    dic = load_batch(data_dir, batch_num)
+    dic.pop('data_file', None)
+    dic['data'] = apply_whitening(transform, dic['data'])
+    pickle(os.path.join(out_dir, 'data_batch_%d' % batch_num), dic)
+    
+# Writes whitened copies of the given batches of data_dir to out_dir, with
+# the whitening transform of data_dir, so that it's applied only once
+def write_whitened_batches(data_dir, out_dir, batch_nums, num_workers=1):
+    transform = load_whitening(data_dir)
+    if transform is None:
+        raise WhiteningError("No whitening transform in %s" % data_dir)
+    if os.path.realpath(data_dir) == os.path.realpath(out_dir):
+        raise WhiteningError("Whitened batches must go to a different directory than %s" % data_dir)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    tasks = [(data_dir, out_dir, b) for b in batch_nums]
+    pool = Pool(processes=num_workers)
+    try:
+        pool.map(whiten_batch, tasks)
+    finally:
+        pool.terminate()
+    meta = unpickle(os.path.join(data_dir, BATCH_META_FILE))
+    meta.update({'num_vis': transform['W'].shape[0], 'data_mean': n.zeros((transform['W'].shape[0], 1), dtype=n.single),
+                 'whitened': transform['kind']})
+    if transform['kind'] == 'pca':
+        for k in ('img_size', 'num_colors', 'channel_mean', 'channel_std'): # no longer images
+            meta.pop(k, None)
+    write_meta(out_dir, meta)
+
+def get_options_parser():
+    op = OptionsParser()
+    op.add_option("data-path", "data_path", StringOptionParser, "Data directory")
+    op.add_option("batch-range", "batch_range", ListOptionParser(RangeOptionParser), "Batches to fit the transform to: the training batches (default: those batches.meta was computed on)", default=[])
+    op.add_option("kind", "kind", StringOptionParser, "Whitening transform: 'zca' or 'pca'", default='zca')
+    op.add_option("epsilon", "epsilon", FloatOptionParser, "Regularizer added to the eigenvalues", default=0.1)
+    op.add_option("components", "components", IntegerOptionParser, "Number of principal components to keep (PCA only; 0 for all)", default=0)
+    op.add_option("output-path", "output_path", StringOptionParser, "Also write whitened copies of all batches to this directory", default="")
+    op.add_option("workers", "workers", IntegerOptionParser, "Number of worker processes", default=cpu_count())
+    return op
+
+if __name__ == "__main__":
+    op = get_options_parser()
+    try:
+        op.parse()
+        data_path = op.get_value('data_path')
+        all_batches = DataProvider.get_batch_nums(data_path)
+        batch_nums = sum(op.get_value('batch_range'), []) or get_summarized_batches(data_path)
+        if not batch_nums:
+            raise OptionMissingException("Option --batch-range (the training batches) not supplied, and %s doesn't record the batches its statistics were computed on" % BATCH_META_FILE)
+        transform = get_whitening(data_path, batch_nums, op.get_value('kind'), op.get_value('epsilon'),
+                                  op.get_value('components'), op.get_value('workers'))
+        print "%s transform of %d dimensions to %d, fit to %d cases, keeps %.2f%% of the variance" % (transform['kind'].upper(), transform['W'].shape[1],
+                                                                                          transform['W'].shape[0], transform['num_cases'],
+                                                                                          100 * transform['explained_variance'])
+        print "Saved to %s" % get_whitening_file(data_path)
+        if op.get_value('output_path'):
+            write_whitened_batches(data_path, op.get_value('output_path'), all_batches, op.get_value('workers'))
+            print "Wrote whitened batches to %s" % op.get_value('output_path')
+    except OptionMissingException, e:
+        print e
+        op.print_usage()
+    except (OptionException, GetoptError, UnpickleError, WhiteningError, IOError, OSError), e:
+        print "----------------"
+        print "Error:"
+        print e